@@ -0,0 +1,23 @@
+# ---------------------------------------------------------------------------- #
+
+"""
+Gunicorn settings, loaded when gunicorn is run from this directory.
+"""
+
+# ---------------------------------------------------------------------------- #
+
+
+def post_worker_init(worker):
+
+    # connect to the database and the node before the worker takes traffic,
+    # without keeping it from starting if the node is down
+    from tuichain.api.services.blockchain import warm_up
+
+    try:
+        for (name, seconds) in warm_up():
+            worker.log.info("Warmed up %s in %.1f ms", name, seconds * 1000)
+    except Exception:
+        worker.log.exception("Warmup failed")
+
+
+# ---------------------------------------------------------------------------- #
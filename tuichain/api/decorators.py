@@ -0,0 +1,189 @@
+# ---------------------------------------------------------------------------- #
+
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+    quote_etag,
+)
+from django.utils.http import http_date
+
+from tuichain.api.enums import LoanState
+from tuichain.api.models import (
+    IndexedBlock,
+    Investment,
+    Loan,
+    LoanChainState,
+    SellPosition,
+    TableVersion,
+)
+from tuichain.api.services.blockchain import block_pinner
+
+# ---------------------------------------------------------------------------- #
+
+
+def _call_and_close_connections(view, request, *args, **kwargs):
+    try:
+        return view(request, *args, **kwargs)
+    finally:
+        # the executor's threads are not the ones Django closes connections of
+        # when the request finishes
+        connections.close_all()
+
+
+def async_view(view):
+    """
+    Make a native async variant of a read-only DRF view.
+
+    Under ASGI, Django runs all sync views one after the other on a single
+    thread. The returned view runs the wrapped one on the event loop's thread
+    pool instead, so that requests waiting on the chain or the database do not
+    hold up each other.
+
+    Must only be used for views that do not write to the database, as each
+    call runs outside of the request's thread and transaction.
+
+    Parameters
+    ----------
+    view : callable
+
+        The view, as returned by ``@api_view``.
+
+    Returns
+    -------
+    callable
+        The async view.
+    """
+
+    call = sync_to_async(_call_and_close_connections, thread_sensitive=False)
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await call(view, request, *args, **kwargs)
+
+    return wrapper
+
+
+# ---------------------------------------------------------------------------- #
+
+
+def _get_versions(models):
+    """
+    Get the ETag and last modification time of the data read by a view.
+
+    The last modification time is None if the data includes chain state read
+    straight from the chain, whose changes the tables' versions do not track.
+    """
+
+    if settings.ETHEREUM_INDEXER_ENABLED:
+        reads_chain = (
+            Loan in models
+            and Loan.objects.filter(
+                state=LoanState.APPROVED.value, chain_state=None
+            ).exists()
+        )
+        models = [
+            *models,
+            IndexedBlock,
+            LoanChainState,
+            SellPosition,
+            Investment,
+        ]
+    else:
+        reads_chain = True
+
+    # reads are pinned to this block, so the response will match the tag;
+    # with the indexer, this is only the case for loans it has not seen yet
+    block_number = block_pinner.get_block_number() if reads_chain else None
+
+    tables = sorted(model._meta.db_table for model in models)
+
+    versions = {}
+    last_modified = None
+
+    for table, version, updated_at in TableVersion.objects.filter(
+        table__in=tables
+    ).values_list("table", "version", "updated_at"):
+        versions[table] = version
+        last_modified = max(last_modified or updated_at, updated_at)
+
+    etag = "-".join(str(versions.get(t, 0)) for t in tables)
+
+    if block_number is not None:
+        etag = f"{block_number}-{etag}"
+        last_modified = None
+
+    return (quote_etag(etag), last_modified)
+
+
+def conditional_view(*models, cacheable=False):
+    """
+    Answer conditional GET requests to a DRF view with 304 Not Modified while
+    the data it reads is unchanged, without running the view.
+
+    The ETag is derived from the versions of the tables of the given models,
+    which are bumped whenever one of their rows is saved or deleted, and from
+    the latest indexed block, and from the latest block if the view may read
+    from the chain, which is when the indexer is disabled or has not seen
+    every approved loan yet. Last-Modified is only sent when the ETag does not
+    include the latest block, as a time cannot tell chain changes apart.
+
+    Must be applied below ``@api_view`` and ``@permission_classes``, so that
+    requests are authenticated first.
+
+    Parameters
+    ----------
+    *models : django.db.models.Model
+
+        The models whose tables the view reads.
+
+    cacheable : bool
+
+        Whether responses are the same for every user, and may thus be reused
+        by the client for HTTP_CACHE_MAX_AGE seconds without revalidating.
+        Other responses must be revalidated on every use. Either way,
+        responses are private to the user that authenticated the request, and
+        must not be stored by shared caches.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+
+            etag, last_modified = _get_versions(models)
+            last_modified = last_modified and last_modified.timestamp()
+
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified
+            )
+
+            if response is None:
+                response = view(request, *args, **kwargs)
+
+                if response.status_code == 200:
+                    response["ETag"] = etag
+                    if last_modified:
+                        response["Last-Modified"] = http_date(last_modified)
+
+            if cacheable:
+                patch_cache_control(
+                    response, private=True, max_age=settings.HTTP_CACHE_MAX_AGE
+                )
+            else:
+                patch_cache_control(response, private=True, no_cache=True)
+
+            patch_vary_headers(response, ["Authorization"])
+
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+# ---------------------------------------------------------------------------- #
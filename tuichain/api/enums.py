@@ -21,3 +21,22 @@ class LoanState(Enum):
 
     def __str__(self):
         return self.name
+
+
+class JobState(Enum):
+    """Possible States of a Job."""
+
+    PENDING = 0
+    """Waiting to be run by a worker, possibly after a failed attempt."""
+
+    RUNNING = 1
+    """Being run by a worker."""
+
+    SUCCEEDED = 2
+    """Its transaction has been mined."""
+
+    FAILED = 3
+    """All attempts failed."""
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,404 @@
+# ---------------------------------------------------------------------------- #
+
+"""
+Server-Sent Events stream of the market events recorded by the indexer.
+
+Django 3.1 cannot stream responses from async views, so the stream is served
+by a plain ASGI application mounted in front of Django by ``tuichain.asgi``,
+at ``/api/market/events/``. A single poller per process reads new market
+events and hands them to the open streams, instead of each stream polling the
+database or holding a thread. Streams resuming from an earlier event first
+catch up by querying the events they missed themselves.
+
+Clients authenticate with their token, either in the ``Authorization`` header
+or, since ``EventSource`` cannot set headers, in the ``token`` query
+parameter. The ``loans`` query parameter optionally restricts the stream to a
+comma-separated list of loan IDs. Clients resume where they left off through
+the ``Last-Event-ID`` header, which browsers send when reconnecting, or the
+``last_event_id`` query parameter.
+
+Each event is sent as::
+
+    id: <event id>
+    event: <phase | funded_value | price | sell_position_created | ...>
+    data: {"loan": ..., "identifier": ..., "block_number": ..., ...}
+"""
+
+# ---------------------------------------------------------------------------- #
+
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from rest_framework.authtoken.models import Token
+
+from tuichain.api.models import MarketEvent
+
+# ---------------------------------------------------------------------------- #
+
+PATH = "/api/market/events/"
+
+HEARTBEAT_INTERVAL = 15
+"""Seconds after which an idle stream sends a comment to keep it open."""
+
+MAX_EVENTS_PER_POLL = 500
+
+MAX_QUEUED_EVENTS = 1000
+"""
+Number of events a stream may fall behind the poller before it is left to
+catch up by itself, so that slow clients do not hold events in memory.
+"""
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------- #
+
+
+def _run_and_close_connections(function, *args):
+    try:
+        return function(*args)
+    finally:
+        connections.close_all()
+
+
+def _database(function):
+    call = sync_to_async(_run_and_close_connections, thread_sensitive=False)
+    return lambda *args: call(function, *args)
+
+
+@_database
+def _authenticate(key):
+    return Token.objects.filter(key=key, user__is_active=True).exists()
+
+
+@_database
+def _get_last_event_id():
+    event = MarketEvent.objects.order_by("-id").only("id").first()
+    return 0 if event is None else event.id
+
+
+def _query_events(after_id, loan_ids, until_id=None):
+
+    events = MarketEvent.objects.filter(id__gt=after_id).order_by("id")
+
+    if until_id is not None:
+        events = events.filter(id__lte=until_id)
+
+    if loan_ids is not None:
+        events = events.filter(loan_id__in=loan_ids)
+
+    return list(events[:MAX_EVENTS_PER_POLL])
+
+
+_get_events = _database(_query_events)
+
+
+def _format_event(event):
+
+    data = {
+        "loan": event.loan_id,
+        "identifier": event.identifier,
+        "block_number": event.block_number,
+        **json.loads(event.data),
+    }
+
+    return (
+        f"id: {event.id}\nevent: {event.kind}\ndata: {json.dumps(data)}\n\n"
+    ).encode()
+
+
+# ---------------------------------------------------------------------------- #
+
+
+class _Subscription:
+
+    __slots__ = ("loan_ids", "start_id", "events", "overflowed", "wakeup")
+
+    def __init__(self, loan_ids, start_id):
+        self.loan_ids = loan_ids
+        self.start_id = start_id
+        self.events = []
+        self.overflowed = False
+        self.wakeup = asyncio.Event()
+
+
+class _Poller:
+    """
+    Polls the market events table on behalf of all open streams of the
+    process, while there is at least one.
+
+    Each subscription gets the IDs and formatted bodies of the events that
+    follow its ``start_id`` and match its loan IDs. Events are handed out in
+    the same step that moves the poller past them, so subscribing never misses
+    or repeats one.
+    """
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._last_event_id = None
+        self._task = None
+        self._executor = None
+
+    async def subscribe(self, loan_ids):
+
+        if self._task is None or self._task.done():
+            last_event_id = await _get_last_event_id()
+            if self._task is None or self._task.done():
+                self._last_event_id = last_event_id
+                self._task = asyncio.ensure_future(self._run())
+
+        subscription = _Subscription(loan_ids, self._last_event_id)
+        self._subscriptions.add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._subscriptions.discard(subscription)
+
+    def resume(self, subscription):
+        """
+        Start handing events to a subscription that overflowed again, from
+        the current position of the poller.
+        """
+
+        subscription.start_id = self._last_event_id
+        subscription.events = []
+        subscription.overflowed = False
+
+    async def _run(self):
+
+        while self._subscriptions:
+
+            try:
+                events = await asyncio.get_event_loop().run_in_executor(
+                    self._get_executor(), self._poll
+                )
+            except Exception:
+                logger.exception("Failed to poll market events")
+                events = []
+
+            if events:
+                self._last_event_id = events[-1].id
+                self._dispatch(events)
+
+            if len(events) < MAX_EVENTS_PER_POLL:
+                await asyncio.sleep(settings.MARKET_EVENTS_POLL_INTERVAL)
+
+    def _get_executor(self):
+
+        # a thread of its own, which keeps its database connection open
+        # between polls
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="tuichain-market-events"
+            )
+
+        return self._executor
+
+    def _poll(self):
+
+        try:
+            return _query_events(self._last_event_id, None)
+        except Exception:
+            connections.close_all()
+            raise
+
+    def _dispatch(self, events):
+
+        formatted = [(e.id, e.loan_id, _format_event(e)) for e in events]
+
+        for subscription in self._subscriptions:
+
+            if subscription.overflowed:
+                continue
+
+            matching = [
+                (event_id, body)
+                for (event_id, loan_id, body) in formatted
+                if event_id > subscription.start_id
+                and (
+                    subscription.loan_ids is None
+                    or loan_id in subscription.loan_ids
+                )
+            ]
+
+            if not matching:
+                continue
+
+            subscription.events.extend(matching)
+
+            if len(subscription.events) > MAX_QUEUED_EVENTS:
+                subscription.events = []
+                subscription.overflowed = True
+
+            subscription.wakeup.set()
+
+
+_poller = _Poller()
+
+
+# ---------------------------------------------------------------------------- #
+
+
+async def _send_error(send, status, message):
+
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json")],
+        }
+    )
+    await send(
+        {
+            "type": "http.response.body",
+            "body": json.dumps({"message": message}).encode(),
+        }
+    )
+
+
+async def _wait_for_disconnect(receive):
+
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def market_events(scope, receive, send):
+    """
+    ASGI application streaming market events.
+
+    Answers 401 if the token is missing or invalid, and 400 if the loan IDs
+    or the last event ID are not integers.
+    """
+
+    headers = dict(scope["headers"])
+    query = {
+        k: v[-1] for k, v in parse_qs(scope["query_string"].decode()).items()
+    }
+
+    if scope["method"] != "GET":
+        await _send_error(send, 405, "Method not allowed")
+        return
+
+    key = headers.get(b"authorization", b"").decode().partition("Token ")[2]
+
+    if not await _authenticate(key.strip() or query.get("token", "")):
+        await _send_error(send, 401, "Invalid token")
+        return
+
+    try:
+        loan_ids = query.get("loans")
+        if loan_ids is not None:
+            loan_ids = {int(i) for i in loan_ids.split(",")}
+
+        last_event_id = headers.get(b"last-event-id", b"").decode()
+        last_event_id = last_event_id or query.get("last_event_id")
+        if last_event_id is not None:
+            last_event_id = int(last_event_id)
+
+    except ValueError:
+        await _send_error(send, 400, "Invalid loan IDs or last event ID")
+        return
+
+    subscription = await _poller.subscribe(loan_ids)
+
+    # the client may have seen events the poller has not got to yet
+    if last_event_id is not None:
+        subscription.start_id = max(subscription.start_id, last_event_id)
+
+    try:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    (b"access-control-allow-origin", b"*"),
+                    (b"x-accel-buffering", b"no"),  # unbuffered behind nginx
+                ],
+            }
+        )
+        await _send_body(send, b": ok\n\n")
+
+        if last_event_id is None:
+            last_event_id = subscription.start_id
+        else:
+            last_event_id = await _catch_up(send, last_event_id, subscription)
+
+        await _stream(send, receive, last_event_id, subscription)
+
+    finally:
+        _poller.unsubscribe(subscription)
+
+
+async def _send_body(send, body):
+
+    await send({"type": "http.response.body", "body": body, "more_body": True})
+
+
+async def _catch_up(send, last_event_id, subscription):
+    """
+    Send the events from the given one up to where the poller started handing
+    them to the subscription, and return the ID of the last event sent.
+    """
+
+    while last_event_id < subscription.start_id:
+
+        events = await _get_events(
+            last_event_id, subscription.loan_ids, subscription.start_id
+        )
+
+        if not events:
+            break
+
+        await _send_body(send, b"".join(map(_format_event, events)))
+        last_event_id = events[-1].id
+
+    return max(last_event_id, subscription.start_id)
+
+
+async def _stream(send, receive, last_event_id, subscription):
+
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+
+    try:
+        while not disconnected.done():
+
+            if subscription.overflowed:
+                _poller.resume(subscription)
+                last_event_id = await _catch_up(
+                    send, last_event_id, subscription
+                )
+
+            if subscription.events:
+                events, subscription.events = subscription.events, []
+                await _send_body(send, b"".join(body for (_, body) in events))
+                last_event_id = events[-1][0]
+                continue
+
+            subscription.wakeup.clear()
+            wakeup = asyncio.ensure_future(subscription.wakeup.wait())
+
+            await asyncio.wait(
+                [disconnected, wakeup],
+                timeout=HEARTBEAT_INTERVAL,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+
+            if not wakeup.done() and not disconnected.done():
+                await _send_body(send, b": heartbeat\n\n")
+
+            wakeup.cancel()
+
+    finally:
+        disconnected.cancel()
+
+
+# ---------------------------------------------------------------------------- #
@@ -0,0 +1,59 @@
+# ---------------------------------------------------------------------------- #
+
+from django.core.management.base import BaseCommand
+from tuichain_ethereum import LoanIdentifier
+
+from tuichain.api.enums import LoanState
+from tuichain.api.models import Loan
+from tuichain.api.services.blockchain import controller
+
+# ---------------------------------------------------------------------------- #
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Store the immutable on-chain attributes of loans created before they"
+        " were recorded on creation."
+    )
+
+    def handle(self, *args, **options):
+
+        loans = Loan.objects.filter(
+            state=LoanState.APPROVED.value, token_contract_address=None
+        ).exclude(identifier=None)
+
+        count = 0
+
+        for loan in loans:
+
+            fetched_loan = controller.loans.get_by_identifier(
+                LoanIdentifier(loan.identifier)
+            )
+
+            loan.token_contract_address = str(
+                fetched_loan.token_contract_address
+            )
+            loan.funding_fee_atto_dai_per_dai = str(
+                fetched_loan.funding_fee_atto_dai_per_dai
+            )
+            loan.payment_fee_atto_dai_per_dai = str(
+                fetched_loan.payment_fee_atto_dai_per_dai
+            )
+            loan.expiration_time = fetched_loan.expiration_time
+
+            loan.save(
+                update_fields=[
+                    "token_contract_address",
+                    "funding_fee_atto_dai_per_dai",
+                    "payment_fee_atto_dai_per_dai",
+                    "expiration_time",
+                ]
+            )
+
+            count += 1
+
+        self.stdout.write(f"Backfilled {count} loans")
+
+
+# ---------------------------------------------------------------------------- #
@@ -0,0 +1,270 @@
+# ---------------------------------------------------------------------------- #
+
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, models, transaction
+
+from tuichain.api.enums import LoanState
+from tuichain.api.models import Document, Loan
+
+# ---------------------------------------------------------------------------- #
+
+BATCH_SIZE = 10_000
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Measure the hot loan and document queries with and without their "
+        "indexes, on rows seeded in the configured database and rolled back "
+        "afterwards."
+    )
+
+    def add_arguments(self, parser):
+
+        parser.add_argument(
+            "--loans",
+            type=int,
+            default=1_000_000,
+            help="Number of loans to seed.",
+        )
+
+        parser.add_argument(
+            "--documents",
+            type=int,
+            default=1_000_000,
+            help="Number of documents to seed.",
+        )
+
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=20,
+            help="Number of times each query is run.",
+        )
+
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+
+        rng = random.Random(options["seed"])
+
+        # everything, including dropping and recreating the indexes, happens
+        # in a transaction that is rolled back, which SQLite and PostgreSQL
+        # both allow
+        try:
+            with transaction.atomic():
+                self._run(rng, options)
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _run(self, rng, options):
+
+        start = time.perf_counter()
+        student_ids = self._seed(rng, options["loans"], options["documents"])
+        self.stdout.write(
+            f"Seeded {options['loans']} loans and {options['documents']} "
+            f"documents on {connection.vendor} in "
+            f"{time.perf_counter() - start:.1f} s"
+        )
+
+        queries = _get_queries(rng.choice(student_ids))
+
+        # the indexes of the loans and documents, and the foreign key indexes
+        # replaced by 0011_hot_filter_indexes
+
+        editor = connection.schema_editor()
+
+        new_indexes = [(Loan, i) for i in Loan._meta.indexes] + [
+            (Document, i) for i in Document._meta.indexes
+        ]
+
+        old_indexes = [
+            (Loan, models.Index(fields=["student"], name="benchmark_student")),
+            (Document, models.Index(fields=["loan"], name="benchmark_loan")),
+        ]
+
+        for model, index in new_indexes:
+            editor.remove_index(model, index)
+        for model, index in old_indexes:
+            editor.add_index(model, index)
+
+        before = self._measure(queries, options["repeat"])
+
+        for model, index in old_indexes:
+            editor.remove_index(model, index)
+        for model, index in new_indexes:
+            editor.add_index(model, index)
+
+        after = self._measure(queries, options["repeat"])
+
+        for name in queries:
+            self.stdout.write("")
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for label, (plan, seconds) in [
+                ("Before", before[name]),
+                ("After", after[name]),
+            ]:
+                self.stdout.write(f"  {label}: {seconds * 1e3:.3f} ms")
+                for line in plan.splitlines():
+                    self.stdout.write(f"    {line}")
+
+    def _seed(self, rng, loan_count, document_count):
+
+        first_user_id = (
+            User.objects.order_by("-id").values_list("id", flat=True).first()
+            or 0
+        ) + 1
+
+        # a handful of loans per student, as each has at most one ongoing
+        student_count = max(1, loan_count // 5)
+
+        _bulk_create(
+            User,
+            (
+                User(
+                    id=first_user_id + i,
+                    username=f"benchmark{first_user_id + i}",
+                )
+                for i in range(student_count)
+            ),
+        )
+
+        student_ids = list(range(first_user_id, first_user_id + student_count))
+
+        # most loans are past review, as in a long-running deployment
+        states = [s.value for s in LoanState]
+        weights = [
+            {
+                LoanState.PENDING: 2,
+                LoanState.APPROVED: 60,
+                LoanState.WITHDRAWN: 10,
+                LoanState.REJECTED: 10,
+            }.get(s, 1)
+            for s in LoanState
+        ]
+
+        first_loan_id = (
+            Loan.objects.order_by("-id").values_list("id", flat=True).first()
+            or 0
+        ) + 1
+
+        def loans():
+            for i in range(loan_count):
+                state = rng.choices(states, weights)[0]
+                value = rng.randrange(10 ** 21)
+                yield Loan(
+                    id=first_loan_id + i,
+                    student_id=rng.choice(student_ids),
+                    school="school",
+                    course="course",
+                    destination="destination",
+                    requested_value_atto_dai=value,
+                    exact_requested_value_atto_dai=str(value),
+                    description="description",
+                    state=state,
+                    recipient_address="0x" + "ab" * 20,
+                    identifier=(
+                        f"0x{first_loan_id + i:040x}"
+                        if state == LoanState.APPROVED.value
+                        else None
+                    ),
+                )
+
+        _bulk_create(Loan, loans())
+
+        # and so are most documents
+        def documents():
+            for _ in range(document_count):
+                outcome = rng.random()
+                yield Document(
+                    loan_id=first_loan_id + rng.randrange(loan_count),
+                    is_public=rng.random() < 0.5,
+                    approved=outcome < 0.8,
+                    rejected=0.8 <= outcome < 0.98,
+                    name="document",
+                    url="url",
+                )
+
+        if loan_count:
+            _bulk_create(Document, documents())
+
+        return student_ids
+
+    def _measure(self, queries, repeat):
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+        result = {}
+
+        for name, queryset in queries.items():
+
+            plan = queryset.explain()
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                list(queryset.all())
+            seconds = (time.perf_counter() - start) / max(1, repeat)
+
+            result[name] = (plan, seconds)
+
+        return result
+
+
+def _get_queries(student_id):
+
+    # as issued by the views, see tuichain.api.views.loans
+    return {
+        "Ongoing loans of a student (create_loan)": Loan.objects.filter(
+            student_id=student_id
+        )
+        .exclude(state=LoanState.WITHDRAWN.value)
+        .exclude(state=LoanState.REJECTED.value),
+        "Loans of a student (get_personal_loans)": Loan.objects.filter(
+            student_id=student_id
+        ),
+        "Page of pending loans (get_specific_state_loans)": Loan.objects.filter(
+            state=LoanState.PENDING.value
+        ).order_by("id")[:100],
+        "Page of loans by requested value (get_all_loans)": (
+            Loan.objects.filter(
+                requested_value_atto_dai__gte=10 ** 20
+            ).order_by("-requested_value_atto_dai", "-id")[:100]
+        ),
+        "Loan by identifier (indexer)": Loan.objects.filter(
+            identifier=f"0x{1:040x}"
+        ),
+        "Unevaluated documents of a loan (get_loan_unevaluated_docs)": (
+            Document.objects.filter(loan_id=1, approved=False, rejected=False)
+        ),
+        "Page of unevaluated documents (get_all_unevaluated_documents)": (
+            Document.objects.filter(approved=False, rejected=False).order_by(
+                "id"
+            )[:100]
+        ),
+    }
+
+
+def _bulk_create(model, objects):
+
+    batch = []
+
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) == BATCH_SIZE:
+            model.objects.bulk_create(batch)
+            batch = []
+
+    model.objects.bulk_create(batch)
+
+
+# ---------------------------------------------------------------------------- #
@@ -0,0 +1,119 @@
+# ---------------------------------------------------------------------------- #
+
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from tuichain.api.services.market import OrderBook
+
+# ---------------------------------------------------------------------------- #
+
+
+def _sorted_median(positions):
+    """The weighted median as computed for one-off reads, for comparison."""
+
+    sorted_positions = sorted(positions.values())
+    total = sum(amount for (_, amount) in sorted_positions)
+
+    counter = 0
+    for price, amount in sorted_positions:
+        counter += amount
+        if counter > total // 2:
+            return price
+
+
+class Command(BaseCommand):
+
+    help = "Measure the cost of keeping the current price of a loan's token."
+
+    def add_arguments(self, parser):
+
+        parser.add_argument(
+            "--positions",
+            type=int,
+            default=10000,
+            help="Number of sell positions in the book.",
+        )
+
+        parser.add_argument(
+            "--updates",
+            type=int,
+            default=10000,
+            help="Number of position changes to apply.",
+        )
+
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+
+        rng = random.Random(options["seed"])
+
+        def random_position():
+            return (
+                rng.randrange(10 ** 17, 2 * 10 ** 18, 10 ** 14),
+                rng.randrange(1, 10 ** 4),
+            )
+
+        positions = {
+            f"seller{i}": random_position() for i in range(options["positions"])
+        }
+
+        updates = [
+            (f"seller{rng.randrange(len(positions) * 2)}", random_position())
+            for _ in range(options["updates"])
+        ]
+
+        # build
+
+        start = time.perf_counter()
+
+        order_book = OrderBook()
+        for seller, (price, amount) in positions.items():
+            order_book.set_position(seller, price, amount)
+
+        build_time = time.perf_counter() - start
+
+        # incremental updates, reading the median after each one
+
+        start = time.perf_counter()
+
+        for seller, (price, amount) in updates:
+            if amount % 5 == 0:
+                order_book.remove_position(seller)
+            else:
+                order_book.set_position(seller, price, amount)
+            order_book.median_price_atto_dai_per_token
+
+        update_time = time.perf_counter() - start
+
+        # sorting all positions on every read, as one-off reads do
+
+        sample = updates[: max(1, min(len(updates), 100))]
+
+        start = time.perf_counter()
+
+        for seller, (price, amount) in sample:
+            if amount % 5 == 0:
+                positions.pop(seller, None)
+            else:
+                positions[seller] = (price, amount)
+            _sorted_median(positions)
+
+        sort_time = (time.perf_counter() - start) / len(sample)
+
+        if order_book.median_price_atto_dai_per_token != _sorted_median(
+            {s: order_book.get_position(s) for s in order_book.get_sellers()}
+        ):
+            self.stderr.write("Order book median does not match the sort")
+
+        self.stdout.write(f"Positions:            {len(order_book)}")
+        self.stdout.write(f"Build:                {build_time * 1e3:.1f} ms")
+        self.stdout.write(
+            f"Update and read:      "
+            f"{update_time / max(1, len(updates)) * 1e6:.1f} us"
+        )
+        self.stdout.write(f"Sort and walk read:   {sort_time * 1e6:.1f} us")
+
+
+# ---------------------------------------------------------------------------- #
@@ -0,0 +1,44 @@
+# ---------------------------------------------------------------------------- #
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from tuichain.api.services import indexer
+
+# ---------------------------------------------------------------------------- #
+
+
+class Command(BaseCommand):
+
+    help = "Mirror the on-chain state of loans into the database."
+
+    def add_arguments(self, parser):
+
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Index up to the current block and exit.",
+        )
+
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=5,
+            help="Seconds to wait between checks for new blocks.",
+        )
+
+    def handle(self, *args, **options):
+
+        while True:
+
+            block_number = indexer.sync()
+            self.stdout.write(f"Indexed up to block {block_number}")
+
+            if options["once"]:
+                break
+
+            time.sleep(options["poll_interval"])
+
+
+# ---------------------------------------------------------------------------- #
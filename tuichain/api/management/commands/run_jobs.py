@@ -0,0 +1,58 @@
+# ---------------------------------------------------------------------------- #
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tuichain.api.services import jobs
+
+# ---------------------------------------------------------------------------- #
+
+
+class Command(BaseCommand):
+
+    help = "Run the queued on-chain writes."
+
+    def add_arguments(self, parser):
+
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Run the jobs that are due and exit.",
+        )
+
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1,
+            help="Seconds to wait between checks for new jobs.",
+        )
+
+    def handle(self, *args, **options):
+
+        # nonces are handed out per process, see tuichain.api.services.nonces
+        if settings.JOBS_RUN_IN_PROCESS:
+            raise CommandError(
+                "Jobs are run by the web server, as JOBS_RUN_IN_PROCESS is set"
+            )
+
+        while True:
+
+            requeued = jobs.reconcile()
+
+            if requeued:
+                self.stdout.write(f"Requeued {requeued} stale jobs")
+
+            count = jobs.run_due()
+
+            if count:
+                self.stdout.write(f"Ran {count} jobs")
+
+            if options["once"]:
+                break
+
+            time.sleep(options["poll_interval"])
+
+
+# ---------------------------------------------------------------------------- #
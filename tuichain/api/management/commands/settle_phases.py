@@ -0,0 +1,50 @@
+# ---------------------------------------------------------------------------- #
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from tuichain.api.services import loans
+from tuichain.api.services.providers import block_scope
+
+# ---------------------------------------------------------------------------- #
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Periodically record the phase of the funding loans, which investors "
+        "fund without the backend taking part."
+    )
+
+    def add_arguments(self, parser):
+
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Record the phases once and exit.",
+        )
+
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=60,
+            help="Seconds to wait between runs.",
+        )
+
+    def handle(self, *args, **options):
+
+        while True:
+
+            with block_scope():
+                count = loans.settle_phases()
+
+            self.stdout.write(f"Recorded {count} phase changes")
+
+            if options["once"]:
+                break
+
+            time.sleep(options["interval"])
+
+
+# ---------------------------------------------------------------------------- #
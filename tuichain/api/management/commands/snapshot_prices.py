@@ -0,0 +1,47 @@
+# ---------------------------------------------------------------------------- #
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from tuichain.api.services import price_history
+from tuichain.api.services.providers import block_scope
+
+# ---------------------------------------------------------------------------- #
+
+
+class Command(BaseCommand):
+
+    help = "Periodically record the market price of every active loan."
+
+    def add_arguments(self, parser):
+
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Record a single snapshot and exit.",
+        )
+
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=300,
+            help="Seconds to wait between snapshots.",
+        )
+
+    def handle(self, *args, **options):
+
+        while True:
+
+            with block_scope():
+                count = price_history.record_snapshots()
+
+            self.stdout.write(f"Recorded {count} price snapshots")
+
+            if options["once"]:
+                break
+
+            time.sleep(options["interval"])
+
+
+# ---------------------------------------------------------------------------- #
@@ -0,0 +1,28 @@
+# ---------------------------------------------------------------------------- #
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tuichain.api.services.blockchain import warm_up
+
+# ---------------------------------------------------------------------------- #
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Connect to the database and the Ethereum node and read the contract"
+        " metadata, failing if any of them is unavailable."
+    )
+
+    def handle(self, *args, **options):
+
+        try:
+            timings = warm_up()
+        except Exception as e:
+            raise CommandError(f"Warmup failed: {type(e).__name__}: {e}")
+
+        for (name, seconds) in timings:
+            self.stdout.write(f"{name}: {seconds * 1000:.1f} ms")
+
+
+# ---------------------------------------------------------------------------- #
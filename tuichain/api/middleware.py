@@ -0,0 +1,40 @@
+# ---------------------------------------------------------------------------- #
+
+import asyncio
+
+from tuichain.api.services.providers import block_scope
+
+# ---------------------------------------------------------------------------- #
+
+
+class BlockScopeMiddleware:
+    """
+    Pin all chain reads of a request to the same block.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+
+        self.get_response = get_response
+
+        if asyncio.iscoroutinefunction(get_response):
+            # lets Django tell that this instance is async
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        with block_scope():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+
+        with block_scope():
+            return await self.get_response(request)
+
+
+# ---------------------------------------------------------------------------- #
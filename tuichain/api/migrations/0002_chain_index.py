@@ -0,0 +1,122 @@
+# Generated by Django 3.1.5 on 2026-10-18 19:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IndexedBlock",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("number", models.IntegerField(unique=True)),
+                ("hash", models.CharField(max_length=66)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="LoanChainState",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("identifier", models.CharField(max_length=42, unique=True)),
+                ("token_contract_address", models.CharField(max_length=42)),
+                ("phase", models.CharField(max_length=20)),
+                ("funded_value_atto_dai", models.CharField(max_length=40)),
+                (
+                    "redemption_value_atto_dai_per_token",
+                    models.CharField(blank=True, max_length=40, null=True),
+                ),
+                (
+                    "current_value_atto_dai",
+                    models.CharField(blank=True, max_length=40, null=True),
+                ),
+                ("block_number", models.IntegerField()),
+                (
+                    "loan",
+                    models.OneToOneField(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="chain_state",
+                        to="api.loan",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="TokenHolding",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("holder_address", models.CharField(max_length=42)),
+                ("amount_tokens", models.CharField(max_length=40)),
+                (
+                    "loan_state",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="holdings",
+                        to="api.loanchainstate",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("loan_state", "holder_address")},
+            },
+        ),
+        migrations.CreateModel(
+            name="SellPosition",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("seller_address", models.CharField(max_length=42)),
+                ("amount_tokens", models.CharField(max_length=40)),
+                ("price_atto_dai_per_token", models.CharField(max_length=40)),
+                (
+                    "loan_state",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="sell_positions",
+                        to="api.loanchainstate",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("loan_state", "seller_address")},
+            },
+        ),
+    ]
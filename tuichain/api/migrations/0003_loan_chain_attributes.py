@@ -0,0 +1,33 @@
+# Generated by Django 3.1.5 on 2026-10-18 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0002_chain_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="loan",
+            name="expiration_time",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="loan",
+            name="funding_fee_atto_dai_per_dai",
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name="loan",
+            name="payment_fee_atto_dai_per_dai",
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name="loan",
+            name="token_contract_address",
+            field=models.CharField(blank=True, max_length=42, null=True),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.1.5 on 2026-10-18 19:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0003_loan_chain_attributes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LoanPriceSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("time", models.DateTimeField()),
+                (
+                    "current_value_atto_dai",
+                    models.CharField(blank=True, max_length=40, null=True),
+                ),
+                ("funded_value_atto_dai", models.CharField(max_length=40)),
+                ("sell_positions", models.IntegerField()),
+                ("amount_tokens_for_sale", models.CharField(max_length=40)),
+                (
+                    "loan",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="price_snapshots",
+                        to="api.loan",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="loanpricesnapshot",
+            index=models.Index(
+                fields=["loan", "time"], name="api_loanpri_loan_id_3c5331_idx"
+            ),
+        ),
+    ]
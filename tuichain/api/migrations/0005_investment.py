@@ -0,0 +1,69 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_sell_positions(apps, schema_editor):
+    Investment = apps.get_model("api", "Investment")
+    SellPosition = apps.get_model("api", "SellPosition")
+
+    for sp in SellPosition.objects.all():
+        Investment.objects.update_or_create(
+            investor_address=sp.seller_address,
+            loan_state_id=sp.loan_state_id,
+            defaults={
+                "sell_amount_tokens": sp.amount_tokens,
+                "sell_price_atto_dai_per_token": sp.price_atto_dai_per_token,
+            },
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0004_loan_price_snapshot"),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name="tokenholding",
+            unique_together=set(),
+        ),
+        migrations.RenameModel(
+            old_name="TokenHolding",
+            new_name="Investment",
+        ),
+        migrations.RenameField(
+            model_name="investment",
+            old_name="holder_address",
+            new_name="investor_address",
+        ),
+        migrations.AlterField(
+            model_name="investment",
+            name="loan_state",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="investments",
+                to="api.loanchainstate",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="investment",
+            name="amount_tokens",
+            field=models.CharField(default="0", max_length=40),
+        ),
+        migrations.AddField(
+            model_name="investment",
+            name="sell_amount_tokens",
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name="investment",
+            name="sell_price_atto_dai_per_token",
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name="investment",
+            unique_together={("investor_address", "loan_state")},
+        ),
+        migrations.RunPython(copy_sell_positions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.1.5 on 2026-10-18 19:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0005_investment"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="loan",
+            name="identifier",
+            field=models.CharField(
+                blank=True, max_length=42, null=True, unique=True
+            ),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.1.5 on 2026-10-18 19:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0007_table_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MarketEvent",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("block_number", models.IntegerField()),
+                ("identifier", models.CharField(max_length=42)),
+                ("kind", models.CharField(max_length=30)),
+                ("data", models.TextField()),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, db_index=True),
+                ),
+                (
+                    "loan",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="api.loan",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.1.5 on 2026-10-18 20:19
+
+from django.db import migrations, models
+
+
+def copy_indexed_phases(apps, schema_editor):
+    LoanChainState = apps.get_model("api", "LoanChainState")
+    Loan = apps.get_model("api", "Loan")
+
+    for loan_state in LoanChainState.objects.exclude(loan=None):
+        Loan.objects.filter(id=loan_state.loan_id).update(
+            phase=loan_state.phase
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0009_job"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="loan",
+            name="phase",
+            field=models.CharField(
+                blank=True, db_index=True, max_length=20, null=True
+            ),
+        ),
+        migrations.RunPython(copy_indexed_phases, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.1.5 on 2026-10-18 20:29
+
+from django.db import migrations, models
+
+
+def check_requested_values(apps, schema_editor):
+    Loan = apps.get_model("api", "Loan")
+
+    invalid = []
+
+    for loan in Loan.objects.only("requested_value_atto_dai"):
+        value = loan.requested_value_atto_dai.strip()
+        if value.isascii() and value.isdigit():
+            if value != loan.requested_value_atto_dai:
+                loan.requested_value_atto_dai = value
+                loan.save(update_fields=["requested_value_atto_dai"])
+        else:
+            invalid.append(loan.id)
+
+    # the requests were stored as sent, unchecked
+    if invalid:
+        raise ValueError(
+            "Loans whose requested value is not a whole number of atto-Dai "
+            f"must be fixed before migrating: {invalid}"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0011_hot_filter_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(check_requested_values, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="loan",
+            name="requested_value_atto_dai",
+            field=models.DecimalField(decimal_places=0, max_digits=40),
+        ),
+        migrations.AddIndex(
+            model_name="loan",
+            index=models.Index(
+                fields=["requested_value_atto_dai", "id"],
+                name="api_loan_value_id_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.5 on 2026-10-18 20:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0012_numeric_requested_value"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="job",
+            name="heartbeat_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="job",
+            name="worker",
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.5 on 2026-10-18 20:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0013_job_heartbeat"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="indexedblock",
+            name="holders",
+            field=models.TextField(default="[]"),
+        ),
+        migrations.AddField(
+            model_name="indexedblock",
+            name="loans",
+            field=models.TextField(default="[]"),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.1.5 on 2026-10-18 23:10
+
+from django.db import migrations, models
+
+
+def copy_requested_values(apps, schema_editor):
+    Loan = apps.get_model("api", "Loan")
+
+    # exact on PostgreSQL; SQLite has already rounded values past 15 digits
+    for loan in Loan.objects.only("requested_value_atto_dai"):
+        loan.exact_requested_value_atto_dai = str(
+            int(loan.requested_value_atto_dai)
+        )
+        loan.save(update_fields=["exact_requested_value_atto_dai"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0014_indexed_block_changes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="loan",
+            name="exact_requested_value_atto_dai",
+            field=models.CharField(default="", max_length=40),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_requested_values, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.5 on 2026-10-18 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0015_exact_requested_value"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="job",
+            name="transaction_hash",
+            field=models.CharField(blank=True, max_length=66, null=True),
+        ),
+    ]
@@ -1,10 +1,12 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
 from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
-from tuichain.api.enums import LoanState
+from tuichain.api.enums import JobState, LoanState
 
 
 class Profile(models.Model):
@@ -64,30 +66,84 @@ class IDVerifications(models.Model):
 
 class Loan(models.Model):
     id = models.AutoField(primary_key=True)
-    student = models.ForeignKey(User, on_delete=models.CASCADE)
+    # indexed by api_loan_student_state_idx
+    student = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     request_date = models.DateTimeField(auto_now_add=True)
     school = models.CharField(max_length=100)
     course = models.CharField(max_length=100)
     destination = models.CharField(max_length=100)
-    requested_value_atto_dai = models.CharField(max_length=40)
+    # compared, sorted and summed by the database, but only to 15 significant
+    # digits on SQLite, which keeps decimals as floating-point numbers
+    requested_value_atto_dai = models.DecimalField(
+        max_digits=40, decimal_places=0
+    )
+    # the requested value, exactly, set from the above when the loan is created
+    exact_requested_value_atto_dai = models.CharField(max_length=40)
     description = models.CharField(max_length=5000)
     state = models.IntegerField(default=LoanState.PENDING.value)
     recipient_address = models.CharField(max_length=42)
-    identifier = models.CharField(max_length=42, null=True, blank=True)
+    identifier = models.CharField(
+        max_length=42, null=True, blank=True, unique=True
+    )
+
+    # immutable on-chain attributes, stored when the loan is created
+    token_contract_address = models.CharField(
+        max_length=42, null=True, blank=True
+    )
+    funding_fee_atto_dai_per_dai = models.CharField(
+        max_length=40, null=True, blank=True
+    )
+    payment_fee_atto_dai_per_dai = models.CharField(
+        max_length=40, null=True, blank=True
+    )
+    expiration_time = models.DateTimeField(null=True, blank=True)
+
+    # last known on-chain phase, recorded by the jobs and the indexer, see
+    # tuichain.api.services.loans.filter_by_phase
+    phase = models.CharField(
+        max_length=20, null=True, blank=True, db_index=True
+    )
+
+    class Meta:
+        indexes = [
+            # a student's loans, by state
+            models.Index(
+                fields=["student", "state"], name="api_loan_student_state_idx"
+            ),
+            # loans at a given state, in page order
+            models.Index(fields=["state", "id"], name="api_loan_state_id_idx"),
+            # loans by requested value, in page order
+            models.Index(
+                fields=["requested_value_atto_dai", "id"],
+                name="api_loan_value_id_idx",
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        # before the database gets to round it
+        if self._state.adding and not self.exact_requested_value_atto_dai:
+            self.exact_requested_value_atto_dai = str(
+                int(self.requested_value_atto_dai)
+            )
+        super().save(*args, **kwargs)
 
     def to_dict(self):
         return {
             "id": self.id,
-            "student": self.student.id,
+            "student": self.student_id,
             "request_date": self.request_date,
             "school": self.school,
             "course": self.course,
             "destination": self.destination,
-            "requested_value_atto_dai": self.requested_value_atto_dai,
+            "requested_value_atto_dai": self.exact_requested_value_atto_dai,
             "description": self.description,
             "state": str(LoanState(self.state)),
             "recipient_address": self.recipient_address,
             "identifier": self.identifier,
+            "token_contract_address": self.token_contract_address,
+            "funding_fee_atto_dai_per_dai": self.funding_fee_atto_dai_per_dai,
+            "payment_fee_atto_dai_per_dai": self.payment_fee_atto_dai_per_dai,
+            "expiration_time": self.expiration_time,
         }
 
 
@@ -98,7 +154,24 @@ class Document(models.Model):
     rejected = models.BooleanField(default=False)
     name = models.CharField(max_length=100)
     url = models.CharField(max_length=1000)
-    loan = models.ForeignKey(Loan, on_delete=models.CASCADE)
+    # indexed by api_document_loan_review_idx
+    loan = models.ForeignKey(Loan, on_delete=models.CASCADE, db_index=False)
+
+    class Meta:
+        indexes = [
+            # a loan's documents, by review outcome
+            models.Index(
+                fields=["loan", "approved", "rejected"],
+                name="api_document_loan_review_idx",
+            ),
+            # the review queue, in page order, which only ever holds a small
+            # fraction of the documents
+            models.Index(
+                fields=["id"],
+                condition=models.Q(approved=False, rejected=False),
+                name="api_document_unevaluated_idx",
+            ),
+        ]
 
     def to_dict(self):
         return {
@@ -112,6 +185,188 @@ class Document(models.Model):
         }
 
 
+# JOBS (run by the run_jobs management command)
+
+
+class Job(models.Model):
+    """
+    An on-chain write on a loan, queued by a request and run by a worker.
+    """
+
+    kind = models.CharField(max_length=30)
+    loan = models.ForeignKey(
+        Loan, on_delete=models.CASCADE, related_name="jobs"
+    )
+    arguments = models.TextField(default="{}")  # JSON
+    state = models.IntegerField(default=JobState.PENDING.value, db_index=True)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    # the process running the job, which keeps heartbeat_at recent while it
+    # is alive, see tuichain.api.services.jobs.reconcile
+    worker = models.CharField(max_length=100, null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    # the last transaction sent by the job, recorded before it is mined
+    transaction_hash = models.CharField(max_length=66, null=True, blank=True)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "loan": self.loan_id,
+            "state": str(JobState(self.state)),
+            "attempts": self.attempts,
+            "error": self.error,
+            "created_at": self.created_at,
+            "run_after": self.run_after,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "transaction_hash": self.transaction_hash,
+        }
+
+
+# ON-CHAIN INDEX (maintained by the run_indexer management command)
+
+
+class IndexedBlock(models.Model):
+    """
+    The last block of a range indexed by the indexer, along with the loans and
+    token holders whose state changed in the range, to be read again if the
+    range is reorganized.
+    """
+
+    number = models.IntegerField(unique=True)
+    hash = models.CharField(max_length=66)
+    loans = models.TextField(default="[]")  # JSON
+    holders = models.TextField(default="[]")  # JSON
+
+
+class LoanChainState(models.Model):
+    loan = models.OneToOneField(
+        Loan,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="chain_state",
+    )
+    identifier = models.CharField(max_length=42, unique=True)
+    token_contract_address = models.CharField(max_length=42)
+    phase = models.CharField(max_length=20)
+    funded_value_atto_dai = models.CharField(max_length=40)
+    redemption_value_atto_dai_per_token = models.CharField(
+        max_length=40, null=True, blank=True
+    )
+    current_value_atto_dai = models.CharField(
+        max_length=40, null=True, blank=True
+    )
+    block_number = models.IntegerField()
+
+    def get_token_balance_of(self, address):
+        investment = self.investments.filter(
+            investor_address=str(address)
+        ).first()
+        return 0 if investment is None else int(investment.amount_tokens)
+
+    def get_sell_positions(self):
+        return self.sell_positions.all()
+
+    def get_sell_position_of(self, address):
+        return self.sell_positions.filter(seller_address=str(address)).first()
+
+
+class SellPosition(models.Model):
+    loan_state = models.ForeignKey(
+        LoanChainState, on_delete=models.CASCADE, related_name="sell_positions"
+    )
+    seller_address = models.CharField(max_length=42)
+    amount_tokens = models.CharField(max_length=40)
+    price_atto_dai_per_token = models.CharField(max_length=40)
+
+    class Meta:
+        unique_together = [["loan_state", "seller_address"]]
+
+
+class Investment(models.Model):
+    """
+    The tokens of a loan held by an address, either in its wallet or for sale
+    in a sell position.
+    """
+
+    investor_address = models.CharField(max_length=42)
+    loan_state = models.ForeignKey(
+        LoanChainState, on_delete=models.CASCADE, related_name="investments"
+    )
+    amount_tokens = models.CharField(max_length=40, default="0")
+    sell_amount_tokens = models.CharField(max_length=40, null=True, blank=True)
+    sell_price_atto_dai_per_token = models.CharField(
+        max_length=40, null=True, blank=True
+    )
+
+    class Meta:
+        unique_together = [["investor_address", "loan_state"]]
+
+
+class MarketEvent(models.Model):
+    """
+    A change seen by the indexer, streamed to clients by the market events
+    endpoint.
+    """
+
+    block_number = models.IntegerField()
+    loan = models.ForeignKey(
+        Loan, on_delete=models.CASCADE, null=True, blank=True, related_name="+"
+    )
+    identifier = models.CharField(max_length=42)
+    kind = models.CharField(max_length=30)
+    data = models.TextField()  # JSON
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+# PRICE HISTORY (recorded by the snapshot_prices management command)
+
+
+class LoanPriceSnapshot(models.Model):
+    loan = models.ForeignKey(
+        Loan, on_delete=models.CASCADE, related_name="price_snapshots"
+    )
+    time = models.DateTimeField()
+    current_value_atto_dai = models.CharField(
+        max_length=40, null=True, blank=True
+    )
+    funded_value_atto_dai = models.CharField(max_length=40)
+    sell_positions = models.IntegerField()
+    amount_tokens_for_sale = models.CharField(max_length=40)
+
+    class Meta:
+        indexes = [models.Index(fields=["loan", "time"])]
+
+
+# TABLE VERSIONS (bumped on every save and delete, used to compute ETags)
+
+
+class TableVersion(models.Model):
+    table = models.CharField(max_length=100, unique=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def bump(cls, model):
+
+        table = model._meta.db_table
+
+        updated = cls.objects.filter(table=table).update(
+            version=F("version") + 1, updated_at=timezone.now()
+        )
+
+        if not updated:
+            cls.objects.get_or_create(table=table, defaults={"version": 1})
+
+
 # SIGNALS
 
 # Create Auth token automatically when a User is created
@@ -133,3 +388,22 @@ def create_user_profile_idverification(sender, instance, created, **kwargs):
 def save_user_profile_idverification(sender, instance, **kwargs):
     instance.profile.save()
     instance.id_verification.save()
+
+
+# Bump the version of a table whenever one of its rows changes
+def bump_table_version(sender, **kwargs):
+    TableVersion.bump(sender)
+
+
+for model in [
+    User,
+    Profile,
+    Loan,
+    Document,
+    IndexedBlock,
+    LoanChainState,
+    SellPosition,
+    Investment,
+]:
+    post_save.connect(bump_table_version, sender=model)
+    post_delete.connect(bump_table_version, sender=model)
@@ -0,0 +1,167 @@
+# ---------------------------------------------------------------------------- #
+
+"""
+Keyset pagination for the list endpoints.
+
+Items are ordered by a unique key, or by several keys that are unique
+together, and the cursor of a page holds the keys of the last item of the
+previous one. Fetching a page is thus a single indexed
+range query however far into the list it is, and items added or removed
+between requests do not shift the pages.
+
+Clients pass the ``cursor`` query parameter, taken from the ``next`` link of
+the previous page, and optionally ``page_size``, which defaults to the
+API_PAGE_SIZE setting and is capped to MAX_PAGE_SIZE.
+"""
+
+# ---------------------------------------------------------------------------- #
+
+import base64
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param
+
+# ---------------------------------------------------------------------------- #
+
+MAX_PAGE_SIZE = 1000
+
+# ---------------------------------------------------------------------------- #
+
+
+class Page:
+    def __init__(self, items, next_link):
+        self.items = items
+        self.next_link = next_link
+
+
+def paginate(request, items, key):
+    """
+    Get the page of items requested.
+
+    Parameters
+    ----------
+    request : rest_framework.request.Request
+
+        The request, whose ``cursor`` and ``page_size`` query parameters select
+        the page.
+
+    items : django.db.models.QuerySet or list
+
+        All the items.
+
+    key : str or tuple
+
+        The field or attribute of the items to order them by, which must be
+        unique, or several of them, which must be unique together. Each may be
+        prefixed with "-" to order by it in descending order.
+
+    Returns
+    -------
+    Page
+        The page's items, and the link to the next page, or None if it is the
+        last one.
+    """
+
+    keys = (key,) if isinstance(key, str) else tuple(key)
+
+    page_size = _get_page_size(request)
+    after = _decode_cursor(request.query_params.get("cursor"), len(keys))
+
+    try:
+        if isinstance(items, QuerySet):
+            items = items.order_by(*keys)
+            if after is not None:
+                items = items.filter(_get_after_condition(keys, after))
+            items = list(items[: page_size + 1])
+        else:
+            items = [
+                i for i in items if after is None or _is_after(i, keys, after)
+            ]
+            for k in reversed(keys):
+                items.sort(
+                    key=lambda i: getattr(i, k.lstrip("-")),
+                    reverse=k.startswith("-"),
+                )
+            items = items[: page_size + 1]
+    except (TypeError, ValueError, ValidationError):
+        # a cursor of another endpoint
+        raise NotFound("Invalid cursor")
+
+    if len(items) <= page_size:
+        return Page(items, None)
+
+    items = items[:page_size]
+
+    next_link = replace_query_param(
+        request.build_absolute_uri(),
+        "cursor",
+        _encode_cursor([getattr(items[-1], k.lstrip("-")) for k in keys]),
+    )
+
+    return Page(items, next_link)
+
+
+def _get_after_condition(keys, after):
+
+    # (a, b) > (x, y) is a > x or (a = x and b > y), and so on
+    condition = Q()
+    equal = Q()
+
+    for k, value in zip(keys, after):
+        field = k.lstrip("-")
+        lookup = "lt" if k.startswith("-") else "gt"
+        condition |= equal & Q(**{f"{field}__{lookup}": value})
+        equal &= Q(**{field: value})
+
+    return condition
+
+
+def _is_after(item, keys, after):
+
+    for k, value in zip(keys, after):
+        item_value = getattr(item, k.lstrip("-"))
+        if item_value != value:
+            return (item_value < value) == k.startswith("-")
+
+    return False
+
+
+def _get_page_size(request):
+
+    try:
+        page_size = int(request.query_params["page_size"])
+    except (KeyError, ValueError):
+        return settings.API_PAGE_SIZE
+
+    return max(1, min(page_size, MAX_PAGE_SIZE))
+
+
+def _encode_cursor(values):
+
+    # decimals are encoded as strings, which their fields parse back
+    data = json.dumps(values, default=str)
+
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def _decode_cursor(cursor, count):
+
+    if cursor is None:
+        return None
+
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise NotFound("Invalid cursor")
+
+    if not isinstance(values, list) or len(values) != count:
+        raise NotFound("Invalid cursor")
+
+    return values
+
+
+# ---------------------------------------------------------------------------- #
@@ -1,6 +1,25 @@
+# ---------------------------------------------------------------------------- #
+
+"""
+Model serializers, and bulk variants of the models' ``to_dict()``.
+
+Calling ``to_dict()`` on each row of a listing fetches the related rows it
+reads one query at a time. These functions load them up front instead, with
+``select_related()`` for querysets, or with one query per relation for rows
+that were already fetched, such as the items of a page, so that serializing
+any number of rows takes a fixed number of queries. They return the same
+dicts.
+"""
+
+# ---------------------------------------------------------------------------- #
+
+from django.db.models import QuerySet, prefetch_related_objects
 from rest_framework import serializers
+
 from tuichain.api.models import Investment, Loan
 
+# ---------------------------------------------------------------------------- #
+
 
 class LoanSerializer(serializers.ModelSerializer):
     class Meta:
@@ -12,3 +31,65 @@ class InvestmentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Investment
         fields = "__all__"
+
+
+# ---------------------------------------------------------------------------- #
+
+
+def serialize_documents(documents):
+    """
+    Serialize documents as ``Document.to_dict()`` does.
+
+    Parameters
+    ----------
+    documents : django.db.models.QuerySet or list
+
+        The documents.
+
+    Returns
+    -------
+    list
+        The documents' dicts.
+    """
+
+    return [doc.to_dict() for doc in _load_related(documents, "loan")]
+
+
+def serialize_profiles(users, private=False):
+    """
+    Serialize the profiles of users as ``Profile.to_dict()`` does.
+
+    Parameters
+    ----------
+    users : django.db.models.QuerySet or list
+
+        The users.
+
+    private : bool
+
+        Whether to include the private fields of the profiles.
+
+    Returns
+    -------
+    list
+        The profiles' dicts.
+    """
+
+    return [
+        user.profile.to_dict(private=private)
+        for user in _load_related(users, "profile")
+    ]
+
+
+def _load_related(rows, *fields):
+
+    if isinstance(rows, QuerySet):
+        return list(rows.select_related(*fields))
+
+    rows = list(rows)
+    prefetch_related_objects(rows, *fields)
+
+    return rows
+
+
+# ---------------------------------------------------------------------------- #
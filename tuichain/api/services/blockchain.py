@@ -1,8 +1,121 @@
+import threading
+import time
+
 from django.conf import settings
+from django.db import connections
+from django.utils.functional import SimpleLazyObject
 from tuichain_ethereum import Controller
+from web3 import EthereumTesterProvider, Web3
+from tuichain.api.services.providers import (
+    BatchingProvider,
+    BlockPinningProvider,
+    CachingProvider,
+    ProviderPool,
+    SerializingProvider,
+)
+from tuichain.api.services.nonces import NonceManagingProvider
+
+# the test chain does not support concurrent requests, which jobs send
+rpc_providers = [
+    SerializingProvider(p) if isinstance(p, EthereumTesterProvider) else p
+    for p in settings.ETHEREUM_PROVIDERS
+]
+
+if len(rpc_providers) > 1:
+    rpc_pool = ProviderPool(
+        rpc_providers,
+        probe_interval=settings.ETHEREUM_PROBE_INTERVAL,
+        hedge_percentile=settings.ETHEREUM_HEDGE_PERCENTILE,
+    )
+else:
+    rpc_pool = None
+
+rpc_batcher = BatchingProvider(
+    rpc_pool or rpc_providers[0],
+    enabled=settings.ETHEREUM_BATCH_REQUESTS,
+)
+
+if settings.ETHEREUM_CACHE_MAX_ENTRIES > 0:
+    rpc_cache = CachingProvider(
+        rpc_batcher, max_entries=settings.ETHEREUM_CACHE_MAX_ENTRIES
+    )
+else:
+    rpc_cache = None
 
-controller = Controller(
-    provider=settings.ETHEREUM_PROVIDER,
-    master_account_private_key=settings.ETHEREUM_MASTER_ACCOUNT_PRIVATE_KEY,
-    contract_address=settings.ETHEREUM_CONTROLLER_ADDRESS,
+nonce_manager = NonceManagingProvider(
+    rpc_cache or rpc_batcher,
+    private_key=settings.ETHEREUM_MASTER_ACCOUNT_PRIVATE_KEY,
 )
+
+block_pinner = BlockPinningProvider(nonce_manager)
+provider = block_pinner
+
+web3 = Web3(provider)
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller():
+    """
+    Get the controller, connecting to the node on the first call.
+    """
+
+    global _controller
+
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = Controller(
+                    provider=provider,
+                    master_account_private_key=(
+                        settings.ETHEREUM_MASTER_ACCOUNT_PRIVATE_KEY
+                    ),
+                    contract_address=settings.ETHEREUM_CONTROLLER_ADDRESS,
+                )
+
+    return _controller
+
+
+# this module is imported by every view, so connecting to the node when it is
+# imported would make every management command, even migrate, depend on it
+controller = SimpleLazyObject(get_controller)
+
+
+def warm_up():
+    """
+    Connect to the database and the node and build the controller, so that the
+    first requests served by the process do not have to, and check that the
+    contracts answer.
+
+    Chain reads are only cached for the block a request is pinned to, which is
+    soon superseded, so no loans are read ahead of time.
+
+    Returns
+    -------
+    list
+        The names of the steps taken and the seconds each took.
+    """
+
+    steps = [
+        ("database", connections["default"].ensure_connection),
+        ("node", lambda: web3.eth.blockNumber),
+        ("controller", get_controller),
+        (
+            "contract metadata",
+            lambda: (
+                controller.chain_id,
+                controller.dai_contract_address,
+                controller.market.get_fee_atto_dai_per_nano_dai(),
+            ),
+        ),
+    ]
+
+    timings = []
+
+    for (name, step) in steps:
+        start = time.perf_counter()
+        step()
+        timings.append((name, time.perf_counter() - start))
+
+    return timings
@@ -0,0 +1,89 @@
+# ---------------------------------------------------------------------------- #
+
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from contextvars import copy_context
+import threading
+
+from django.conf import settings
+from django.db import connections
+
+# ---------------------------------------------------------------------------- #
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.ETHEREUM_MAX_CONCURRENCY,
+                thread_name_prefix="tuichain-chain",
+            )
+
+    return _executor
+
+
+def _run_task(function, item):
+    try:
+        return function(item)
+    finally:
+        # pool threads outlive requests, so do not keep connections open
+        connections.close_all()
+
+
+def fan_out(function, items):
+    """
+    Apply a function to every item concurrently, on a bounded thread pool.
+
+    The number of items being processed at once, across all requests, is
+    limited by the ETHEREUM_MAX_CONCURRENCY setting. Calls run in a copy of
+    the caller's context, so they share its block scope.
+
+    Must not be called from a function that is itself being fanned out.
+
+    Parameters
+    ----------
+    function : callable
+
+        The function to apply.
+
+    items : iterable
+
+        The items to apply it to.
+
+    Returns
+    -------
+    list
+        The results, in the same order as the items. As soon as a call raises,
+        the calls that have not started yet are canceled and the exception is
+        re-raised.
+    """
+
+    items = list(items)
+
+    if len(items) < 2 or settings.ETHEREUM_MAX_CONCURRENCY < 2:
+        return [function(item) for item in items]
+
+    executor = _get_executor()
+
+    futures = [
+        executor.submit(copy_context().run, _run_task, function, item)
+        for item in items
+    ]
+
+    done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+
+    for future in futures:
+        if future in done and future.exception() is not None:
+            for f in not_done:
+                f.cancel()
+            raise future.exception()
+
+    return [future.result() for future in futures]
+
+
+# ---------------------------------------------------------------------------- #
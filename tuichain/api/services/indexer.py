@@ -0,0 +1,566 @@
+# ---------------------------------------------------------------------------- #
+
+"""
+Mirrors the on-chain state of loans into the database.
+
+Every sync indexes the blocks up to the head of the chain at once. It picks
+up newly created loans, refreshes the phase, funded value and sell positions
+of every loan that can still change, and replays the ERC-20 ``Transfer`` logs
+emitted by the loan tokens since the last sync, requested MAX_BLOCK_RANGE
+blocks at a time, to find out whose balances must be refreshed. All of it is
+read from the chain at the head block first, and then written to the tables
+in one short transaction, so that the tables are not locked while waiting on
+the node. Balances and sell positions are also kept together per investor
+and loan, for the investments endpoints, and every change to a loan's phase,
+funded value, price or sell positions is recorded as a market event, for the
+market events stream.
+
+The hash of the last block of each sync is recorded so that chain
+reorganizations can be detected, along with the loans and token holders whose
+state changed since the previous one. When one happens the affected ranges are indexed
+again, and those loans and holders are read again too, since the changes seen
+in the orphaned blocks may not have happened on the canonical chain.
+"""
+
+# ---------------------------------------------------------------------------- #
+
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from tuichain_ethereum import Address, LoanIdentifier, LoanPhase
+from web3 import Web3
+from web3.exceptions import BlockNotFound
+
+from tuichain.api.models import (
+    IndexedBlock,
+    Investment,
+    Loan,
+    LoanChainState,
+    MarketEvent,
+    SellPosition,
+    TableVersion,
+)
+from tuichain.api.services.blockchain import controller, rpc_batcher, web3
+from tuichain.api.services.market import OrderBook, get_current_price
+from tuichain.api.services.providers import block_scope
+
+# ---------------------------------------------------------------------------- #
+
+logger = logging.getLogger(__name__)
+
+TRANSFER_EVENT_TOPIC = Web3.keccak(
+    text="Transfer(address,address,uint256)"
+).hex()
+
+ZERO_ADDRESS = "0x" + "0" * 40
+
+MAX_BLOCK_RANGE = 500
+"""Maximum number of blocks whose logs are requested at once."""
+
+MAX_REORG_DEPTH = 64
+"""Number of syncs whose last block is kept around to detect
+reorganizations."""
+
+MARKET_EVENT_RETENTION = timedelta(days=1)
+"""How long market events are kept around for clients to catch up on."""
+
+_TERMINAL_PHASES = frozenset(
+    phase.name for phase in [LoanPhase.CANCELED, LoanPhase.EXPIRED]
+)
+"""Phases after which nothing but token balances changes."""
+
+_MARKET_PHASES = frozenset(
+    phase.name for phase in [LoanPhase.ACTIVE, LoanPhase.FINALIZED]
+)
+
+_order_books = {}
+"""Order books of the loans that can still change, by loan identifier."""
+
+# ---------------------------------------------------------------------------- #
+
+
+def sync():
+    """
+    Index every block up to the current head of the chain.
+
+    Returns
+    -------
+    int
+        The number of the last indexed block.
+    """
+
+    head = web3.eth.blockNumber
+    last = _rewind_reorganized_blocks()
+
+    if last is None:
+        last = settings.ETHEREUM_INDEXER_START_BLOCK - 1
+
+    if last < head:
+        try:
+            _index_range(last + 1, head)
+        except Exception:
+            # the order books may no longer match the rolled back tables
+            _order_books.clear()
+            raise
+
+    return max(last, head)
+
+
+def _rewind_reorganized_blocks():
+    """
+    Find the last indexed block that is still part of the canonical chain.
+
+    The blocks after it are left for ``_index_range()`` to replace, which reads
+    again what changed in them.
+
+    Returns the number of the last block that is still valid, or None if the
+    chain must be indexed from the start.
+    """
+
+    indexed_blocks = IndexedBlock.objects.order_by("-number")
+
+    for block in indexed_blocks:
+
+        try:
+            canonical_hash = web3.eth.get_block(block.number)["hash"].hex()
+        except BlockNotFound:
+            canonical_hash = None
+
+        if canonical_hash == block.hash:
+            return block.number
+
+        logger.warning("Block %d was reorganized", block.number)
+
+    return None
+
+
+def _index_range(start, end):
+
+    # the blocks being replaced, if the chain was reorganized
+    reindexed_loans = set()
+    reindexed_holders = set()
+
+    for block in IndexedBlock.objects.filter(number__gte=start):
+        reindexed_loans.update(json.loads(block.loans))
+        reindexed_holders.update(map(tuple, json.loads(block.holders)))
+
+    with block_scope(end):
+        block_hash = web3.eth.get_block(end)["hash"].hex()
+        fetched_loans = _fetch_loans(reindexed_loans)
+        balances = _fetch_token_balances(
+            start, end, fetched_loans, reindexed_holders
+        )
+
+    with transaction.atomic():
+
+        IndexedBlock.objects.filter(number__gte=start).delete()
+
+        events = []
+
+        _index_loans(end, fetched_loans, events)
+        _index_token_holders(balances)
+
+        # loans created in this range were only linked after their events
+        loan_ids = dict(
+            LoanChainState.objects.filter(
+                identifier__in={
+                    e.identifier for e in events if e.loan_id is None
+                }
+            ).values_list("identifier", "loan_id")
+        )
+
+        for event in events:
+            event.loan_id = event.loan_id or loan_ids.get(event.identifier)
+
+        MarketEvent.objects.bulk_create(events)
+        MarketEvent.objects.filter(
+            created_at__lt=timezone.now() - MARKET_EVENT_RETENTION
+        ).delete()
+
+        IndexedBlock.objects.create(
+            number=end,
+            hash=block_hash,
+            loans=json.dumps(sorted({e.identifier for e in events})),
+            holders=json.dumps(sorted(balances)),
+        )
+
+        stale = IndexedBlock.objects.order_by("-number").values_list(
+            "number", flat=True
+        )[MAX_REORG_DEPTH : MAX_REORG_DEPTH + 1]
+
+        if stale:
+            IndexedBlock.objects.filter(number__lte=stale[0]).delete()
+
+    logger.info("Indexed blocks %d to %d", start, end)
+
+
+# ---------------------------------------------------------------------------- #
+
+
+class _FetchedLoan:
+    """
+    A loan's state and sell positions, as read from the chain, or only its
+    identifier if it is settled.
+    """
+
+    __slots__ = (
+        "identifier",
+        "token_contract_address",
+        "state",
+        "sell_positions",
+    )
+
+    def __init__(self, fetched_loan, reindexed, settled):
+
+        self.identifier = str(fetched_loan.identifier)
+        self.token_contract_address = None
+        self.state = None
+        self.sell_positions = None
+
+        if self.identifier in settled and self.identifier not in reindexed:
+            return
+
+        self.token_contract_address = str(fetched_loan.token_contract_address)
+        self.state = fetched_loan.get_state()
+
+        if self.state.phase.name in _MARKET_PHASES:
+            self.sell_positions = list(
+                controller.market.get_sell_positions_by_loan(fetched_loan)
+            )
+        else:
+            self.sell_positions = []
+
+
+def _fetch_loans(reindexed):
+    """
+    Read the state and sell positions of every loan that can still change, or
+    that changed in reorganized blocks. Other loans are listed without them.
+    """
+
+    settled = set(
+        LoanChainState.objects.filter(phase__in=_TERMINAL_PHASES).values_list(
+            "identifier", flat=True
+        )
+    )
+
+    return rpc_batcher.map(
+        lambda fetched_loan: _FetchedLoan(fetched_loan, reindexed, settled),
+        controller.loans.get_all(),
+    )
+
+
+def _index_loans(block_number, fetched_loans, events):
+
+    known_states = {s.identifier: s for s in LoanChainState.objects.all()}
+
+    for fetched_loan in fetched_loans:
+
+        if fetched_loan.state is None:
+            continue
+
+        identifier = fetched_loan.identifier
+        state = fetched_loan.state
+        sell_positions = fetched_loan.sell_positions
+
+        loan_state = known_states.get(identifier) or LoanChainState(
+            identifier=identifier,
+            token_contract_address=fetched_loan.token_contract_address,
+        )
+
+        order_book = _update_order_book(loan_state, sell_positions)
+
+        previous = (
+            loan_state.phase,
+            loan_state.funded_value_atto_dai,
+            loan_state.current_value_atto_dai,
+        )
+
+        loan_state.phase = state.phase.name
+        loan_state.funded_value_atto_dai = str(state.funded_value_atto_dai)
+        loan_state.current_value_atto_dai = get_current_price(state, order_book)
+        loan_state.block_number = block_number
+
+        if state.phase == LoanPhase.FINALIZED:
+            loan_state.redemption_value_atto_dai_per_token = str(
+                state.redemption_value_atto_dai_per_token
+            )
+
+        loan_state.save()
+
+        if loan_state.phase != previous[0]:
+            _add_event(events, loan_state, "phase", phase=loan_state.phase)
+
+        if loan_state.funded_value_atto_dai != previous[1]:
+            _add_event(
+                events,
+                loan_state,
+                "funded_value",
+                funded_value_atto_dai=loan_state.funded_value_atto_dai,
+            )
+
+        if loan_state.current_value_atto_dai != previous[2]:
+            _add_event(
+                events,
+                loan_state,
+                "price",
+                current_value_atto_dai=loan_state.current_value_atto_dai,
+            )
+
+        _index_sell_positions(loan_state, sell_positions, events)
+
+        if loan_state.phase in _TERMINAL_PHASES:
+            _order_books.pop(identifier, None)
+
+    _link_loans()
+    _copy_phases()
+
+
+def _update_order_book(loan_state, sell_positions):
+    """
+    Apply the changes in a loan's sell positions to its order book.
+    """
+
+    order_book = _order_books.get(loan_state.identifier)
+
+    if order_book is None:
+        order_book = OrderBook(
+            loan_state.sell_positions.all() if loan_state.pk else []
+        )
+        _order_books[loan_state.identifier] = order_book
+
+    fetched = {str(sp.seller_address): sp for sp in sell_positions}
+
+    for seller_address in order_book.get_sellers():
+        if seller_address not in fetched:
+            order_book.remove_position(seller_address)
+
+    for seller_address, sp in fetched.items():
+        position = (int(sp.price_atto_dai_per_token), int(sp.amount_tokens))
+        if order_book.get_position(seller_address) != position:
+            order_book.set_position(seller_address, *position)
+
+    return order_book
+
+
+def _index_sell_positions(loan_state, sell_positions, events):
+
+    existing = {sp.seller_address: sp for sp in loan_state.sell_positions.all()}
+    fetched = {str(sp.seller_address): sp for sp in sell_positions}
+
+    loan_state.sell_positions.exclude(seller_address__in=list(fetched)).delete()
+
+    for seller_address in existing.keys() - fetched.keys():
+        _update_investment(
+            loan_state,
+            seller_address,
+            sell_amount_tokens=None,
+            sell_price_atto_dai_per_token=None,
+        )
+        _add_event(
+            events,
+            loan_state,
+            "sell_position_removed",
+            seller_address=seller_address,
+        )
+
+    for seller_address, sp in fetched.items():
+
+        row = existing.get(seller_address) or SellPosition(
+            loan_state=loan_state, seller_address=seller_address
+        )
+
+        amount_tokens = str(sp.amount_tokens)
+        price_atto_dai_per_token = str(sp.price_atto_dai_per_token)
+
+        if (
+            row.pk is None
+            or row.amount_tokens != amount_tokens
+            or row.price_atto_dai_per_token != price_atto_dai_per_token
+        ):
+            kind = "created" if row.pk is None else "updated"
+
+            _add_event(
+                events,
+                loan_state,
+                f"sell_position_{kind}",
+                seller_address=seller_address,
+                amount_tokens=amount_tokens,
+                price_atto_dai_per_token=price_atto_dai_per_token,
+            )
+
+            row.amount_tokens = amount_tokens
+            row.price_atto_dai_per_token = price_atto_dai_per_token
+            row.save()
+
+            _update_investment(
+                loan_state,
+                seller_address,
+                sell_amount_tokens=amount_tokens,
+                sell_price_atto_dai_per_token=price_atto_dai_per_token,
+            )
+
+
+def _add_event(events, loan_state, kind, **data):
+
+    events.append(
+        MarketEvent(
+            block_number=loan_state.block_number,
+            loan_id=loan_state.loan_id,
+            identifier=loan_state.identifier,
+            kind=kind,
+            data=json.dumps(data),
+        )
+    )
+
+
+def _link_loans():
+    """
+    Associate indexed loans with their database rows.
+
+    A loan may be indexed before the request that created it stores its
+    identifier, so this is retried on every range.
+    """
+
+    unlinked = LoanChainState.objects.filter(loan=None)
+
+    loan_ids = dict(
+        Loan.objects.filter(
+            identifier__in=unlinked.values("identifier")
+        ).values_list("identifier", "id")
+    )
+
+    for loan_state in unlinked.filter(identifier__in=list(loan_ids)):
+        loan_state.loan_id = loan_ids[loan_state.identifier]
+        loan_state.save(update_fields=["loan"])
+
+
+def _copy_phases():
+    """
+    Record the indexed phases of loans in their ``phase`` column, which phase
+    filters use.
+    """
+
+    stale = list(
+        Loan.objects.exclude(chain_state=None)
+        .exclude(phase=F("chain_state__phase"))
+        .values_list("id", "chain_state__phase")
+    )
+
+    for (loan_id, phase) in stale:
+        Loan.objects.filter(id=loan_id).update(phase=phase)
+
+    # updates do not send the signals that bump it
+    if stale:
+        TableVersion.bump(Loan)
+
+
+# ---------------------------------------------------------------------------- #
+
+
+def _fetch_token_balances(start, end, fetched_loans, reindexed):
+    """
+    Read the balances of the holders of loan tokens transferred in a block
+    range, and of the given (loan identifier, holder address) pairs.
+
+    Returns the balances, keyed by (loan identifier, holder address).
+    """
+
+    token_addresses = dict(
+        LoanChainState.objects.values_list(
+            "token_contract_address", "identifier"
+        )
+    )
+
+    for fetched_loan in fetched_loans:
+        if fetched_loan.token_contract_address is not None:
+            token_addresses[
+                fetched_loan.token_contract_address
+            ] = fetched_loan.identifier
+
+    identifiers = {a.lower(): i for (a, i) in token_addresses.items()}
+
+    if not identifiers:
+        return {}
+
+    known = set(token_addresses.values())
+
+    touched = {
+        (identifier, holder_address)
+        for (identifier, holder_address) in reindexed
+        if identifier in known
+    }
+
+    for log_start in range(start, end + 1, MAX_BLOCK_RANGE):
+
+        logs = web3.eth.getLogs(
+            {
+                "fromBlock": log_start,
+                "toBlock": min(end, log_start + MAX_BLOCK_RANGE - 1),
+                "address": [Web3.toChecksumAddress(a) for a in identifiers],
+                "topics": [TRANSFER_EVENT_TOPIC],
+            }
+        )
+
+        for log in logs:
+            identifier = identifiers[log["address"].lower()]
+            for topic in log["topics"][1:3]:
+                holder_address = Web3.toChecksumAddress(topic[-20:])
+                if holder_address != ZERO_ADDRESS:
+                    touched.add((identifier, holder_address))
+
+    touched = sorted(touched)
+
+    amounts = rpc_batcher.map(
+        lambda pair: controller.loans.get_by_identifier(
+            LoanIdentifier(pair[0])
+        ).get_token_balance_of(Address(pair[1])),
+        touched,
+    )
+
+    return dict(zip(touched, amounts))
+
+
+def _index_token_holders(balances):
+    """
+    Store the balances read by ``_fetch_token_balances()``.
+    """
+
+    loan_states = LoanChainState.objects.in_bulk(
+        {identifier for (identifier, _) in balances}, field_name="identifier"
+    )
+
+    for (identifier, holder_address), amount_tokens in balances.items():
+        _update_investment(
+            loan_states[identifier],
+            holder_address,
+            amount_tokens=str(amount_tokens),
+        )
+
+
+def _update_investment(loan_state, investor_address, **fields):
+    """
+    Set fields of the investment of an address in a loan, and forget the
+    investment once the address neither holds nor sells any tokens.
+    """
+
+    investment = Investment.objects.filter(
+        loan_state=loan_state, investor_address=investor_address
+    ).first() or Investment(
+        loan_state=loan_state, investor_address=investor_address
+    )
+
+    for name, value in fields.items():
+        setattr(investment, name, value)
+
+    if investment.amount_tokens != "0" or investment.sell_amount_tokens:
+        investment.save()
+    elif investment.pk is not None:
+        investment.delete()
+
+
+# ---------------------------------------------------------------------------- #
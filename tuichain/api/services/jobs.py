@@ -0,0 +1,531 @@
+# ---------------------------------------------------------------------------- #
+
+"""
+Persistent queue of the on-chain writes requested by the API.
+
+Sending a transaction and waiting for it to be mined takes as long as the
+chain wants it to, so views only record a ``Job`` and answer right away, and
+the ``run_jobs`` management command sends the transactions, JOBS_CONCURRENCY
+at a time. Their nonces are handed out by ``nonce_manager``.
+
+A job that fails is retried with exponential backoff, up to MAX_ATTEMPTS
+times. Jobs check the chain before sending their transaction, so that a job
+whose previous attempt got its transaction mined, or whose worker died while
+running it, is completed instead of sent twice. Loan creation, which cannot
+be told apart from that of another loan, records its transaction's hash
+before waiting for it, and looks it up instead. Workers record a heartbeat on
+the jobs they run every HEARTBEAT_INTERVAL, and jobs whose heartbeat is older
+than STALE_JOB_TIMEOUT are put back in the queue by ``reconcile()``.
+"""
+
+# ---------------------------------------------------------------------------- #
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from tuichain_ethereum import Address, LoanIdentifier, LoanPhase
+from web3.exceptions import TransactionNotFound
+
+from tuichain.api.enums import JobState, LoanState
+from tuichain.api.models import Job, Loan
+from tuichain.api.services.blockchain import controller, nonce_manager, web3
+from tuichain.api.services.nonces import sending_transactions
+from tuichain.api.services.providers import block_scope
+
+# ---------------------------------------------------------------------------- #
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+
+RETRY_BACKOFF = timedelta(seconds=30)
+"""Delay before the first retry of a job, doubled on each retry after it."""
+
+HEARTBEAT_INTERVAL = timedelta(seconds=30)
+"""Time between heartbeats of the jobs a worker is running."""
+
+STALE_JOB_TIMEOUT = timedelta(minutes=5)
+"""Time without a heartbeat after which a job is assumed to have lost its
+worker."""
+
+# ---------------------------------------------------------------------------- #
+
+
+def enqueue(kind, loan, **arguments):
+    """
+    Queue a job.
+
+    Parameters
+    ----------
+    kind : str
+
+        One of "create_loan", "cancel_loan" or "finalize_loan".
+
+    loan : tuichain.api.models.Loan
+
+        The loan the job acts on.
+
+    **arguments
+
+        JSON-serializable arguments of the job.
+
+    Returns
+    -------
+    tuichain.api.models.Job
+        The queued job.
+    """
+
+    assert kind in _HANDLERS
+
+    job = Job.objects.create(
+        kind=kind, loan=loan, arguments=json.dumps(arguments)
+    )
+
+    if settings.JOBS_RUN_IN_PROCESS:
+        transaction.on_commit(_wake_up_thread)
+
+    return job
+
+
+def has_unfinished_jobs(loan):
+    return Job.objects.filter(
+        loan=loan,
+        state__in=[JobState.PENDING.value, JobState.RUNNING.value],
+    ).exists()
+
+
+def run_due():
+    """
+    Run the jobs that are due, JOBS_CONCURRENCY at a time, until none are
+    left, after looking after the transactions of the previous ones.
+
+    Returns
+    -------
+    int
+        The number of jobs run.
+    """
+
+    nonce_manager.maintain()
+
+    executor = _get_executor()
+
+    # on threads of their own, as jobs wait minutes for their transactions to
+    # be mined, which must not hold up the pool of fan_out() that requests use
+    futures = [
+        executor.submit(_run_until_none_due)
+        for _ in range(settings.JOBS_CONCURRENCY)
+    ]
+
+    return sum(future.result() for future in futures)
+
+
+def _get_executor():
+
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.JOBS_CONCURRENCY,
+                thread_name_prefix="tuichain-jobs-worker",
+            )
+
+    return _executor
+
+
+def _run_until_none_due():
+
+    count = 0
+
+    try:
+        while run_next():
+            count += 1
+    finally:
+        # the executor's threads outlive this call
+        connections.close_all()
+
+    return count
+
+
+def run_next():
+    """
+    Run the next job that is due, if any.
+
+    Returns
+    -------
+    bool
+        Whether a job was run.
+    """
+
+    job = _claim_next()
+
+    if job is None:
+        return False
+
+    with _running_lock:
+        _running.add(job.id)
+
+    try:
+        _HANDLERS[job.kind](job, **json.loads(job.arguments))
+
+    except Exception as e:
+
+        logger.exception("Job %d failed", job.id)
+
+        job.error = f"{type(e).__name__}: {e}"
+
+        if job.attempts < MAX_ATTEMPTS:
+            job.state = JobState.PENDING.value
+            job.run_after = timezone.now() + RETRY_BACKOFF * (
+                2 ** (job.attempts - 1)
+            )
+        else:
+            job.state = JobState.FAILED.value
+            job.finished_at = timezone.now()
+            if job.kind in _FAILURE_HANDLERS:
+                _FAILURE_HANDLERS[job.kind](job)
+
+    else:
+
+        job.state = JobState.SUCCEEDED.value
+        job.error = None
+        job.finished_at = timezone.now()
+
+    finally:
+        with _running_lock:
+            _running.discard(job.id)
+
+    # unless the job was deemed stale and given to another worker meanwhile
+    Job.objects.filter(
+        id=job.id, state=JobState.RUNNING.value, worker=job.worker
+    ).update(
+        state=job.state,
+        error=job.error,
+        run_after=job.run_after,
+        finished_at=job.finished_at,
+    )
+
+    return True
+
+
+def reconcile():
+    """
+    Put the running jobs whose worker has not recorded a heartbeat for longer
+    than STALE_JOB_TIMEOUT, and is thus presumably gone, back in the queue.
+
+    Returns
+    -------
+    int
+        The number of jobs put back in the queue.
+    """
+
+    stale = timezone.now() - STALE_JOB_TIMEOUT
+
+    return Job.objects.filter(
+        Q(heartbeat_at__lt=stale) | Q(heartbeat_at=None, started_at__lt=stale),
+        state=JobState.RUNNING.value,
+    ).update(
+        state=JobState.PENDING.value, run_after=timezone.now(), worker=None
+    )
+
+
+def _claim_next():
+
+    while True:
+
+        job = (
+            Job.objects.filter(
+                state=JobState.PENDING.value, run_after__lte=timezone.now()
+            )
+            .order_by("run_after", "id")
+            .first()
+        )
+
+        if job is None:
+            return None
+
+        # of several workers, only the first to change the state gets the job
+        claimed = Job.objects.filter(
+            id=job.id, state=JobState.PENDING.value
+        ).update(
+            state=JobState.RUNNING.value,
+            attempts=F("attempts") + 1,
+            started_at=timezone.now(),
+            worker=_get_worker_name(),
+            heartbeat_at=timezone.now(),
+        )
+
+        if claimed:
+            _start_heartbeat_thread()
+            job.refresh_from_db()
+            return job
+
+
+# ---------------------------------------------------------------------------- #
+
+
+def _create_loan(
+    job,
+    days_to_expiration,
+    funding_fee_atto_dai_per_dai,
+    payment_fee_atto_dai_per_dai,
+):
+
+    loan = job.loan
+
+    # an earlier attempt may have been mined after it gave up waiting
+    fetched_loan = _find_created_loan(job)
+
+    if fetched_loan is None:
+
+        def record(transaction_hash, nonce):
+            job.transaction_hash = transaction_hash
+            Job.objects.filter(id=job.id).update(
+                transaction_hash=transaction_hash
+            )
+
+        with sending_transactions(record):
+            fetched_loan = controller.loans.create(
+                recipient_address=Address(loan.recipient_address),
+                time_to_expiration=timedelta(days=days_to_expiration),
+                funding_fee_atto_dai_per_dai=int(funding_fee_atto_dai_per_dai),
+                payment_fee_atto_dai_per_dai=int(payment_fee_atto_dai_per_dai),
+                requested_value_atto_dai=int(
+                    loan.exact_requested_value_atto_dai
+                ),
+            ).get()
+
+    loan.identifier = str(fetched_loan.identifier)
+    loan.token_contract_address = str(fetched_loan.token_contract_address)
+    loan.funding_fee_atto_dai_per_dai = str(funding_fee_atto_dai_per_dai)
+    loan.payment_fee_atto_dai_per_dai = str(payment_fee_atto_dai_per_dai)
+    loan.expiration_time = fetched_loan.expiration_time
+    loan.phase = LoanPhase.FUNDING.name
+    loan.state = LoanState.APPROVED.value
+    loan.save()
+
+
+def _find_created_loan(job):
+    """
+    Find the on-chain loan created by the transaction that an earlier attempt
+    of a loan creation job sent, or None if there was none, or it failed.
+
+    Raises an exception while that transaction is not mined, so that the job is
+    retried later instead of creating the loan a second time.
+    """
+
+    if job.transaction_hash is None:
+        return None
+
+    try:
+        receipt = web3.eth.getTransactionReceipt(job.transaction_hash)
+    except TransactionNotFound:
+        receipt = None
+
+    if receipt is None:
+        raise ValueError(f"Transaction {job.transaction_hash} is not mined yet")
+
+    if receipt["status"] == 0:
+        return None
+
+    # the loans created in the transaction's block, in creation order
+    block_number = receipt["blockNumber"]
+
+    with block_scope(block_number - 1):
+        existing = {str(f.identifier) for f in controller.loans.get_all()}
+
+    with block_scope(block_number):
+        created = [
+            f
+            for f in controller.loans.get_all()
+            if str(f.identifier) not in existing
+        ]
+
+    # of which others may have been created for other requests
+    taken = set(
+        Loan.objects.filter(
+            identifier__in=[str(f.identifier) for f in created]
+        ).values_list("identifier", flat=True)
+    )
+
+    loan = job.loan
+    recipient_address = str(Address(loan.recipient_address))
+
+    for fetched_loan in created:
+        if (
+            str(fetched_loan.identifier) not in taken
+            and str(Address(str(fetched_loan.recipient_address)))
+            == recipient_address
+            and fetched_loan.requested_value_atto_dai
+            == int(loan.exact_requested_value_atto_dai)
+        ):
+            return fetched_loan
+
+    raise ValueError(
+        f"Transaction {job.transaction_hash} did not create the loan"
+    )
+
+
+def _reset_loan_request(job):
+
+    loan = job.loan
+
+    # let an admin validate the request again
+    if loan.state == LoanState.CREATING.value:
+        loan.state = LoanState.PENDING.value
+        loan.save()
+
+
+def _cancel_loan(job):
+
+    fetched_loan = controller.loans.get_by_identifier(
+        LoanIdentifier(job.loan.identifier)
+    )
+
+    if fetched_loan.get_state().phase != LoanPhase.CANCELED:
+        with sending_transactions():
+            fetched_loan.cancel().get()
+
+    _record_phase(job.loan, LoanPhase.CANCELED)
+
+
+def _finalize_loan(job):
+
+    fetched_loan = controller.loans.get_by_identifier(
+        LoanIdentifier(job.loan.identifier)
+    )
+
+    if fetched_loan.get_state().phase != LoanPhase.FINALIZED:
+        with sending_transactions():
+            fetched_loan.finalize().get()
+
+    _record_phase(job.loan, LoanPhase.FINALIZED)
+
+
+def _record_phase(loan, phase):
+    loan.phase = phase.name
+    loan.save()
+
+
+_HANDLERS = {
+    "create_loan": _create_loan,
+    "cancel_loan": _cancel_loan,
+    "finalize_loan": _finalize_loan,
+}
+
+_FAILURE_HANDLERS = {
+    "create_loan": _reset_loan_request,
+}
+
+# ---------------------------------------------------------------------------- #
+
+_executor = None
+_executor_lock = threading.Lock()
+
+_running = set()
+"""Identifiers of the jobs run by this process."""
+
+_running_lock = threading.Lock()
+
+_heartbeat_thread = None
+_heartbeat_thread_pid = None
+
+
+def _get_worker_name():
+    # computed on every call, as gunicorn forks its workers after import
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _start_heartbeat_thread():
+
+    global _heartbeat_thread, _heartbeat_thread_pid
+
+    with _running_lock:
+        # threads do not survive forks
+        if _heartbeat_thread_pid != os.getpid():
+            _heartbeat_thread = threading.Thread(
+                target=_run_heartbeat_thread,
+                name="tuichain-jobs-heartbeat",
+                daemon=True,
+            )
+            _heartbeat_thread_pid = os.getpid()
+            _heartbeat_thread.start()
+
+
+def _run_heartbeat_thread():
+
+    while True:
+
+        time.sleep(HEARTBEAT_INTERVAL.total_seconds())
+
+        with _running_lock:
+            job_ids = list(_running)
+
+        if not job_ids:
+            continue
+
+        try:
+            Job.objects.filter(
+                id__in=job_ids,
+                state=JobState.RUNNING.value,
+                worker=_get_worker_name(),
+            ).update(heartbeat_at=timezone.now())
+        except Exception:
+            logger.exception("Failed to record the heartbeat of jobs")
+        finally:
+            connections.close_all()
+
+
+# ---------------------------------------------------------------------------- #
+
+_thread = None
+_thread_lock = threading.Lock()
+_thread_wake_up = threading.Event()
+
+
+def _wake_up_thread():
+    """
+    Start the in-process worker thread, or wake it up if it is waiting.
+    """
+
+    global _thread
+
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(
+                target=_run_thread, name="tuichain-jobs", daemon=True
+            )
+            _thread.start()
+
+    _thread_wake_up.set()
+
+
+def _run_thread():
+
+    while True:
+
+        _thread_wake_up.clear()
+
+        try:
+            reconcile()
+            run_due()
+        except Exception:
+            logger.exception("In-process job worker failed")
+        finally:
+            connections.close_all()
+
+        # retries are due at some point even if no job is queued
+        _thread_wake_up.wait(RETRY_BACKOFF.total_seconds())
+
+
+# ---------------------------------------------------------------------------- #
@@ -0,0 +1,290 @@
+# ---------------------------------------------------------------------------- #
+
+from decimal import Decimal
+
+from django.db.models import (
+    Avg,
+    Count,
+    DecimalField,
+    F,
+    Max,
+    Min,
+    Q,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Floor
+from django.utils import timezone
+from tuichain_ethereum import LoanIdentifier, LoanPhase
+
+from tuichain.api.enums import LoanState
+from tuichain.api.models import Loan, TableVersion
+from tuichain.api.services.blockchain import controller, rpc_batcher
+
+# ---------------------------------------------------------------------------- #
+
+
+def resolve_loans(identifiers):
+    """
+    Get the database rows of several on-chain loans, along with their students
+    and the students' profiles, in a single query.
+
+    Parameters
+    ----------
+    identifiers : iterable
+
+        The loans' on-chain identifiers, as LoanIdentifier or str.
+
+    Returns
+    -------
+    dict
+        The loans, keyed by identifier string. Identifiers without a loan are
+        left out.
+    """
+
+    loans = Loan.objects.select_related("chain_state", "student__profile")
+
+    return {
+        loan.identifier: loan
+        for loan in loans.filter(identifier__in=[str(i) for i in identifiers])
+    }
+
+
+def filter_by_phase(loans, phase):
+    """
+    Restrict a queryset of loans to those in the given on-chain phase, as last
+    recorded in their ``phase`` column.
+
+    Parameters
+    ----------
+    loans : django.db.models.QuerySet
+
+        The loans.
+
+    phase : str
+
+        The name of a LoanPhase.
+
+    Returns
+    -------
+    django.db.models.QuerySet
+        The loans in that phase.
+    """
+
+    return loans.filter(get_phase_condition(phase))
+
+
+def get_phase_condition(phase):
+    """
+    Get the condition on loans of being in the given on-chain phase, as last
+    recorded in their ``phase`` column.
+
+    A loan that is not fully funded by its expiration time expires without any
+    transaction, so funding loans past their expiration time are counted as
+    expired even before that is recorded.
+    """
+
+    expired = Q(
+        phase=LoanPhase.FUNDING.name, expiration_time__lte=timezone.now()
+    )
+
+    if phase == LoanPhase.FUNDING.name:
+        return Q(phase=phase) & ~expired
+    elif phase == LoanPhase.EXPIRED.name:
+        return Q(phase=phase) | expired
+    else:
+        return Q(phase=phase)
+
+
+def get_loans_with_unsettled_phase():
+    """
+    Get the approved loans whose phase may have changed without the backend
+    taking part, which are the funding loans, and the loans whose phase was
+    never recorded.
+
+    Funding loans past their expiration time are included, as they may have
+    been fully funded just before it.
+    """
+
+    return Loan.objects.filter(
+        Q(phase=None) | Q(phase=LoanPhase.FUNDING.name),
+        state=LoanState.APPROVED.value,
+    )
+
+
+def settle_phases():
+    """
+    Record the phase that the chain reports for every loan whose phase may have
+    changed without the backend taking part, which the indexer does instead
+    when it runs.
+
+    The loans' states are read concurrently, on the bounded pool of
+    ``fan_out()``.
+
+    Returns
+    -------
+    int
+        The number of loans whose phase changed.
+    """
+
+    # loans are approved before their creation job gives them an identifier
+    unsettled = list(get_loans_with_unsettled_phase().exclude(identifier=None))
+
+    phases = rpc_batcher.map(
+        lambda loan: controller.loans.get_by_identifier(
+            LoanIdentifier(loan.identifier)
+        )
+        .get_state()
+        .phase.name,
+        unsettled,
+    )
+
+    return record_phases(unsettled, phases)
+
+
+def record_phases(loans, phases):
+    """
+    Store the phases of several loans, in a single query per changed phase.
+
+    Parameters
+    ----------
+    loans : iterable
+
+        The loans.
+
+    phases : iterable
+
+        The names of their phases, in the same order.
+
+    Returns
+    -------
+    int
+        The number of loans whose phase changed.
+    """
+
+    changed = {}
+
+    for (loan, phase) in zip(loans, phases):
+        if loan.phase != phase:
+            loan.phase = phase
+            changed.setdefault(phase, []).append(loan.id)
+
+    for (phase, loan_ids) in changed.items():
+        Loan.objects.filter(id__in=loan_ids).update(phase=phase)
+
+    # updates do not send the signals that bump it
+    if changed:
+        TableVersion.bump(Loan)
+
+    return sum(len(loan_ids) for loan_ids in changed.values())
+
+
+# ---------------------------------------------------------------------------- #
+
+
+def get_value_statistics(loans, bucket_count):
+    """
+    Summarize the requested values of some loans, in SQL.
+
+    Parameters
+    ----------
+    loans : django.db.models.QuerySet
+
+        The loans.
+
+    bucket_count : int
+
+        Number of buckets of the histogram, which split the range between the
+        smallest and the largest requested value in equal parts.
+
+    Returns
+    -------
+    dict
+        The count, total, average, minimum and maximum of the requested values,
+        those of the loans at each state, keyed by state name, and the
+        histogram, as a list of buckets with their inclusive bounds, count and
+        total.
+        Amounts are strings, and None if there are no loans.
+    """
+
+    loans = loans.order_by()
+    value = F("requested_value_atto_dai")
+
+    aggregates = {
+        "count": Count("id"),
+        "total": Sum(value),
+        "average": Avg(value),
+        "min": Min(value),
+        "max": Max(value),
+    }
+
+    summary = _format_summary(loans.aggregate(**aggregates))
+
+    states = {
+        str(LoanState(row["state"])): _format_summary(row)
+        for row in loans.values("state").annotate(**aggregates)
+    }
+
+    histogram = []
+
+    if summary["count"]:
+
+        low = int(summary["min_atto_dai"])
+        high = int(summary["max_atto_dai"])
+
+        # buckets of whole widths, the last of which also holds the largest
+        # value, and none past it
+        width = max(1, -(-(high - low) // bucket_count))
+        bucket_count = min(bucket_count, (high - low) // width + 1)
+
+        # the bucket of each loan, as computed by the database; amounts are
+        # passed as decimals, which may not fit in a 64-bit integer
+        amount = DecimalField(max_digits=40, decimal_places=0)
+        rows = (
+            loans.annotate(
+                bucket=Floor(
+                    (value - Value(Decimal(low), output_field=amount))
+                    / Value(Decimal(width), output_field=amount),
+                    output_field=amount,
+                )
+            )
+            .values("bucket")
+            .annotate(count=Count("id"), total=Sum(value))
+        )
+
+        counts = [0] * bucket_count
+        totals = [0] * bucket_count
+
+        for row in rows:
+            bucket = min(int(row["bucket"]), bucket_count - 1)
+            counts[bucket] += row["count"]
+            totals[bucket] += int(row["total"])
+
+        for bucket in range(bucket_count):
+            histogram.append(
+                {
+                    "min_atto_dai": str(low + bucket * width),
+                    "max_atto_dai": str(
+                        high
+                        if bucket == bucket_count - 1
+                        else low + (bucket + 1) * width - 1
+                    ),
+                    "count": counts[bucket],
+                    "total_atto_dai": str(totals[bucket]),
+                }
+            )
+
+    return {**summary, "states": states, "histogram": histogram}
+
+
+def _format_summary(row):
+    return {
+        "count": row["count"],
+        **{
+            f"{key}_atto_dai": None if row[key] is None else str(int(row[key]))
+            for key in ["total", "average", "min", "max"]
+        },
+    }
+
+
+# ---------------------------------------------------------------------------- #
@@ -0,0 +1,202 @@
+# ---------------------------------------------------------------------------- #
+
+from sortedcontainers import SortedDict
+from tuichain_ethereum import LoanPhase
+
+# ---------------------------------------------------------------------------- #
+
+
+class _Position:
+
+    __slots__ = ("price_atto_dai_per_token", "amount_tokens")
+
+    def __init__(self, price_atto_dai_per_token, amount_tokens):
+        self.price_atto_dai_per_token = price_atto_dai_per_token
+        self.amount_tokens = amount_tokens
+
+
+class OrderBook:
+    """
+    The sell positions of a loan's token, kept sorted by price.
+
+    Amounts for sale are aggregated per price level, and the levels are split
+    in two halves at the amount-weighted median price, each with a running
+    total of its amount. The median is therefore read in constant time, and
+    adding, changing or removing a position takes O(log n) time per level
+    that crosses the split, which is usually none or one.
+    """
+
+    __slots__ = ("_positions", "_low", "_high", "_low_amount", "_high_amount")
+
+    def __init__(self, sell_positions=()):
+
+        self._positions = {}
+
+        self._low = SortedDict()  # price -> amount, at or below the median
+        self._high = SortedDict()  # price -> amount, above the median
+        self._low_amount = 0
+        self._high_amount = 0
+
+        for sp in sell_positions:
+            self.set_position(
+                sp.seller_address, sp.price_atto_dai_per_token, sp.amount_tokens
+            )
+
+    def __len__(self):
+        return len(self._positions)
+
+    def get_sellers(self):
+        return list(self._positions)
+
+    def get_position(self, seller_address):
+        """
+        Get the (price_atto_dai_per_token, amount_tokens) of a seller's
+        position, or None if the seller has none.
+        """
+
+        position = self._positions.get(str(seller_address))
+
+        if position is None:
+            return None
+
+        return (position.price_atto_dai_per_token, position.amount_tokens)
+
+    @property
+    def total_amount_tokens(self):
+        return self._low_amount + self._high_amount
+
+    @property
+    def median_price_atto_dai_per_token(self):
+        """
+        The lowest price at which more than half of the tokens for sale are
+        offered at or below, or None if no tokens are for sale.
+        """
+
+        return self._low.peekitem(-1)[0] if self._low else None
+
+    def set_position(
+        self, seller_address, price_atto_dai_per_token, amount_tokens
+    ):
+        """
+        Add or replace the sell position of a seller. An amount of zero
+        removes it.
+        """
+
+        self.remove_position(seller_address)
+
+        price = int(price_atto_dai_per_token)
+        amount = int(amount_tokens)
+
+        if amount > 0:
+            self._positions[str(seller_address)] = _Position(price, amount)
+            self._add_to_level(price, amount)
+            self._rebalance()
+
+    def remove_position(self, seller_address):
+
+        position = self._positions.pop(str(seller_address), None)
+
+        if position is not None:
+            self._add_to_level(
+                position.price_atto_dai_per_token, -position.amount_tokens
+            )
+            self._rebalance()
+
+    def _add_to_level(self, price, amount):
+
+        if self._low and price <= self._low.peekitem(-1)[0]:
+            levels = self._low
+            self._low_amount += amount
+        else:
+            levels = self._high
+            self._high_amount += amount
+
+        level_amount = levels.get(price, 0) + amount
+
+        if level_amount:
+            levels[price] = level_amount
+        else:
+            del levels[price]
+
+    def _rebalance(self):
+
+        half = self.total_amount_tokens // 2
+
+        while self._low_amount <= half and self._high:
+            price, amount = self._high.popitem(0)
+            self._high_amount -= amount
+            self._low[price] = amount
+            self._low_amount += amount
+
+        while self._low and self._low_amount - self._low.peekitem(-1)[1] > half:
+            price, amount = self._low.popitem(-1)
+            self._low_amount -= amount
+            self._high[price] = amount
+            self._high_amount += amount
+
+
+# ---------------------------------------------------------------------------- #
+
+
+def get_current_price(loan_state, sell_positions):
+    """
+    Compute the current value of a loan's token, in atto-Dai.
+
+    While the loan is active this is the amount-weighted median price of its
+    sell positions, or None if no tokens are for sale.
+
+    Parameters
+    ----------
+    loan_state : tuichain_ethereum.LoanState
+
+        The loan's on-chain state.
+
+    sell_positions : OrderBook or iterable
+
+        The loan's sell positions, either in an order book kept up to date
+        between refreshes, or as read for a single computation, which sorts
+        them once instead of building an order book. Only used while the loan
+        is active.
+    """
+
+    if loan_state.phase in [
+        LoanPhase.FUNDING,
+        LoanPhase.CANCELED,
+        LoanPhase.EXPIRED,
+    ]:
+
+        return str(10 ** 18)
+
+    elif loan_state.phase == LoanPhase.ACTIVE:
+
+        if isinstance(sell_positions, OrderBook):
+            price = sell_positions.median_price_atto_dai_per_token
+        else:
+            price = _get_median_price(sell_positions)
+
+        return None if price is None else str(price)
+
+    else:  # loan_state.phase == LoanPhase.FINALIZED
+
+        return str(loan_state.redemption_value_atto_dai_per_token)
+
+
+def _get_median_price(sell_positions):
+
+    positions = sorted(
+        (int(sp.price_atto_dai_per_token), int(sp.amount_tokens))
+        for sp in sell_positions
+    )
+
+    half = sum(amount for (_, amount) in positions) // 2
+    counter = 0
+
+    for price, amount in positions:
+        counter += amount
+        if counter > half:
+            return price
+
+    return None
+
+
+# ---------------------------------------------------------------------------- #
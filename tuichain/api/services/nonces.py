@@ -0,0 +1,466 @@
+# ---------------------------------------------------------------------------- #
+
+"""
+Local nonce allocation for the master account.
+
+The controller signs the master account's transactions itself, asking the
+node for the account's transaction count to use as the nonce. Nodes only
+count transactions they have seen, so two transactions built at once would
+get the same nonce. ``NonceManagingProvider`` answers those requests with
+nonces it hands out itself, and keeps track of the transactions sent with
+them, so that any number of them can be in flight at once. It only does so
+inside ``sending_transactions()``, which the jobs wrap their writes in, so
+that other reads of the account's transaction count do not leave nonces
+unused. Transactions are
+passed on to the node in the order of their nonces, since not every node, and
+not the test chain, accepts a transaction before the ones preceding it.
+
+Transactions can get stuck, in which case every later one is stuck too.
+``maintain()``, which the job workers call regularly, sends again the ones
+that nodes forgot about, replaces the ones that are not mined in time with
+copies paying a higher gas price, and fills the nonces that were handed out
+but never used with empty transactions.
+
+Nonces are handed out by each process on its own, so only one process may
+send the master account's transactions: the ``run_jobs`` command, or the web
+server when JOBS_RUN_IN_PROCESS is set, but not both.
+"""
+
+# ---------------------------------------------------------------------------- #
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+import logging
+import threading
+import time
+
+from eth_account import Account
+from eth_account._utils.transactions import Transaction
+from eth_utils import to_checksum_address
+from hexbytes import HexBytes
+
+from tuichain.api.services.providers import ProviderWrapper, _to_int
+
+# ---------------------------------------------------------------------------- #
+
+logger = logging.getLogger(__name__)
+
+_current_sender = ContextVar("transaction_sender", default=None)
+
+
+@contextmanager
+def sending_transactions(on_sent=None):
+    """
+    Hand out nonces to the transactions of the master account built inside
+    the block.
+
+    If given, ``on_sent(transaction_hash, nonce)`` is called for each of them
+    as soon as the node accepts it. Replacements of stuck transactions, which
+    ``maintain()`` sends, are not reported.
+    """
+
+    token = _current_sender.set(on_sent or _ignore_sent)
+
+    try:
+        yield
+    finally:
+        _current_sender.reset(token)
+
+
+def _ignore_sent(transaction_hash, nonce):
+    pass
+
+
+# ---------------------------------------------------------------------------- #
+
+
+class _SentTransaction:
+
+    __slots__ = ("raw", "hash", "sent_at")
+
+    def __init__(self, raw, hash):
+        self.raw = raw
+        self.hash = hash
+        self.sent_at = time.monotonic()
+
+
+class NonceManagingProvider(ProviderWrapper):
+    """
+    Hands out the nonces of an account locally and tracks the transactions
+    sent with them. See the module's documentation.
+    """
+
+    STUCK_AFTER = 180
+    """Seconds after which a transaction that was not mined is resent."""
+
+    ABANDONED_AFTER = 60
+    """
+    Seconds after which a nonce that was not used is filled, and for which a
+    transaction waits for the ones with lower nonces to be sent.
+    """
+
+    GAS_PRICE_BUMP = 1.125
+    """Minimum factor by which a replacement must raise the gas price."""
+
+    MAX_ALIASES = 10_000
+
+    def __init__(self, provider, private_key):
+
+        super().__init__(provider)
+
+        self.private_key = bytes(private_key)
+        self.address = Account.from_key(self.private_key).address
+
+        self._lock = threading.RLock()
+        self._turn = threading.Condition(self._lock)
+
+        # how the provider's formatting passes addresses, numbers and bytes
+        self._address_param = self.address
+        self._int_results = False
+        self._bytes_params = False
+
+        self._next_nonce = None
+        self._allocated = {}  # nonce -> time handed out
+        self._filling = set()  # nonces whose empty transaction is being sent
+        self._sent = {}  # nonce -> _SentTransaction
+        self._aliases = OrderedDict()  # hash of any version -> nonce
+
+    def get_stats(self):
+
+        with self._lock:
+            return {
+                "address": self.address,
+                "next_nonce": self._next_nonce,
+                "allocated": sorted(self._allocated),
+                "filling": sorted(self._filling),
+                "pending": sorted(self._sent),
+            }
+
+    def make_request(self, method, params):
+
+        if (
+            method == "eth_getTransactionCount"
+            and self._is_own(params[0])
+            and _current_sender.get() is not None
+        ):
+            return self._allocate(params)
+
+        if method == "eth_sendRawTransaction":
+            return self._send_raw_transaction(params)
+
+        if method == "eth_getTransactionReceipt":
+            return self._get_transaction_receipt(params)
+
+        return self.provider.make_request(method, params)
+
+    def maintain(self):
+        """
+        Forget mined transactions, resend or replace stuck ones, and fill
+        abandoned nonces.
+
+        What to do is decided with the lock held, and done after releasing it,
+        so that nonces can still be handed out while transactions are sent.
+        """
+
+        with self._lock:
+            if self._next_nonce is None:
+                return
+
+        mined_count = self._get_node_count("latest")
+
+        with self._lock:
+
+            for nonces in [self._allocated, self._sent]:
+                for nonce in [n for n in nonces if n < mined_count]:
+                    del nonces[nonce]
+
+            now = time.monotonic()
+
+            abandoned = self._abandon(
+                nonce
+                for (nonce, allocated_at) in self._allocated.items()
+                if now - allocated_at > self.ABANDONED_AFTER
+            )
+
+            stuck = [
+                (nonce, sent)
+                for (nonce, sent) in self._sent.items()
+                if now - sent.sent_at > self.STUCK_AFTER
+            ]
+
+            # so that a concurrent pass leaves them alone
+            for (_, sent) in stuck:
+                sent.sent_at = now
+
+        self._fill(abandoned)
+
+        for (nonce, sent) in stuck:
+            try:
+                self._unstick(nonce, sent)
+            except Exception:
+                logger.exception("Could not unstick nonce %d", nonce)
+
+    def _is_own(self, address):
+        return isinstance(address, str) and address.lower() == (
+            self.address.lower()
+        )
+
+    def _allocate(self, params):
+
+        with self._lock:
+
+            self._address_param = params[0]
+
+            # picks up transactions sent by others with the same account
+            node_count = self._get_node_count("pending")
+
+            if self._next_nonce is None or node_count > self._next_nonce:
+                self._next_nonce = node_count
+
+            nonce = self._next_nonce
+            self._next_nonce += 1
+            self._allocated[nonce] = time.monotonic()
+
+        return {"result": nonce if self._int_results else hex(nonce)}
+
+    def _send_raw_transaction(self, params):
+
+        try:
+            raw = HexBytes(params[0])
+            nonce = Transaction.from_bytes(raw).nonce
+            own = Account.recover_transaction(raw) == self.address
+        except Exception:
+            # not a kind of transaction that the master account sends
+            own = False
+
+        if not own:
+            return self.provider.make_request("eth_sendRawTransaction", params)
+
+        self._wait_for_turn(nonce)
+
+        response = None
+        abandoned = []
+
+        try:
+            response = self.provider.make_request(
+                "eth_sendRawTransaction", params
+            )
+        finally:
+            with self._turn:
+
+                self._bytes_params = isinstance(params[0], bytes)
+
+                if response is not None and "error" not in response:
+                    self._allocated.pop(nonce, None)
+                    self._track(
+                        nonce,
+                        _SentTransaction(params[0], _hash(response["result"])),
+                    )
+                elif nonce in self._allocated:
+                    # later transactions cannot be mined without this nonce
+                    abandoned = self._abandon([nonce])
+
+                self._turn.notify_all()
+
+            self._fill(abandoned)
+
+        on_sent = _current_sender.get()
+
+        if on_sent is not None and "error" not in response:
+            on_sent(_hash(response["result"]), nonce)
+
+        return response
+
+    def _wait_for_turn(self, nonce):
+        """
+        Wait until the transactions with lower nonces that were handed out are
+        sent, filling the nonces of the ones that take too long.
+        """
+
+        deadline = time.monotonic() + self.ABANDONED_AFTER
+
+        while True:
+
+            with self._turn:
+
+                allocated = [n for n in self._allocated if n < nonce]
+
+                if not allocated and not any(n < nonce for n in self._filling):
+                    return
+
+                timeout = deadline - time.monotonic()
+
+                if timeout > 0 or not allocated:
+                    # fillers being sent by others only take a request
+                    self._turn.wait(timeout if timeout > 0 else 1)
+                    continue
+
+                abandoned = self._abandon(allocated)
+
+            self._fill(abandoned)
+
+    def _get_transaction_receipt(self, params):
+
+        transaction_hash = _hash(params[0])
+
+        with self._lock:
+            nonce = self._aliases.get(transaction_hash)
+            sent = self._sent.get(nonce)
+
+        response = self.provider.make_request(
+            "eth_getTransactionReceipt", params
+        )
+
+        if (
+            sent is not None
+            and sent.hash != transaction_hash
+            and response.get("result") is None
+        ):
+            # the transaction was replaced, and its replacement may be mined
+            response = self.provider.make_request(
+                "eth_getTransactionReceipt", [self._format_bytes(sent.hash)]
+            )
+
+        if nonce is not None and response.get("result") is not None:
+            with self._lock:
+                self._sent.pop(nonce, None)
+
+        return response
+
+    def _track(self, nonce, sent):
+        """
+        Must be called with the lock held.
+        """
+
+        self._sent[nonce] = sent
+        self._aliases[sent.hash] = nonce
+
+        while len(self._aliases) > self.MAX_ALIASES:
+            self._aliases.popitem(last=False)
+
+    def _abandon(self, nonces):
+        """
+        Mark nonces that were handed out as to be filled by ``_fill()``, which
+        later transactions wait for. Must be called with the lock held.
+        """
+
+        nonces = sorted(nonces)
+
+        for nonce in nonces:
+            del self._allocated[nonce]
+            self._filling.add(nonce)
+
+        return nonces
+
+    def _fill(self, nonces):
+        """
+        Use abandoned nonces for empty transactions, so that later ones can be
+        mined. Must be called without the lock held.
+        """
+
+        for nonce in nonces:
+            try:
+                self._send_empty_transaction(nonce)
+            except Exception:
+                logger.exception("Could not fill nonce %d", nonce)
+            finally:
+                with self._turn:
+                    self._filling.discard(nonce)
+                    self._turn.notify_all()
+
+    def _send_empty_transaction(self, nonce):
+
+        self._sign_and_send(
+            nonce,
+            {
+                "to": self.address,
+                "value": 0,
+                "gas": 21_000,
+                "gasPrice": self._get_gas_price(),
+                "data": b"",
+            },
+        )
+
+    def _unstick(self, nonce, sent):
+        """
+        Must be called without the lock held.
+        """
+
+        known = self.provider.make_request(
+            "eth_getTransactionByHash", [self._format_bytes(sent.hash)]
+        ).get("result")
+
+        if known is None:
+            # the nodes forgot about it
+            self.provider.make_request("eth_sendRawTransaction", [sent.raw])
+            sent.sent_at = time.monotonic()
+            return
+
+        transaction = Transaction.from_bytes(HexBytes(sent.raw))
+
+        self._sign_and_send(
+            nonce,
+            {
+                "to": to_checksum_address(transaction.to)
+                if transaction.to
+                else None,
+                "value": transaction.value,
+                "gas": transaction.gas,
+                "gasPrice": max(
+                    int(transaction.gasPrice * self.GAS_PRICE_BUMP) + 1,
+                    self._get_gas_price(),
+                ),
+                "data": transaction.data,
+            },
+        )
+
+    def _sign_and_send(self, nonce, fields):
+
+        chain_id = _to_int(
+            self.provider.make_request("eth_chainId", [])["result"]
+        )
+
+        if fields["to"] is None:
+            del fields["to"]
+
+        signed = Account.sign_transaction(
+            {**fields, "nonce": nonce, "chainId": chain_id}, self.private_key
+        )
+
+        raw = self._format_bytes(signed.rawTransaction)
+
+        response = self.provider.make_request("eth_sendRawTransaction", [raw])
+
+        if "error" in response:
+            raise ValueError(response["error"])
+
+        with self._lock:
+            self._track(nonce, _SentTransaction(raw, _hash(response["result"])))
+
+    def _get_node_count(self, block_identifier):
+
+        result = self.provider.make_request(
+            "eth_getTransactionCount", [self._address_param, block_identifier]
+        )["result"]
+
+        self._int_results = isinstance(result, int)
+
+        return _to_int(result)
+
+    def _get_gas_price(self):
+        return _to_int(self.provider.make_request("eth_gasPrice", [])["result"])
+
+    def _format_bytes(self, value):
+        value = HexBytes(value)
+        return value if self._bytes_params else value.hex()
+
+
+# ---------------------------------------------------------------------------- #
+
+
+def _hash(value):
+    return HexBytes(value).hex()
+
+
+# ---------------------------------------------------------------------------- #
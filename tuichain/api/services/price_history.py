@@ -0,0 +1,241 @@
+# ---------------------------------------------------------------------------- #
+
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Func, IntegerField, Max, Min, Q, Value
+from django.db.models.functions import LPad
+from django.utils import timezone
+from tuichain_ethereum import LoanPhase
+
+from tuichain.api.models import Loan, LoanChainState, LoanPriceSnapshot
+from tuichain.api.services.blockchain import controller, rpc_batcher
+from tuichain.api.services.market import get_current_price
+
+# ---------------------------------------------------------------------------- #
+
+MAX_OHLC_BUCKETS = 1000
+"""Maximum number of buckets that ``get_ohlc()`` spans."""
+
+# ---------------------------------------------------------------------------- #
+
+
+def record_snapshots():
+    """
+    Record the current price, funded value and order book depth of every
+    active loan.
+
+    Returns
+    -------
+    int
+        The number of recorded snapshots.
+    """
+
+    now = timezone.now()
+
+    if settings.ETHEREUM_INDEXER_ENABLED:
+        snapshots = [
+            _make_snapshot(
+                loan_state.loan_id,
+                now,
+                loan_state.current_value_atto_dai,
+                loan_state.funded_value_atto_dai,
+                loan_state.sell_positions.all(),
+            )
+            for loan_state in LoanChainState.objects.filter(
+                phase=LoanPhase.ACTIVE.name
+            )
+            .exclude(loan=None)
+            .prefetch_related("sell_positions")
+        ]
+
+    else:
+        loan_ids = dict(
+            Loan.objects.exclude(identifier=None).values_list(
+                "identifier", "id"
+            )
+        )
+
+        snapshots = [
+            snapshot
+            for snapshot in rpc_batcher.map(
+                lambda fetched_loan: _read_snapshot(
+                    fetched_loan, loan_ids, now
+                ),
+                controller.loans.get_all(),
+            )
+            if snapshot is not None
+        ]
+
+    LoanPriceSnapshot.objects.bulk_create(snapshots)
+
+    return len(snapshots)
+
+
+def _read_snapshot(fetched_loan, loan_ids, now):
+
+    loan_id = loan_ids.get(str(fetched_loan.identifier))
+    if loan_id is None:
+        return None
+
+    state = fetched_loan.get_state()
+    if state.phase != LoanPhase.ACTIVE:
+        return None
+
+    sell_positions = list(
+        controller.market.get_sell_positions_by_loan(fetched_loan)
+    )
+
+    return _make_snapshot(
+        loan_id,
+        now,
+        get_current_price(state, sell_positions),
+        state.funded_value_atto_dai,
+        sell_positions,
+    )
+
+
+def _make_snapshot(loan_id, now, current_value, funded_value, sell_positions):
+
+    sell_positions = list(sell_positions)
+
+    return LoanPriceSnapshot(
+        loan_id=loan_id,
+        time=now,
+        current_value_atto_dai=current_value,
+        funded_value_atto_dai=str(funded_value),
+        sell_positions=len(sell_positions),
+        amount_tokens_for_sale=str(
+            sum(int(sp.amount_tokens) for sp in sell_positions)
+        ),
+    )
+
+
+# ---------------------------------------------------------------------------- #
+
+
+class _EpochSeconds(Func):
+    """Seconds since the epoch of a datetime, rounded down."""
+
+    template = "CAST(FLOOR(EXTRACT(EPOCH FROM %(expressions)s)) AS BIGINT)"
+    output_field = IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler,
+            connection,
+            template="CAST(STRFTIME('%%%%s', %(expressions)s) AS INTEGER)",
+            **extra_context,
+        )
+
+
+def get_ohlc(loan_id, interval, start=None, end=None):
+    """
+    Downsample the price history of a loan into open/high/low/close buckets,
+    in SQL.
+
+    Parameters
+    ----------
+    loan_id : int
+
+        The loan's database identifier.
+
+    interval : int
+
+        Length of each bucket, in seconds. Buckets are aligned to the epoch.
+
+    start : datetime, optional
+
+        Ignore snapshots taken before this time. Defaults to the start of the
+        MAX_OHLC_BUCKETS-th bucket before the end.
+
+    end : datetime, optional
+
+        Ignore snapshots taken after this time. Defaults to now.
+
+    Returns
+    -------
+    list
+        One dict per bucket with at least one priced snapshot, oldest first.
+        The funded value and depth fields are those of the bucket's last
+        snapshot.
+
+    Raises
+    ------
+    ValueError
+        If the range spans more than MAX_OHLC_BUCKETS buckets.
+    """
+
+    if end is None:
+        end = timezone.now()
+
+    last_bucket = int(end.timestamp()) // interval
+
+    if start is None:
+        first_bucket = max(0, last_bucket - MAX_OHLC_BUCKETS + 1)
+        start = datetime.fromtimestamp(first_bucket * interval, tz=timezone.utc)
+    else:
+        first_bucket = int(start.timestamp()) // interval
+
+    if last_bucket - first_bucket >= MAX_OHLC_BUCKETS:
+        raise ValueError(
+            f"The range spans more than {MAX_OHLC_BUCKETS} intervals"
+        )
+
+    snapshots = LoanPriceSnapshot.objects.filter(
+        loan_id=loan_id, time__gte=start, time__lte=end
+    ).exclude(current_value_atto_dai=None)
+
+    # prices are integers stored as strings, which compare as numbers once
+    # padded to the same length
+    padded_price = LPad("current_value_atto_dai", 40, Value("0"))
+
+    buckets = (
+        snapshots.annotate(bucket=_EpochSeconds("time") / Value(interval))
+        .values("bucket")
+        .annotate(
+            high=Max(padded_price),
+            low=Min(padded_price),
+            first_time=Min("time"),
+            last_time=Max("time"),
+        )
+        .order_by("bucket")
+    )
+
+    # the first and last snapshot of each bucket, for its open and close
+    edges = snapshots.filter(
+        Q(time__in=buckets.values("first_time"))
+        | Q(time__in=buckets.values("last_time"))
+    ).order_by("time", "id")
+
+    first_snapshots = {}
+    last_snapshots = {}
+
+    for snapshot in edges:
+        first_snapshots.setdefault(snapshot.time, snapshot)
+        last_snapshots[snapshot.time] = snapshot
+
+    result = []
+
+    for bucket in buckets:
+
+        first = first_snapshots[bucket["first_time"]]
+        last = last_snapshots[bucket["last_time"]]
+
+        result.append(
+            {
+                "time": bucket["bucket"] * interval,
+                "open": first.current_value_atto_dai,
+                "high": str(int(bucket["high"])),
+                "low": str(int(bucket["low"])),
+                "close": last.current_value_atto_dai,
+                "funded_value_atto_dai": last.funded_value_atto_dai,
+                "sell_positions": last.sell_positions,
+                "amount_tokens_for_sale": last.amount_tokens_for_sale,
+            }
+        )
+
+    return result
+
+
+# ---------------------------------------------------------------------------- #
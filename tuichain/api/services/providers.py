@@ -0,0 +1,928 @@
+# ---------------------------------------------------------------------------- #
+
+import asyncio
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+import threading
+import time
+
+from django.conf import settings
+from web3 import EthereumTesterProvider, HTTPProvider, WebsocketProvider
+from web3._utils.encoding import FriendlyJsonSerde
+from web3._utils.request import make_post_request
+from web3.providers import BaseProvider
+from websockets.exceptions import ConnectionClosed
+
+from tuichain.api.services.concurrency import fan_out
+
+# ---------------------------------------------------------------------------- #
+
+
+class _BlockScope:
+
+    __slots__ = ("block_number", "lock")
+
+    def __init__(self):
+        self.block_number = None
+        self.lock = threading.Lock()
+
+
+_current_block_scope = ContextVar("block_scope", default=None)
+
+
+@contextmanager
+def block_scope(block_number=None):
+    """
+    Pin the chain reads made inside the block to a single block.
+
+    Unless the number of the block is given, the latest block number is fetched
+    once, on the first read, and reused until a transaction is sent or mined.
+    See ``BlockPinningProvider``.
+    """
+
+    scope = _BlockScope()
+    scope.block_number = block_number
+
+    token = _current_block_scope.set(scope)
+
+    try:
+        yield
+    finally:
+        _current_block_scope.reset(token)
+
+
+def _to_int(value):
+    return int(value, 16) if isinstance(value, str) else int(value)
+
+
+_BLOCK_PARAMETER_INDICES = {
+    "eth_call": 1,
+    "eth_getBalance": 1,
+    "eth_getCode": 1,
+    "eth_getStorageAt": 2,
+}
+"""Position of the block parameter of the reads that can be pinned."""
+
+
+def _get_block_parameter(method, params):
+    """
+    Get the block number a read is made at, or None if it is made at a block
+    tag such as "latest", or is not a read of state.
+    """
+
+    index = _BLOCK_PARAMETER_INDICES.get(method)
+
+    if index is None or len(params) <= index:
+        return None
+
+    block = params[index]
+
+    if isinstance(block, int) or (
+        isinstance(block, str) and block.startswith("0x")
+    ):
+        return _to_int(block)
+    else:
+        return None
+
+
+# ---------------------------------------------------------------------------- #
+
+
+class ProviderWrapper(BaseProvider):
+    """
+    Base class for providers that forward requests to another provider.
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+
+    @property
+    def middlewares(self):
+        return self.provider.middlewares
+
+    @middlewares.setter
+    def middlewares(self, values):
+        self.provider.middlewares = values
+
+    def make_request(self, method, params):
+        return self.provider.make_request(method, params)
+
+    def isConnected(self):
+        return self.provider.isConnected()
+
+
+class SerializingProvider(ProviderWrapper):
+    """
+    Sends one request at a time, for providers that are not thread-safe, such
+    as that of the test chain.
+    """
+
+    def __init__(self, provider):
+        super().__init__(provider)
+        self._lock = threading.Lock()
+
+    def make_request(self, method, params):
+        with self._lock:
+            return self.provider.make_request(method, params)
+
+
+class BlockPinningProvider(ProviderWrapper):
+    """
+    Makes every state read inside a ``block_scope()`` at the same block.
+
+    Reads of the "latest" block are sent for the block number that the scope
+    resolved instead, so that all of them observe one consistent state of the
+    chain, and caches below this provider see a stable key.
+    """
+
+    BLOCK_CHANGING_METHODS = frozenset(
+        [
+            "eth_getTransactionReceipt",
+            "eth_sendRawTransaction",
+            "eth_sendTransaction",
+        ]
+    )
+
+    def __init__(self, provider):
+
+        super().__init__(provider)
+
+        innermost = provider
+        while isinstance(innermost, (ProviderWrapper, ProviderPool)):
+            if isinstance(innermost, ProviderPool):
+                innermost = innermost.providers[0]
+            else:
+                innermost = innermost.provider
+
+        # request formatting happens before wrappers get the request, and the
+        # tester's formatting expects block numbers as integers
+        if isinstance(innermost, EthereumTesterProvider):
+            self._format_block_number = int
+        else:
+            self._format_block_number = hex
+
+    def get_block_number(self):
+        """
+        Get the number of the block that reads are pinned to, or of the latest
+        block if called outside of a ``block_scope()``.
+        """
+
+        scope = _current_block_scope.get()
+
+        if scope is None:
+            return self._get_latest_block_number()
+
+        with scope.lock:
+            if scope.block_number is None:
+                scope.block_number = self._get_latest_block_number()
+            return scope.block_number
+
+    def make_request(self, method, params):
+
+        scope = _current_block_scope.get()
+
+        if scope is None:
+            return self.provider.make_request(method, params)
+
+        index = _BLOCK_PARAMETER_INDICES.get(method)
+
+        if index is not None and (
+            len(params) <= index or params[index] == "latest"
+        ):
+            params = [
+                *params[:index],
+                self._format_block_number(self.get_block_number()),
+                *params[index + 1 :],
+            ]
+
+        response = self.provider.make_request(method, params)
+
+        if method in self.BLOCK_CHANGING_METHODS:
+            with scope.lock:
+                scope.block_number = None
+
+        return response
+
+    def _get_latest_block_number(self):
+        return _to_int(
+            self.provider.make_request("eth_blockNumber", [])["result"]
+        )
+
+
+class CachingProvider(ProviderWrapper):
+    """
+    Read-through LRU cache of RPC responses.
+
+    Only state reads made at a given block number, such as those pinned by
+    ``BlockPinningProvider``, and requests for constants of the chain are
+    cached. Entries are dropped as soon as a read at a newer block is made.
+    """
+
+    CONSTANT_METHODS = frozenset(["eth_chainId", "net_version"])
+
+    def __init__(self, provider, max_entries):
+
+        super().__init__(provider)
+
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._block_number = None
+        self._entries = OrderedDict()
+        self._constants = {}
+
+    def get_stats(self):
+
+        with self._lock:
+            return {
+                "block_number": self._block_number,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def make_request(self, method, params):
+
+        if method in self.CONSTANT_METHODS:
+            if method not in self._constants:
+                response = self.provider.make_request(method, params)
+                if "error" in response:
+                    return response
+                self._constants[method] = response
+            return self._constants[method]
+
+        block_number = _get_block_parameter(method, params)
+
+        if block_number is None:
+            return self.provider.make_request(method, params)
+
+        key = (method, json.dumps(params, sort_keys=True, default=repr))
+
+        with self._lock:
+
+            if self._block_number is None or block_number > self._block_number:
+                self._block_number = block_number
+                self._entries.clear()
+
+            elif block_number == self._block_number and key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+            self.misses += 1
+
+        response = self.provider.make_request(method, params)
+
+        if "error" not in response:
+            with self._lock:
+                if block_number == self._block_number:
+                    self._entries[key] = response
+                    if len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+
+        return response
+
+
+# ---------------------------------------------------------------------------- #
+
+
+def send_batch(provider, requests):
+    """
+    Send several requests to a provider as a single JSON-RPC batch.
+
+    Providers that do not speak JSON-RPC over HTTP or WebSockets get the
+    requests one at a time.
+
+    Parameters
+    ----------
+    provider : web3.providers.BaseProvider
+
+        The provider to send the requests to.
+
+    requests : list
+
+        The (method, params) pairs to send.
+
+    Returns
+    -------
+    list
+        The responses, in the same order as the requests.
+    """
+
+    if len(requests) > 1 and hasattr(provider, "make_batch_request"):
+        return provider.make_batch_request(requests)
+
+    if len(requests) < 2 or not isinstance(
+        provider, (HTTPProvider, WebsocketProvider)
+    ):
+        return [provider.make_request(m, p) for (m, p) in requests]
+
+    request_data = (
+        FriendlyJsonSerde()
+        .json_encode(
+            [
+                {
+                    "jsonrpc": "2.0",
+                    "method": method,
+                    "params": params or [],
+                    "id": i,
+                }
+                for (i, (method, params)) in enumerate(requests)
+            ]
+        )
+        .encode()
+    )
+
+    if isinstance(provider, HTTPProvider):
+        responses = provider.decode_rpc_response(
+            make_post_request(
+                provider.endpoint_uri,
+                request_data,
+                **provider.get_request_kwargs(),
+            )
+        )
+    else:
+        responses = asyncio.run_coroutine_threadsafe(
+            provider.coro_make_request(request_data), WebsocketProvider._loop
+        ).result()
+
+    if not isinstance(responses, list):
+        # the node does not support batches
+        return [provider.make_request(m, p) for (m, p) in requests]
+
+    responses_by_id = {r.get("id"): r for r in responses}
+
+    return [responses_by_id[i] for i in range(len(requests))]
+
+
+class _PendingRequest:
+
+    __slots__ = ("method", "params", "response", "error", "sent", "done")
+
+    def __init__(self, method, params):
+        self.method = method
+        self.params = params
+        self.response = None
+        self.error = None
+        self.sent = False
+        self.done = False
+
+
+class BatchingProvider(ProviderWrapper):
+    """
+    Groups requests made concurrently by ``map()`` workers into batches.
+
+    Every thread running the function given to ``map()`` is a worker. Workers
+    block on their requests until every running worker has a request waiting
+    and no batch is in flight, and the waiting requests are then sent as a
+    single JSON-RPC batch.
+    A listing that takes k sequential round trips per loan therefore takes k
+    round trips per ETHEREUM_MAX_CONCURRENCY loans. Requests made outside of
+    ``map()`` are sent as usual.
+    """
+
+    MAX_WAIT = 0.05
+    """Seconds to wait for workers that are busy with something else."""
+
+    def __init__(self, provider, enabled=True):
+
+        super().__init__(provider)
+
+        self.enabled = enabled
+
+        self._condition = threading.Condition()
+        self._workers = 0
+        self._pending = []
+        self._in_flight = 0
+
+        self._worker_flag = threading.local()
+
+    def map(self, function, items):
+        """
+        Apply a function to every item concurrently, using ``fan_out()``, and
+        batch the requests it makes.
+
+        Returns the results in the same order as the items.
+        """
+
+        items = list(items)
+
+        if not self.enabled:
+            return fan_out(function, items)
+
+        # Each worker takes items until none are left, and is only counted
+        # while it is running on the pool, which may be busy with workers of
+        # other calls. Workers that are still queued would otherwise hold up
+        # every round until MAX_WAIT.
+
+        results = [None] * len(items)
+        indices = iter(range(len(items)))
+        failed = False
+
+        def work(_):
+
+            nonlocal failed
+
+            with self._condition:
+                self._workers += 1
+
+            self._worker_flag.active = True
+
+            try:
+                while True:
+
+                    with self._condition:
+                        i = None if failed else next(indices, None)
+
+                    if i is None:
+                        return
+
+                    try:
+                        results[i] = function(items[i])
+                    except BaseException:
+                        failed = True
+                        raise
+
+            finally:
+                self._worker_flag.active = False
+
+                with self._condition:
+                    self._workers -= 1
+                    self._condition.notify_all()
+
+        fan_out(work, range(min(len(items), settings.ETHEREUM_MAX_CONCURRENCY)))
+
+        return results
+
+    def make_request(self, method, params):
+
+        if not getattr(self._worker_flag, "active", False):
+            return self.provider.make_request(method, params)
+
+        request = _PendingRequest(method, params)
+
+        with self._condition:
+
+            self._pending.append(request)
+
+            # workers with a request in flight are waited for without a
+            # timeout, as they are back as soon as its batch is answered
+
+            while not request.sent and not self._is_round_complete():
+                if not self._condition.wait(self.MAX_WAIT):
+                    if not self._in_flight:
+                        break
+
+            batch = None if request.sent else self._take_pending()
+
+        if batch is not None:
+            self._send(batch)
+
+        with self._condition:
+            while not request.done:
+                self._condition.wait()
+
+        if request.error is not None:
+            raise request.error
+
+        return request.response
+
+    def _is_round_complete(self):
+        return not self._in_flight and len(self._pending) >= self._workers
+
+    def _take_pending(self):
+        """
+        Mark all pending requests as sent. Must be called with the condition
+        held.
+        """
+
+        batch, self._pending = self._pending, []
+
+        for request in batch:
+            request.sent = True
+
+        self._in_flight += len(batch)
+        self._condition.notify_all()
+
+        return batch
+
+    def _send(self, batch):
+
+        try:
+            responses = send_batch(
+                self.provider, [(r.method, r.params) for r in batch]
+            )
+        except Exception as e:
+            responses = None
+            error = e
+
+        with self._condition:
+
+            for (i, request) in enumerate(batch):
+                if responses is None:
+                    request.error = error
+                else:
+                    request.response = responses[i]
+                request.done = True
+
+            self._in_flight -= len(batch)
+            self._condition.notify_all()
+
+
+# ---------------------------------------------------------------------------- #
+
+
+def _get_required_block(method, params):
+    """
+    Get the block number a node must have reached to answer a request, or
+    None if any node can.
+    """
+
+    if method == "eth_getBlockByNumber" and params:
+        block = params[0]
+    elif method == "eth_getLogs" and params and isinstance(params[0], dict):
+        block = params[0].get("toBlock")
+    else:
+        return _get_block_parameter(method, params)
+
+    if isinstance(block, int) or (
+        isinstance(block, str) and block.startswith("0x")
+    ):
+        return _to_int(block)
+    else:
+        return None
+
+
+def _is_error(response):
+    """
+    Check whether a response, or any response of a batch, is a JSON-RPC error.
+    """
+
+    if isinstance(response, list):
+        return any("error" in r for r in response)
+    else:
+        return "error" in response
+
+
+_CONNECTION_ERRORS = (OSError, asyncio.TimeoutError, ConnectionClosed)
+"""Errors meaning that a node could not be reached, including HTTP errors."""
+
+
+class _Node:
+
+    __slots__ = (
+        "provider",
+        "reachable",
+        "latency",
+        "block_number",
+        "requests",
+        "failures",
+    )
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.reachable = True
+        self.latency = None
+        self.block_number = None
+        self.requests = 0
+        self.failures = 0
+
+
+class ProviderPool(BaseProvider):
+    """
+    Sends requests to the fastest healthy one of several nodes of a chain.
+
+    Every node is probed for its latest block number every ``probe_interval``
+    seconds by a background thread, which keeps a moving average of how long
+    it takes to answer. A node is healthy if the last probe or request sent to
+    it succeeded, and it is at most MAX_BLOCK_LAG blocks behind the others.
+    Requests for a given block, such as reads pinned to one, leave out the
+    nodes last seen below it, unless all of them are.
+
+    A request that cannot reach a node is retried on the next one, and the
+    node is left out until a probe reaches it again. Error responses are
+    returned as usual, without trying the other nodes.
+
+    With a nonzero ``hedge_percentile``, read-only requests that take longer
+    than that percentile of the latest requests are also sent to the next
+    node, and whichever answers first without an error is used. Requests that
+    may change the state of the chain are never sent twice.
+    """
+
+    MAX_BLOCK_LAG = 2
+
+    LATENCY_SMOOTHING = 0.3
+    """Weight of the latest probe in the moving average of a node's latency."""
+
+    HEDGE_SAMPLES = 1000
+    """Number of latest request durations that the hedge delay is taken from."""
+
+    MIN_HEDGE_SAMPLES = 20
+
+    READ_ONLY_METHODS = frozenset(
+        [
+            "eth_blockNumber",
+            "eth_call",
+            "eth_chainId",
+            "eth_gasPrice",
+            "eth_getBalance",
+            "eth_getBlockByHash",
+            "eth_getBlockByNumber",
+            "eth_getCode",
+            "eth_getLogs",
+            "eth_getStorageAt",
+            "eth_getTransactionByHash",
+            "eth_getTransactionReceipt",
+            "net_version",
+        ]
+    )
+    """
+    Methods that can be hedged. Nonces and gas estimates are left out, since
+    a node that is behind would give stale ones for a transaction.
+    """
+
+    def __init__(self, providers, probe_interval, hedge_percentile=0):
+
+        super().__init__()
+
+        self.providers = list(providers)
+        self.probe_interval = probe_interval
+        self.hedge_percentile = hedge_percentile
+
+        # every node of a pool is expected to be of the same kind
+        self.middlewares = self.providers[0].middlewares
+
+        self._lock = threading.Lock()
+        self._nodes = [_Node(p) for p in self.providers]
+        self._probing = False
+
+        self._durations = deque(maxlen=self.HEDGE_SAMPLES)
+        self._hedge_executor = None
+        self.hedges_sent = 0
+        self.hedges_won = 0
+
+    def get_stats(self):
+
+        hedge_delay = self._get_hedge_delay()
+
+        with self._lock:
+            healthy = self._get_healthy_nodes()
+            return {
+                "hedge_delay": hedge_delay,
+                "hedges_sent": self.hedges_sent,
+                "hedges_won": self.hedges_won,
+                "nodes": [
+                    {
+                        "provider": str(node.provider),
+                        "healthy": node in healthy,
+                        "latency": node.latency,
+                        "block_number": node.block_number,
+                        "requests": node.requests,
+                        "failures": node.failures,
+                    }
+                    for node in self._nodes
+                ],
+            }
+
+    def make_request(self, method, params):
+        return self._send(
+            lambda p: p.make_request(method, params),
+            hedge=method in self.READ_ONLY_METHODS,
+            block_number=_get_required_block(method, params),
+        )
+
+    def make_batch_request(self, requests):
+
+        block_numbers = [
+            _get_required_block(method, params) for (method, params) in requests
+        ]
+
+        return self._send(
+            lambda p: send_batch(p, requests),
+            hedge=all(m in self.READ_ONLY_METHODS for (m, _) in requests),
+            block_number=max(
+                (b for b in block_numbers if b is not None), default=None
+            ),
+        )
+
+    def isConnected(self):
+        return any(p.isConnected() for p in self.providers)
+
+    def _send(self, function, hedge, block_number=None):
+
+        self._start_probing()
+
+        nodes = self._get_candidates(block_number)
+        hedge_delay = self._get_hedge_delay() if hedge else None
+
+        if hedge_delay is None:
+            return self._send_to_first_reachable(function, nodes)
+
+        executor = self._get_hedge_executor()
+
+        primary = executor.submit(
+            self._send_to_first_reachable, function, nodes
+        )
+
+        if wait([primary], timeout=hedge_delay).done:
+            return primary.result()
+
+        # the hedge goes to the next node, and fails over to the others
+        hedge = executor.submit(
+            self._send_to_first_reachable, function, [*nodes[1:], nodes[0]]
+        )
+
+        with self._lock:
+            self.hedges_sent += 1
+
+        pending = {primary, hedge}
+
+        # a node that is behind may answer with an error, such as a missing
+        # block, which the other node could have answered
+
+        while pending:
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future.exception() is None and not _is_error(
+                    future.result()
+                ):
+                    if future is hedge:
+                        with self._lock:
+                            self.hedges_won += 1
+                    return future.result()
+
+        # both failed, so the primary's outcome is used
+        return primary.result()
+
+    def _send_to_first_reachable(self, function, nodes):
+
+        for node in nodes:
+
+            start = time.monotonic()
+
+            try:
+                response = function(node.provider)
+            except _CONNECTION_ERRORS as e:
+                error = e
+                with self._lock:
+                    node.reachable = False
+                    node.failures += 1
+            else:
+                with self._lock:
+                    node.reachable = True
+                    node.requests += 1
+                    self._durations.append(time.monotonic() - start)
+                return response
+
+        raise error
+
+    def _get_hedge_delay(self):
+        """
+        Get the number of seconds after which requests are hedged, or None if
+        hedging is disabled or there are not enough samples yet.
+        """
+
+        if not self.hedge_percentile or len(self.providers) < 2:
+            return None
+
+        with self._lock:
+            durations = sorted(self._durations)
+
+        if len(durations) < self.MIN_HEDGE_SAMPLES:
+            return None
+
+        index = int(len(durations) * self.hedge_percentile / 100)
+
+        return durations[min(index, len(durations) - 1)]
+
+    def _get_hedge_executor(self):
+
+        with self._lock:
+
+            if self._hedge_executor is None:
+                # up to a primary request and a hedge per concurrent read
+                self._hedge_executor = ThreadPoolExecutor(
+                    max_workers=4 * settings.ETHEREUM_MAX_CONCURRENCY,
+                    thread_name_prefix="tuichain-hedge",
+                )
+
+            return self._hedge_executor
+
+    def _get_candidates(self, block_number=None):
+        """
+        Get the nodes in the order they should be tried in: healthy ones by
+        latency, then the others, in case the probes are out of date.
+
+        If a block number is given, the nodes last seen below it are left out,
+        unless all of them are, in which case they are tried from the highest.
+        """
+
+        with self._lock:
+
+            healthy = self._get_healthy_nodes()
+            nodes = self._nodes
+
+            if block_number is not None:
+
+                synced = [
+                    node
+                    for node in nodes
+                    if node.block_number is None
+                    or node.block_number >= block_number
+                ]
+
+                if not synced:
+                    return sorted(nodes, key=lambda node: -node.block_number)
+
+                nodes = synced
+
+            return sorted(
+                nodes,
+                key=lambda node: (node not in healthy, node.latency or 0),
+            )
+
+    def _get_healthy_nodes(self):
+        """
+        Must be called with the lock held.
+        """
+
+        reachable = [node for node in self._nodes if node.reachable]
+
+        block_numbers = [
+            node.block_number
+            for node in reachable
+            if node.block_number is not None
+        ]
+
+        if not block_numbers:
+            return reachable
+
+        min_block_number = max(block_numbers) - self.MAX_BLOCK_LAG
+
+        return [
+            node
+            for node in reachable
+            if node.block_number is None
+            or node.block_number >= min_block_number
+        ]
+
+    def _start_probing(self):
+
+        with self._lock:
+
+            if self._probing:
+                return
+
+            self._probing = True
+
+        for node in self._nodes:
+            threading.Thread(
+                target=self._probe_forever,
+                args=(node,),
+                name="tuichain-probe",
+                daemon=True,
+            ).start()
+
+    def _probe_forever(self, node):
+
+        while True:
+            self._probe(node)
+            time.sleep(self.probe_interval)
+
+    def _probe(self, node):
+
+        start = time.monotonic()
+
+        try:
+            response = node.provider.make_request("eth_blockNumber", [])
+            block_number = _to_int(response["result"])
+        except Exception:
+            with self._lock:
+                node.reachable = False
+            return
+
+        latency = time.monotonic() - start
+
+        with self._lock:
+
+            node.reachable = True
+            node.block_number = block_number
+
+            if node.latency is None:
+                node.latency = latency
+            else:
+                node.latency += self.LATENCY_SMOOTHING * (
+                    latency - node.latency
+                )
+
+
+# ---------------------------------------------------------------------------- #
@@ -1,3 +1,1382 @@
-from django.test import TestCase
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from eth_account import Account
+from eth_tester import EthereumTester
+from rest_framework.test import APIClient
+from tuichain_ethereum import LoanPhase
+from web3 import EthereumTesterProvider, Web3
+from web3.exceptions import TransactionNotFound
+
+from tuichain.api.enums import JobState, LoanState
+from tuichain.api.models import (
+    Document,
+    IndexedBlock,
+    Investment,
+    Job,
+    Loan,
+    LoanChainState,
+    LoanPriceSnapshot,
+    MarketEvent,
+)
+from tuichain.api.services import indexer, jobs, market, nonces, providers
+from tuichain.api.services.indexer import TRANSFER_EVENT_TOPIC, ZERO_ADDRESS
+from tuichain.api.services.loans import (
+    filter_by_phase,
+    get_loans_with_unsettled_phase,
+    settle_phases,
+)
+from tuichain.api.services.market import OrderBook
+from tuichain.api.services.nonces import (
+    NonceManagingProvider,
+    sending_transactions,
+)
+from tuichain.api.services.providers import (
+    CachingProvider,
+    ProviderPool,
+    SerializingProvider,
+)
+
+# ---------------------------------------------------------------------------- #
+
+
+class _APITestCase(TestCase):
+    """An admin, logged in to the test client, and their loan requests."""
+
+    def setUp(self):
+
+        self.admin = User.objects.create_superuser("admin", password="admin")
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def _add_loan(self, **fields):
+        return Loan.objects.create(
+            **{
+                "student": self.admin,
+                "school": "school",
+                "course": "course",
+                "destination": "destination",
+                "requested_value_atto_dai": "1000",
+                "description": "description",
+                "recipient_address": "0x" + "ab" * 20,
+                **fields,
+            }
+        )
+
+
+# ---------------------------------------------------------------------------- #
+
+
+# the approved loans are all indexed, which spares the listings from reading
+# the chain
+@override_settings(ETHEREUM_INDEXER_ENABLED=True)
+class ListingQueryCountTests(_APITestCase):
+    """
+    Listings must take the same number of queries however many rows they list.
+    """
+
+    def setUp(self):
+
+        super().setUp()
+
+        self.loan = self._add_loan()
+
+    def _add_approved_loan(self, student):
+
+        loan = self._add_loan(student=student)
+
+        loan.state = LoanState.APPROVED.value
+        loan.identifier = f"0x{loan.id:040x}"
+        loan.token_contract_address = f"0x{loan.id:040x}"
+        loan.expiration_time = datetime.now(timezone.utc) + timedelta(days=1)
+        loan.phase = "FUNDING"
+        loan.save()
+
+        LoanChainState.objects.create(
+            loan=loan,
+            identifier=loan.identifier,
+            token_contract_address=loan.token_contract_address,
+            phase="FUNDING",
+            funded_value_atto_dai="0",
+            current_value_atto_dai="1000",
+            block_number=1,
+        )
+
+        return loan
+
+    def _add_rows(self, count):
+
+        for _ in range(count):
+
+            n = User.objects.count()
+            student = User.objects.create_user(f"student{n}", password="x")
+
+            loan = self._add_loan(student=student)
+            self._add_loan()
+
+            self._add_approved_loan(student)
+            self._add_approved_loan(self.admin)
+
+            for target in [loan, self.loan]:
+                Document.objects.create(name="doc", url="url", loan=target)
+                Document.objects.create(
+                    name="doc",
+                    url="url",
+                    loan=target,
+                    is_public=True,
+                    approved=True,
+                )
+
+    def assertConstantQueries(self, url, num):
+
+        for count in [1, 5]:
+
+            self._add_rows(count)
+
+            with self.assertNumQueries(num):
+                response = self.client.get(url)
+
+            self.assertEqual(response.status_code, 200)
+
+    def test_get_all_users(self):
+        self.assertConstantQueries("/api/users/get_all/", 2)
+
+    def test_get_all_loans(self):
+        # the version of the tables, and whether any loan is not indexed yet
+        self.assertConstantQueries("/api/loans/get_all/", 3)
+
+    def test_get_personal_loans(self):
+        self.assertConstantQueries("/api/loans/get_personal/", 1)
+
+    def test_get_operating_loans(self):
+        self.assertConstantQueries("/api/loans/get_operating/", 1)
+
+    def test_get_specific_state_loans(self):
+        self.assertConstantQueries("/api/loans/get_state/PENDING/1/", 1)
+
+    def test_get_specific_phase_loans(self):
+        self.assertConstantQueries("/api/loans/get_state/FUNDING/1/", 1)
+
+    def test_get_all_unevaluated_documents(self):
+        self.assertConstantQueries(
+            "/api/loans/documents/get_all_unevaluated/", 2
+        )
+
+    def test_get_loan_unevaluated_docs(self):
+        self.assertConstantQueries(
+            f"/api/loans/documents/get_unevaluated_docs/{self.loan.id}/", 2
+        )
+
+    def test_get_loan_approved_public_docs(self):
+        self.assertConstantQueries(
+            f"/api/loans/documents/get_approved_public_docs/{self.loan.id}/", 2
+        )
+
+    def test_get_loan_personal_docs(self):
+        self.assertConstantQueries(
+            f"/api/loans/documents/get_personal_docs/{self.loan.id}/", 2
+        )
+
+
+@override_settings(ETHEREUM_INDEXER_ENABLED=True)
+class ConditionalViewTests(_APITestCase):
+    """
+    Listings are revalidated by ETag and never stored by shared caches.
+    """
+
+    def setUp(self):
+
+        super().setUp()
+
+        self._add_loan()
+
+    def test_cacheable_listing_is_private(self):
+
+        response = self.client.get("/api/loans/get_all/")
+
+        self.assertIn("private", response["Cache-Control"])
+        self.assertNotIn("public", response["Cache-Control"])
+        self.assertIn("Authorization", response["Vary"])
+        self.assertIn("Last-Modified", response)
+
+        response = self.client.get(
+            "/api/loans/get_all/", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(ETHEREUM_INDEXER_ENABLED=True)
+class LoanValueTests(_APITestCase):
+    """
+    Requested values are compared, summed and bucketed by the database.
+    """
+
+    def setUp(self):
+
+        super().setUp()
+
+        for value in [30, 10, 20, 10, 40]:
+            self._add_loan(requested_value_atto_dai=value * 10 ** 18)
+
+    def test_sort_and_filter_by_requested_value(self):
+
+        url = (
+            "/api/loans/get_all/?sort=-requested_value_atto_dai&page_size=1"
+            f"&max_requested_value_atto_dai={30 * 10 ** 18}"
+        )
+        values = []
+
+        while url:
+            response = self.client.get(url)
+            values += [
+                int(loan["requested_value_atto_dai"]) // 10 ** 18
+                for loan in response.data["loans"]
+            ]
+            url = response.data["next"]
+
+        self.assertEqual(values, [30, 20, 10, 10])
+
+    def test_get_loan_value_statistics(self):
+
+        response = self.client.get("/api/loans/get_value_statistics/?buckets=3")
+
+        self.assertEqual(response.data["count"], 5)
+        self.assertEqual(response.data["total_atto_dai"], str(110 * 10 ** 18))
+        self.assertEqual(response.data["average_atto_dai"], str(22 * 10 ** 18))
+        self.assertEqual(response.data["states"]["PENDING"]["count"], 5)
+        self.assertEqual(
+            [bucket["count"] for bucket in response.data["histogram"]],
+            [2, 1, 2],
+        )
+
+    def test_exact_requested_value(self):
+
+        value = 2 ** 70 + 1
+
+        loan = self._add_loan(requested_value_atto_dai=value)
+        loan = Loan.objects.get(id=loan.id)
+
+        self.assertEqual(loan.to_dict()["requested_value_atto_dai"], str(value))
+
+        job = Job.objects.create(loan=loan, kind="create_loan", arguments="{}")
+        controller = mock.MagicMock()
+        fetched_loan = controller.loans.create.return_value.get.return_value
+        fetched_loan.identifier = "0x" + "01" * 20
+        fetched_loan.token_contract_address = "0x" + "02" * 20
+        fetched_loan.expiration_time = datetime.now(timezone.utc)
+
+        with mock.patch("tuichain.api.services.jobs.controller", controller):
+            jobs._create_loan(job, 30, 0, 0)
+
+        self.assertEqual(
+            controller.loans.create.call_args.kwargs[
+                "requested_value_atto_dai"
+            ],
+            value,
+        )
+
+
+class LoanValidationTests(_APITestCase):
+    """
+    A loan request is validated once, by a single job.
+    """
+
+    def setUp(self):
+
+        super().setUp()
+
+        self.loan = self._add_loan()
+
+    def test_validate_twice(self):
+
+        data = {
+            "days_to_expiration": 30,
+            "funding_fee_atto_dai_per_dai": 0,
+            "payment_fee_atto_dai_per_dai": 0,
+        }
+
+        statuses = [
+            self.client.put(
+                f"/api/loans/validate/{self.loan.id}/", data, format="json"
+            ).status_code
+            for _ in range(2)
+        ]
+
+        self.assertEqual(statuses, [202, 403])
+        self.assertEqual(Job.objects.filter(loan=self.loan).count(), 1)
+
+        # nor withdrawn once being validated
+        response = self.client.put(f"/api/loans/user_withdraw/{self.loan.id}/")
+
+        self.assertEqual(response.status_code, 400)
+
+
+class LoanPhaseTests(_APITestCase):
+    """
+    Funding loans are read from the chain again until it reports them settled.
+    """
+
+    def setUp(self):
+
+        super().setUp()
+
+        now = datetime.now(timezone.utc)
+
+        self.loans = {
+            (phase, days): self._add_loan(
+                state=LoanState.APPROVED.value,
+                phase=phase,
+                expiration_time=now + timedelta(days=days),
+            )
+            for phase in [None, "FUNDING", "ACTIVE"]
+            for days in [-1, 1]
+        }
+
+    def test_expired_funding_loans_are_unsettled(self):
+
+        self.assertEqual(
+            set(get_loans_with_unsettled_phase()),
+            {
+                self.loans[(phase, days)]
+                for phase in [None, "FUNDING"]
+                for days in [-1, 1]
+            },
+        )
+
+        # but listed as expired until the chain says otherwise
+        self.assertEqual(
+            set(filter_by_phase(Loan.objects.all(), "EXPIRED")),
+            {self.loans[("FUNDING", -1)]},
+        )
+
+    def test_settle_phases(self):
+
+        for (i, loan) in enumerate(self.loans.values()):
+            loan.identifier = f"0x{i + 1:040x}"
+            loan.save()
+
+        controller = mock.MagicMock()
+        fetched_loan = controller.loans.get_by_identifier.return_value
+        fetched_loan.get_state.return_value.phase.name = "ACTIVE"
+
+        with mock.patch("tuichain.api.services.loans.controller", controller):
+            self.assertEqual(settle_phases(), 4)
+
+        self.assertEqual(controller.loans.get_by_identifier.call_count, 4)
+        self.assertFalse(get_loans_with_unsettled_phase().exists())
+
+
+class PriceHistoryTests(_APITestCase):
+    """
+    Price history buckets are computed by the database, for bounded ranges.
+    """
+
+    def setUp(self):
+
+        super().setUp()
+
+        self.loan = self._add_loan()
+
+        self.start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+        # prices past 64 bits, in two hourly buckets
+        for minutes, price in [(0, 5), (20, 70), (40, 3), (60, 9), (80, 2)]:
+            LoanPriceSnapshot.objects.create(
+                loan=self.loan,
+                time=self.start + timedelta(minutes=minutes),
+                current_value_atto_dai=str(price * 10 ** 19),
+                funded_value_atto_dai=str(minutes),
+                sell_positions=minutes,
+                amount_tokens_for_sale="1",
+            )
+
+    def _get(self, interval, hours):
+
+        start = int(self.start.timestamp())
+
+        return self.client.get(
+            f"/api/loans/get_price_history/{self.loan.id}/"
+            f"?interval={interval}&start={start}&end={start + hours * 3600}"
+        )
+
+    def test_get_loan_price_history(self):
+
+        with self.assertNumQueries(3):
+            response = self._get(3600, 2)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [
+                [
+                    int(b[k]) // 10 ** 19
+                    for k in ["open", "high", "low", "close"]
+                ]
+                for b in response.data["buckets"]
+            ],
+            [[5, 70, 3, 3], [9, 9, 2, 2]],
+        )
+        self.assertEqual(response.data["buckets"][1]["sell_positions"], 80)
+
+    def test_ranges_of_too_many_intervals_are_rejected(self):
+
+        self.assertEqual(self._get(1, 24).status_code, 400)
+
+
+class _ChainAddress:
+    """Like the addresses of tuichain_ethereum, which do not order as str."""
+
+    def __init__(self, value):
+        self._value = value
+
+    def __str__(self):
+        return self._value
+
+
+@override_settings(ETHEREUM_INDEXER_ENABLED=False)
+class LiveSellPositionTests(_APITestCase):
+    """
+    Sell positions read from the chain are paginated by seller address.
+    """
+
+    def setUp(self):
+
+        super().setUp()
+
+        self.loan = self._add_loan(
+            state=LoanState.APPROVED.value,
+            identifier="0x" + "01" * 20,
+        )
+
+        controller = mock.MagicMock()
+        fetched_loan = controller.loans.get_by_identifier.return_value
+        fetched_loan.get_state.return_value.phase.name = "FINALIZED"
+        controller.market.get_sell_positions_by_loan.return_value = [
+            SimpleNamespace(
+                seller_address=_ChainAddress("0x" + c * 40),
+                amount_tokens=1,
+                price_atto_dai_per_token=10 ** 18,
+            )
+            for c in "c3a"
+        ]
+
+        for patcher in [
+            mock.patch("tuichain.api.views.loans.controller", controller),
+            mock.patch("tuichain.api.decorators.block_pinner"),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_get_general_investments_pages(self):
+
+        url = f"/api/investments/get/{self.loan.id}/?page_size=2"
+        sellers = []
+
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            investment = response.data["investment"]
+            sellers += [
+                sp["seller_address"] for sp in investment["sell_positions"]
+            ]
+            url = response.data["next"]
+
+        self.assertEqual(sellers, ["0x" + c * 40 for c in "3ac"])
+
+
+class _NodeProvider(EthereumTesterProvider):
+    """A node of its own chain, which can be taken down and counts requests."""
+
+    def __init__(self, blocks):
+
+        self.tester = EthereumTester()
+        self.tester.mine_blocks(blocks)
+
+        super().__init__(self.tester)
+
+        self.reachable = True
+        self.failing = False
+        self.delay = 0
+        self.methods = []
+
+    def make_request(self, method, params):
+
+        if not self.reachable:
+            raise ConnectionError("Node is down")
+
+        self.methods.append(method)
+        time.sleep(self.delay)
+
+        if self.failing:
+            return {"error": {"code": -32000, "message": "Node is failing"}}
+
+        return super().make_request(method, params)
+
+
+class ProviderPoolTests(SimpleTestCase):
+    """
+    Requests go to the fastest node that is reachable and has their block.
+    """
+
+    def setUp(self):
+
+        # the fastest node is behind, and the slowest is ahead
+        self.nodes = [_NodeProvider(b) for b in [0, 4, 5]]
+
+        self.pool = ProviderPool(self.nodes, probe_interval=3600)
+        self.pool._probing = True  # probed by the tests instead
+
+        for node, latency in zip(self.pool._nodes, [0.01, 0.02, 0.03]):
+            self.pool._probe(node)
+            node.latency = latency
+
+        for node in self.nodes:
+            node.methods.clear()
+
+    def _get_balance_at(self, block_number):
+
+        account = self.nodes[0].tester.get_accounts()[0]
+
+        return self.pool.make_request("eth_getBalance", [account, block_number])
+
+    def test_probe_leaves_out_lagging_nodes(self):
+
+        with self.pool._lock:
+            healthy = self.pool._get_healthy_nodes()
+
+        self.assertEqual(
+            [node.block_number for node in healthy],
+            [4, 5],
+        )
+
+        self.pool.make_request("eth_chainId", [])
+
+        self.assertEqual(self.nodes[1].methods, ["eth_chainId"])
+
+    def test_pinned_reads_skip_nodes_below_their_block(self):
+
+        self._get_balance_at(5)
+
+        self.assertEqual(self.nodes[0].methods, [])
+        self.assertEqual(self.nodes[1].methods, [])
+        self.assertEqual(self.nodes[2].methods, ["eth_getBalance"])
+
+        # no node has it, so the highest one is asked
+        self._get_balance_at(6)
+
+        self.assertEqual(self.nodes[2].methods, ["eth_getBalance"] * 2)
+
+    def test_hedges_win_only_with_answers(self):
+
+        self.pool.hedge_percentile = 50
+        self.pool._durations.extend([0.001] * self.pool.MIN_HEDGE_SAMPLES)
+
+        # the primary node errs after the hedge is sent, before it answers
+        self.nodes[1].failing = True
+        self.nodes[1].delay = 0.05
+        self.nodes[2].delay = 0.2
+
+        response = self.pool.make_request("eth_chainId", [])
+
+        self.assertNotIn("error", response)
+        self.assertEqual(self.pool.hedges_sent, 1)
+        self.assertEqual(self.pool.hedges_won, 1)
+
+        # with no answer to prefer, the primary's error is returned
+        self.nodes[2].failing = True
+
+        response = self.pool.make_request("eth_chainId", [])
+
+        self.assertIn("error", response)
+        self.assertEqual(self.pool.hedges_won, 1)
+
+    def test_failover(self):
+
+        self.nodes[1].reachable = False
+
+        response = self.pool.make_request("eth_blockNumber", [])
+
+        self.assertEqual(response["result"], 5)
+        self.assertFalse(self.pool._nodes[1].reachable)
+        self.assertEqual(self.pool._nodes[1].failures, 1)
+
+        # until a probe reaches it again, it is tried last
+        self.pool.make_request("eth_blockNumber", [])
+
+        self.assertEqual(self.pool._nodes[1].failures, 1)
+        self.assertEqual(self.nodes[2].methods, ["eth_blockNumber"] * 2)
+
+        self.nodes[1].reachable = True
+        self.pool._probe(self.pool._nodes[1])
+        self.nodes[1].methods.clear()
+        self.pool.make_request("eth_blockNumber", [])
+
+        self.assertEqual(self.nodes[1].methods, ["eth_blockNumber"])
+
+        for node in self.nodes:
+            node.reachable = False
+
+        with self.assertRaises(ConnectionError):
+            self.pool.make_request("eth_blockNumber", [])
+
+
+class CachingProviderTests(SimpleTestCase):
+    """
+    Only reads at a block and constants of the chain are cached, for the
+    newest block read, up to a number of entries.
+    """
+
+    def setUp(self):
+
+        self.node = _NodeProvider(3)
+        self.cache = CachingProvider(self.node, max_entries=2)
+        self.accounts = self.node.tester.get_accounts()
+
+    def _get_balance(self, account, block_number):
+        return self.cache.make_request(
+            "eth_getBalance", [self.accounts[account], block_number]
+        )
+
+    def test_reads_at_a_block_are_cached(self):
+
+        responses = [self._get_balance(0, 2) for _ in range(2)]
+
+        self.assertEqual(responses[0], responses[1])
+        self.assertEqual(self.node.methods, ["eth_getBalance"])
+        self.assertEqual(self.cache.hits, 1)
+
+        self.cache.make_request("eth_chainId", [])
+        self.cache.make_request("eth_chainId", [])
+
+        self.assertEqual(self.node.methods.count("eth_chainId"), 1)
+
+    def test_other_requests_are_not_cached(self):
+
+        for _ in range(2):
+            self._get_balance(0, "latest")
+            self.cache.make_request("eth_blockNumber", [])
+
+        self.assertEqual(
+            self.node.methods, ["eth_getBalance", "eth_blockNumber"] * 2
+        )
+
+        # nor are errors
+        self.node.failing = True
+        self.assertIn("error", self._get_balance(0, 2))
+
+        self.node.failing = False
+        self.assertNotIn("error", self._get_balance(0, 2))
+
+        self.assertEqual(self.node.methods.count("eth_getBalance"), 4)
+
+    def test_least_recently_used_entries_are_evicted(self):
+
+        for account in [0, 1, 0, 2, 0, 1]:
+            self._get_balance(account, 2)
+
+        # the read of account 2 evicted account 1, and not the reused 0
+        self.assertEqual(self.cache.hits, 2)
+        self.assertEqual(self.cache.misses, 4)
+        self.assertEqual(self.cache.get_stats()["entries"], 2)
+
+    def test_newer_blocks_replace_older_ones(self):
+
+        self._get_balance(0, 2)
+        self._get_balance(0, 3)
+
+        # the older block is no longer cached, nor cached again
+        self._get_balance(0, 2)
+        self._get_balance(0, 2)
+        self._get_balance(0, 3)
+
+        self.assertEqual(self.node.methods.count("eth_getBalance"), 4)
+        self.assertEqual(self.cache.get_stats()["block_number"], 3)
+
+
+# a contract that emits Transfer(from, to, amount) for the words it is called
+# with, standing in for a loan token
+_TOKEN_RUNTIME = (
+    "60606000600037"  # calldatacopy(0, 0, 96)
+    "602035600035"  # calldataload(32), calldataload(0)
+    "7f" + TRANSFER_EVENT_TOPIC[2:] + "60206040a3"  # log3(64, 32, ...)
+    "00"
+)
+_TOKEN_CODE = (
+    f"0x60{len(_TOKEN_RUNTIME) // 2:02x}600c60003960{len(_TOKEN_RUNTIME) // 2:02x}"
+    f"6000f3{_TOKEN_RUNTIME}"
+)
+
+
+class _FakeLoan:
+    """A loan of the fake controller, whose state the tests set."""
+
+    def __init__(self, identifier, token_contract_address):
+
+        self.identifier = identifier
+        self.token_contract_address = token_contract_address
+        self.phase = LoanPhase.FUNDING
+        self.funded_value_atto_dai = 0
+        self.sell_positions = []
+        self.balances = {}
+        self.balance_reads = []
+        self.state_reads = 0
+
+    def get_state(self):
+        self.state_reads += 1
+        return SimpleNamespace(
+            phase=self.phase,
+            funded_value_atto_dai=self.funded_value_atto_dai,
+            redemption_value_atto_dai_per_token=None,
+        )
+
+    def get_token_balance_of(self, address):
+        self.balance_reads.append(str(address))
+        return self.balances.get(str(address), 0)
+
+
+@override_settings(ETHEREUM_INDEXER_START_BLOCK=0)
+class IndexerTests(_APITestCase):
+    """
+    The indexer mirrors loans, sell positions and token holders, resumes where
+    it left off, and reads again what changed in reorganized blocks.
+    """
+
+    def setUp(self):
+
+        super().setUp()
+
+        self.tester = EthereumTester()
+        self.web3 = Web3(EthereumTesterProvider(self.tester))
+        self.account = self.tester.get_accounts()[0]
+        self.holders = self.tester.get_accounts()[1:4]
+
+        receipt = self.web3.eth.waitForTransactionReceipt(
+            self.web3.eth.sendTransaction(
+                {"from": self.account, "data": _TOKEN_CODE, "gas": 200_000}
+            )
+        )
+
+        self.loan = _FakeLoan("0x" + "01" * 20, receipt["contractAddress"])
+
+        controller = SimpleNamespace(
+            loans=SimpleNamespace(
+                get_all=lambda: [self.loan],
+                get_by_identifier=lambda identifier: self.loan,
+            ),
+            market=SimpleNamespace(
+                get_sell_positions_by_loan=lambda loan: loan.sell_positions
+            ),
+        )
+
+        for patcher in [
+            mock.patch("tuichain.api.services.indexer.web3", self.web3),
+            mock.patch("tuichain.api.services.indexer.controller", controller),
+            mock.patch.dict("tuichain.api.services.indexer._order_books"),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self._add_loan(
+            state=LoanState.APPROVED.value,
+            identifier=self.loan.identifier,
+        )
+
+    def _transfer(self, to, amount, sender=ZERO_ADDRESS):
+
+        for (holder, change) in [(sender, -amount), (to, amount)]:
+            self.loan.balances[holder] = (
+                self.loan.balances.get(holder, 0) + change
+            )
+
+        self.web3.eth.sendTransaction(
+            {
+                "from": self.account,
+                "to": self.loan.token_contract_address,
+                "data": "0x"
+                + "".join(
+                    f"{int(value, 16) if isinstance(value, str) else value:064x}"
+                    for value in [sender, to, amount]
+                ),
+                "gas": 100_000,
+            }
+        )
+
+    def _get_balances(self):
+        return dict(
+            Investment.objects.values_list("investor_address", "amount_tokens")
+        )
+
+    def test_sync(self):
+
+        self._transfer(self.holders[0], 5)
+        self._transfer(self.holders[1], 2)
+
+        # logs are requested in several ranges, but loans are read once
+        with mock.patch("tuichain.api.services.indexer.MAX_BLOCK_RANGE", 1):
+            self.assertEqual(indexer.sync(), self.web3.eth.blockNumber)
+
+        self.assertEqual(self.loan.state_reads, 1)
+
+        loan_state = LoanChainState.objects.get()
+
+        self.assertEqual(loan_state.loan.identifier, self.loan.identifier)
+        self.assertEqual(loan_state.phase, "FUNDING")
+        self.assertEqual(loan_state.loan.phase, "FUNDING")
+        self.assertEqual(
+            self._get_balances(), {self.holders[0]: "5", self.holders[1]: "2"}
+        )
+        self.assertEqual(
+            list(MarketEvent.objects.values_list("kind", flat=True)),
+            ["phase", "funded_value", "price"],
+        )
+
+    def test_resumed_sync(self):
+
+        self._transfer(self.holders[0], 5)
+        indexer.sync()
+
+        self.loan.phase = LoanPhase.ACTIVE
+        self.loan.funded_value_atto_dai = 10
+        self.loan.sell_positions = [
+            SimpleNamespace(
+                seller_address=self.holders[0],
+                amount_tokens=2,
+                price_atto_dai_per_token=3 * 10 ** 18,
+            )
+        ]
+        self.loan.balance_reads.clear()
+
+        self._transfer(self.holders[1], 1, sender=self.holders[0])
+
+        indexer.sync()
+
+        # only the holders in the new blocks are read again
+        self.assertEqual(
+            sorted(self.loan.balance_reads), sorted(self.holders[:2])
+        )
+
+        loan_state = LoanChainState.objects.get()
+
+        self.assertEqual(loan_state.phase, "ACTIVE")
+        self.assertEqual(loan_state.current_value_atto_dai, str(3 * 10 ** 18))
+        self.assertEqual(
+            self._get_balances(), {self.holders[0]: "4", self.holders[1]: "1"}
+        )
+        self.assertEqual(
+            Investment.objects.get(
+                investor_address=self.holders[0]
+            ).sell_amount_tokens,
+            "2",
+        )
+
+        # nothing new
+        self.loan.balance_reads.clear()
+        indexer.sync()
+
+        self.assertEqual(self.loan.balance_reads, [])
+        self.assertEqual(IndexedBlock.objects.count(), 2)
+
+    def test_reorganization(self):
+
+        self._transfer(self.holders[0], 5)
+        indexer.sync()
+
+        snapshot = self.tester.take_snapshot()
+
+        # blocks that will be orphaned
+        self.loan.phase = LoanPhase.CANCELED
+        self._transfer(self.holders[1], 4)
+        self._transfer(self.holders[1], 4)
+        indexer.sync()
+
+        self.assertEqual(LoanChainState.objects.get().phase, "CANCELED")
+
+        # and the canonical chain, which did not see any of it
+        self.tester.revert_to_snapshot(snapshot)
+        self.loan.phase = LoanPhase.FUNDING
+        del self.loan.balances[self.holders[1]]
+        self._transfer(self.holders[2], 1)
+
+        self.assertEqual(indexer.sync(), self.web3.eth.blockNumber)
+
+        self.assertEqual(LoanChainState.objects.get().phase, "FUNDING")
+        self.assertEqual(Loan.objects.get().phase, "FUNDING")
+        self.assertEqual(
+            self._get_balances(), {self.holders[0]: "5", self.holders[2]: "1"}
+        )
+        self.assertEqual(
+            list(IndexedBlock.objects.values_list("number", flat=True)),
+            [self.web3.eth.blockNumber - 1, self.web3.eth.blockNumber],
+        )
+
+
+def _sell_position(seller, price, amount):
+    return SimpleNamespace(
+        seller_address=seller,
+        price_atto_dai_per_token=price,
+        amount_tokens=amount,
+    )
+
+
+class OrderBookTests(SimpleTestCase):
+    """
+    The order book's median price matches the one computed from the sell
+    positions as read from the chain, as positions come and go.
+    """
+
+    def _assertMatches(self, order_book, positions):
+
+        self.assertEqual(
+            order_book.median_price_atto_dai_per_token,
+            market._get_median_price(positions.values()),
+        )
+        self.assertEqual(
+            order_book.total_amount_tokens,
+            sum(sp.amount_tokens for sp in positions.values()),
+        )
+
+    def test_insert_update_and_remove(self):
+
+        order_book = OrderBook()
+        self.assertIsNone(order_book.median_price_atto_dai_per_token)
+
+        order_book.set_position("a", 10, 1)
+        order_book.set_position("b", 20, 1)
+        order_book.set_position("c", 30, 1)
+        self.assertEqual(order_book.median_price_atto_dai_per_token, 20)
+
+        # more than half of the tokens are now offered at 30
+        order_book.set_position("c", 30, 5)
+        self.assertEqual(order_book.median_price_atto_dai_per_token, 30)
+        self.assertEqual(order_book.get_position("c"), (30, 5))
+
+        order_book.remove_position("c")
+        self.assertEqual(order_book.median_price_atto_dai_per_token, 20)
+        self.assertIsNone(order_book.get_position("c"))
+
+        # an amount of zero removes the position
+        order_book.set_position("b", 20, 0)
+        self.assertEqual(order_book.get_sellers(), ["a"])
+        self.assertEqual(order_book.median_price_atto_dai_per_token, 10)
+
+    def test_random_changes(self):
+
+        rng = random.Random(0)
+
+        order_book = OrderBook()
+        positions = {}
+
+        for _ in range(2000):
+
+            seller = f"0x{rng.randrange(30):040x}"
+
+            if seller in positions and rng.random() < 0.3:
+                order_book.remove_position(seller)
+                del positions[seller]
+            else:
+                # few prices, so that positions share levels
+                sp = _sell_position(
+                    seller, rng.randrange(1, 8) * 10 ** 18, rng.randrange(1, 50)
+                )
+                order_book.set_position(
+                    seller, sp.price_atto_dai_per_token, sp.amount_tokens
+                )
+                positions[seller] = sp
+
+            self._assertMatches(order_book, positions)
+
+        # and when built from positions at once, as by the indexer
+        self._assertMatches(OrderBook(positions.values()), positions)
+
+
+class NonceManagerTests(SimpleTestCase):
+    """
+    Nonces of the master account are handed out locally, sent in order, and
+    never left unused or stuck.
+    """
+
+    def setUp(self):
+
+        self.tester = EthereumTester()
+
+        self.account = Account.create()
+        self.tester.add_account(self.account.key.hex())
+
+        Web3(EthereumTesterProvider(self.tester)).eth.sendTransaction(
+            {
+                "from": self.tester.get_accounts()[0],
+                "to": self.account.address,
+                "value": 10 ** 20,
+                "gas": 21_000,
+            }
+        )
+
+        self.manager = NonceManagingProvider(
+            SerializingProvider(EthereumTesterProvider(self.tester)),
+            private_key=self.account.key,
+        )
+        self.web3 = Web3(self.manager)
+
+    def _get_nonce(self):
+        return self.web3.eth.getTransactionCount(
+            self.account.address, "pending"
+        )
+
+    def _send(self, nonce, gas_price=10 ** 9):
+
+        signed = Account.sign_transaction(
+            {
+                "to": self.tester.get_accounts()[1],
+                "value": 1,
+                "gas": 21_000,
+                "gasPrice": gas_price,
+                "nonce": nonce,
+                "chainId": self.web3.eth.chainId,
+            },
+            self.account.key,
+        )
+
+        return self.web3.eth.sendRawTransaction(signed.rawTransaction)
+
+    def _get_mined_count(self):
+        return self.web3.eth.getTransactionCount(self.account.address, "latest")
+
+    def test_reads_do_not_allocate(self):
+
+        self.assertEqual([self._get_nonce() for _ in range(2)], [0, 0])
+        self.assertEqual(self.manager.get_stats()["allocated"], [])
+
+    def test_concurrent_sends(self):
+
+        with sending_transactions():
+            nonces = [self._get_nonce() for _ in range(5)]
+
+        self.assertEqual(nonces, list(range(5)))
+
+        hashes = {}
+
+        def send(nonce):
+            # the last nonces are sent first, and wait for the others
+            time.sleep((len(nonces) - nonce) * 0.02)
+            with sending_transactions():
+                hashes[nonce] = self._send(nonce)
+
+        threads = [threading.Thread(target=send, args=(n,)) for n in nonces]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self._get_mined_count(), 5)
+
+        for transaction_hash in hashes.values():
+            self.web3.eth.getTransactionReceipt(transaction_hash)
+
+        self.assertEqual(self.manager.get_stats()["pending"], [])
+
+    def test_abandoned_nonces_are_filled(self):
+
+        self.manager.ABANDONED_AFTER = 0.1
+
+        with sending_transactions():
+            nonces = [self._get_nonce() for _ in range(3)]
+
+            # waits for the first nonce, and then fills it
+            self._send(nonces[1])
+
+        self.assertEqual(self._get_mined_count(), 2)
+
+        # the last one is never sent
+        time.sleep(0.2)
+        self.manager.maintain()
+
+        self.assertEqual(self._get_mined_count(), 3)
+        self.assertEqual(self.manager.get_stats()["allocated"], [])
+
+    def test_stuck_transactions_are_repriced(self):
+
+        self.tester.disable_auto_mine_transactions()
+        self.manager.STUCK_AFTER = 0
+
+        sent = []
+
+        with sending_transactions(lambda *args: sent.append(args)):
+            transaction_hash = self._send(self._get_nonce())
+
+        self.assertEqual(sent, [(transaction_hash.hex(), 0)])
+
+        self.manager.maintain()
+        self.tester.mine_blocks(1)
+
+        # only the replacement is mined, and found by the original's hash
+        receipt = self.web3.eth.getTransactionReceipt(transaction_hash)
+
+        self.assertNotEqual(receipt["transactionHash"], transaction_hash)
+        self.assertGreater(
+            self.web3.eth.getTransaction(receipt["transactionHash"])[
+                "gasPrice"
+            ],
+            10 ** 9,
+        )
+        self.assertEqual(self._get_mined_count(), 1)
+
+
+# ---------------------------------------------------------------------------- #
+
+
+# ---------------------------------------------------------------------------- #
+
+
+class JobTests(_APITestCase):
+    """
+    Failed jobs are retried with backoff until MAX_ATTEMPTS, jobs of dead
+    workers are put back in the queue, and retried loan creations never create
+    the loan twice.
+    """
+
+    def setUp(self):
+
+        super().setUp()
+
+        self.now = datetime(2021, 1, 1, tzinfo=timezone.utc)
+
+        self.transaction_hash = "0x" + "cd" * 32
+        self.receipt = None
+        self.loans_by_block = {}
+
+        self.controller = SimpleNamespace(
+            loans=SimpleNamespace(
+                create=mock.Mock(),
+                get_all=lambda: self.loans_by_block[
+                    providers._current_block_scope.get().block_number
+                ],
+            )
+        )
+
+        for patcher in [
+            mock.patch(
+                "tuichain.api.services.jobs.timezone",
+                SimpleNamespace(now=lambda: self.now),
+            ),
+            mock.patch(
+                "tuichain.api.services.jobs.controller", self.controller
+            ),
+            mock.patch(
+                "tuichain.api.services.jobs.web3",
+                SimpleNamespace(
+                    eth=SimpleNamespace(getTransactionReceipt=self._get_receipt)
+                ),
+            ),
+            mock.patch("tuichain.api.services.jobs._start_heartbeat_thread"),
+            mock.patch("tuichain.api.services.jobs.logger"),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.loan = self._add_loan(state=LoanState.CREATING.value)
+
+        self.job = Job.objects.create(
+            kind="create_loan",
+            loan=self.loan,
+            arguments=json.dumps(
+                {
+                    "days_to_expiration": 30,
+                    "funding_fee_atto_dai_per_dai": "0",
+                    "payment_fee_atto_dai_per_dai": "0",
+                }
+            ),
+            run_after=self.now,
+        )
+
+    def _get_receipt(self, transaction_hash):
+
+        if self.receipt is None:
+            raise TransactionNotFound(transaction_hash)
+
+        return self.receipt
+
+    def _fetched_loan(self, n, recipient_address=None):
+        return SimpleNamespace(
+            identifier=f"0x{n:040x}",
+            token_contract_address=f"0x{n:040x}",
+            recipient_address=recipient_address or self.loan.recipient_address,
+            requested_value_atto_dai=1000,
+            expiration_time=self.now + timedelta(days=30),
+        )
+
+    def _fail(self, job, **arguments):
+        raise ValueError("node unreachable")
+
+    def test_retry_backoff(self):
+
+        with mock.patch.dict(jobs._HANDLERS, {"create_loan": self._fail}):
+
+            for (attempts, backoff) in [(1, 30), (2, 60), (3, 120)]:
+
+                self.assertTrue(jobs.run_next())
+                self.job.refresh_from_db()
+
+                self.assertEqual(self.job.state, JobState.PENDING.value)
+                self.assertEqual(self.job.attempts, attempts)
+                self.assertEqual(self.job.error, "ValueError: node unreachable")
+                self.assertEqual(
+                    self.job.run_after, self.now + timedelta(seconds=backoff)
+                )
+
+                # not due until then
+                self.now += timedelta(seconds=backoff - 1)
+                self.assertFalse(jobs.run_next())
+                self.now += timedelta(seconds=1)
+
+        self.loan.refresh_from_db()
+        self.assertEqual(self.loan.state, LoanState.CREATING.value)
+
+    def test_max_attempts(self):
+
+        self.job.attempts = jobs.MAX_ATTEMPTS - 1
+        self.job.save()
+
+        with mock.patch.dict(jobs._HANDLERS, {"create_loan": self._fail}):
+            self.assertTrue(jobs.run_next())
+
+        self.job.refresh_from_db()
+
+        self.assertEqual(self.job.state, JobState.FAILED.value)
+        self.assertEqual(self.job.attempts, jobs.MAX_ATTEMPTS)
+        self.assertEqual(self.job.finished_at, self.now)
+        self.assertFalse(jobs.run_next())
+
+        # the request goes back to the admins
+        self.loan.refresh_from_db()
+        self.assertEqual(self.loan.state, LoanState.PENDING.value)
+
+    def test_reconcile(self):
+
+        stale = self.now - jobs.STALE_JOB_TIMEOUT - timedelta(seconds=1)
+        recent = self.now - jobs.HEARTBEAT_INTERVAL
+
+        for (started_at, heartbeat_at) in [
+            (stale, stale),
+            (stale, None),
+            (stale, recent),
+        ]:
+            Job.objects.create(
+                kind="cancel_loan",
+                loan=self.loan,
+                state=JobState.RUNNING.value,
+                started_at=started_at,
+                heartbeat_at=heartbeat_at,
+                worker="gone:1",
+            )
+
+        self.assertEqual(jobs.reconcile(), 2)
+
+        self.assertEqual(
+            list(
+                Job.objects.filter(kind="cancel_loan")
+                .order_by("id")
+                .values_list("state", "worker")
+            ),
+            [
+                (JobState.PENDING.value, None),
+                (JobState.PENDING.value, None),
+                (JobState.RUNNING.value, "gone:1"),
+            ],
+        )
+
+    def test_outcome_of_stale_attempt_is_discarded(self):
+        def run(job, **arguments):
+            # deemed stale meanwhile, and claimed by another worker
+            Job.objects.filter(id=job.id).update(worker="other:1")
+
+        with mock.patch.dict(jobs._HANDLERS, {"create_loan": run}):
+            self.assertTrue(jobs.run_next())
+
+        self.job.refresh_from_db()
+
+        self.assertEqual(self.job.state, JobState.RUNNING.value)
+        self.assertEqual(self.job.worker, "other:1")
+
+    def test_created_loan_is_not_created_again(self):
+        def create(**arguments):
+            # sent, but the wait for it to be mined times out
+            nonces._current_sender.get()(self.transaction_hash, 0)
+            raise TimeoutError("not mined in time")
+
+        self.controller.loans.create.side_effect = create
+
+        self.assertTrue(jobs.run_next())
+        self.job.refresh_from_db()
+
+        self.assertEqual(self.job.state, JobState.PENDING.value)
+        self.assertEqual(self.job.transaction_hash, self.transaction_hash)
+
+        # retried before the transaction is mined
+        self.now = self.job.run_after
+        self.assertTrue(jobs.run_next())
+        self.job.refresh_from_db()
+
+        self.assertEqual(self.job.state, JobState.PENDING.value)
+        self.assertIn("not mined yet", self.job.error)
+
+        # mined in a block that also created loans for other requests
+        other = self._fetched_loan(1)
+        taken = self._fetched_loan(2)
+        created = self._fetched_loan(3)
+        unrelated = self._fetched_loan(4, "0x" + "ef" * 20)
+
+        self.loans_by_block = {
+            6: [other],
+            7: [other, taken, created, unrelated],
+        }
+        self.receipt = {"status": 1, "blockNumber": 7}
+
+        self._add_loan(
+            state=LoanState.APPROVED.value,
+            identifier=taken.identifier,
+        )
+
+        self.now = self.job.run_after
+        self.assertTrue(jobs.run_next())
+        self.job.refresh_from_db()
+
+        self.assertEqual(self.job.state, JobState.SUCCEEDED.value)
+        self.assertEqual(self.controller.loans.create.call_count, 1)
+
+        self.loan.refresh_from_db()
+
+        self.assertEqual(self.loan.state, LoanState.APPROVED.value)
+        self.assertEqual(self.loan.identifier, created.identifier)
+
+    def test_failed_creation_is_sent_again(self):
+
+        self.job.transaction_hash = self.transaction_hash
+        self.job.save()
+
+        self.receipt = {"status": 0, "blockNumber": 7}
+        self.controller.loans.create.return_value.get.return_value = (
+            self._fetched_loan(1)
+        )
+
+        self.assertTrue(jobs.run_next())
+        self.job.refresh_from_db()
+
+        self.assertEqual(self.job.state, JobState.SUCCEEDED.value)
+        self.assertEqual(self.controller.loans.create.call_count, 1)
+        self.assertEqual(
+            self.controller.loans.create.call_args.kwargs[
+                "requested_value_atto_dai"
+            ],
+            1000,
+        )
+
+        self.loan.refresh_from_db()
+        self.assertEqual(self.loan.identifier, f"0x{1:040x}")
@@ -11,7 +11,12 @@ from rest_framework.status import (
     HTTP_201_CREATED,
 )
 from rest_framework.response import Response
-from tuichain.api.services.blockchain import controller
+from tuichain.api.services.blockchain import (
+    controller,
+    nonce_manager,
+    rpc_cache,
+    rpc_pool,
+)
 
 
 @api_view(["GET"])
@@ -40,3 +45,55 @@ def get_blockchain_info(request):
         },
         status=HTTP_200_OK,
     )
+
+
+@api_view(["GET"])
+@permission_classes((IsAdminUser,))
+def get_cache_stats(request):
+    """
+    Get the hit and miss counts of the blockchain read cache. ADMIN ONLY.
+
+    Parameters
+    ----------
+
+    Returns
+    -------
+    200
+        Cache statistics fetched with success.
+
+    """
+
+    return Response(
+        {
+            "message": "Cache statistics fetched with success",
+            "cache": None if rpc_cache is None else rpc_cache.get_stats(),
+        },
+        status=HTTP_200_OK,
+    )
+
+
+@api_view(["GET"])
+@permission_classes((IsAdminUser,))
+def get_provider_stats(request):
+    """
+    Get the health, latency and request counts of the Ethereum nodes, and the
+    nonces of the master account in flight. ADMIN ONLY.
+
+    Parameters
+    ----------
+
+    Returns
+    -------
+    200
+        Provider statistics fetched with success.
+
+    """
+
+    return Response(
+        {
+            "message": "Provider statistics fetched with success",
+            "providers": None if rpc_pool is None else rpc_pool.get_stats(),
+            "nonces": nonce_manager.get_stats(),
+        },
+        status=HTTP_200_OK,
+    )
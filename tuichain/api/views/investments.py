@@ -1,22 +1,18 @@
+from django.conf import settings
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import *
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.status import HTTP_200_OK
-from tuichain.api.models import Loan, Profile
-from tuichain.api.views.loans import _retrieve_current_price
+from tuichain.api.decorators import async_view, conditional_view
+from tuichain.api.models import Investment, Loan, Profile
+from tuichain.api.pagination import paginate
+from tuichain.api.views.loans import _get_chain_state
 from itertools import chain
 
-from tuichain_ethereum import LoanIdentifier, Address
-from tuichain.api.services.blockchain import controller
-
-# ---------------------------------------------------------------------------- #
-
-
-def _get_loan(loan_id):
-    loan = Loan.objects.get(id=int(loan_id))
-    return controller.loans.get_by_identifier(LoanIdentifier(loan.identifier))
-
+from tuichain_ethereum import Address
+from tuichain.api.services.blockchain import controller, rpc_batcher
+from tuichain.api.services.loans import resolve_loans
 
 # ---------------------------------------------------------------------------- #
 
@@ -43,53 +39,75 @@ def get_personal_investments(request, user_addr):
     adr = Address(user_addr)
 
     loans_arr = []
-    invested_loans = []
 
-    loan_identifiers = frozenset(
-        chain(
-            (
-                loan.identifier
-                for loan in controller.loans.get_by_token_holder(adr)
-            ),
+    if settings.ETHEREUM_INDEXER_ENABLED:
+        investments = [
             (
-                sp.loan.identifier
-                for sp in controller.market.get_sell_positions_by_seller(adr)
-            ),
+                investment.loan_state.loan,
+                investment.loan_state.phase,
+                investment.loan_state.current_value_atto_dai,
+                int(investment.amount_tokens),
+                int(investment.sell_amount_tokens or 0),
+                int(investment.sell_price_atto_dai_per_token or 0),
+            )
+            for investment in Investment.objects.filter(
+                investor_address=str(adr)
+            )
+            .exclude(loan_state__loan=None)
+            .select_related("loan_state__loan__student")
+        ]
+    else:
+        loan_identifiers = frozenset(
+            chain(
+                (
+                    str(loan.identifier)
+                    for loan in controller.loans.get_by_token_holder(adr)
+                ),
+                (
+                    str(sp.loan.identifier)
+                    for sp in controller.market.get_sell_positions_by_seller(
+                        adr
+                    )
+                ),
+            )
         )
-    )
-
-    for loan_id in loan_identifiers:
 
-        l = controller.loans.get_by_identifier(loan_id)
-
-        student_id = (
-            Loan.objects.filter(identifier=str(l.identifier)).first().student
+        def read_investment(loan):
+            chain_state = _get_chain_state(loan)
+            sell_position = chain_state.get_sell_position_of(adr)
+            return (
+                loan,
+                chain_state.phase,
+                chain_state.current_value_atto_dai,
+                chain_state.get_token_balance_of(adr),
+                0 if sell_position is None else sell_position.amount_tokens,
+                0
+                if sell_position is None
+                else sell_position.price_atto_dai_per_token,
+            )
+
+        investments = rpc_batcher.map(
+            read_investment,
+            resolve_loans(loan_identifiers).values(),
         )
 
-        student_name = (
-            Profile.objects.filter(user=student_id).first().user.get_full_name()
-        )
+    for (
+        loan,
+        phase,
+        current_value_atto_dai,
+        nrTokens,
+        nrTokens_market,
+        price_per_token_market,
+    ) in investments:
 
-        loan_dict = (
-            Loan.objects.filter(identifier=str(l.identifier)).first().to_dict()
-        )
-        loan_dict["state"] = l.get_state().phase.name
-        loan_dict["current_value_atto_dai"] = _retrieve_current_price(l)
-
-        sell_position = controller.market.get_sell_position_by_loan_and_seller(
-            l, adr
-        )
-
-        price_per_token_market = 0
-        nrTokens_market = 0
-        if sell_position is not None:
-            nrTokens_market = sell_position.amount_tokens
-            price_per_token_market = sell_position.price_atto_dai_per_token
+        loan_dict = loan.to_dict()
+        loan_dict["state"] = phase
+        loan_dict["current_value_atto_dai"] = current_value_atto_dai
 
         loan_obj = {
             "loan": loan_dict,
-            "name": student_name,
-            "nrTokens": l.get_token_balance_of(adr),
+            "name": loan.student.get_full_name(),
+            "nrTokens": nrTokens,
             "nrTokens_market": nrTokens_market,
             "price_per_token_market": price_per_token_market,
         }
@@ -108,6 +126,7 @@ def get_personal_investments(request, user_addr):
 
 @api_view(["GET"])
 @permission_classes((IsAuthenticated,))
+@conditional_view(Loan, Profile)
 def get_investment(request, id, user_addr):
     """
     Get Investment with the given ID and account address
@@ -131,32 +150,28 @@ def get_investment(request, id, user_addr):
 
     adr = Address(user_addr)
 
-    loan = _get_loan(id)
-
-    student_id = (
-        Loan.objects.filter(identifier=str(loan.identifier)).first().student
+    loan = Loan.objects.select_related("chain_state", "student__profile").get(
+        id=int(id)
     )
-    student_name = Profile.objects.filter(user=student_id).first().full_name
+    chain_state = _get_chain_state(loan)
 
-    loan_dict = (
-        Loan.objects.filter(identifier=str(loan.identifier)).first().to_dict()
-    )
-    loan_dict["state"] = loan.get_state().phase.name
+    student_name = loan.student.profile.full_name
 
-    sell_position = controller.market.get_sell_position_by_loan_and_seller(
-        loan, adr
-    )
+    loan_dict = loan.to_dict()
+    loan_dict["state"] = chain_state.phase
+
+    sell_position = chain_state.get_sell_position_of(adr)
 
     price_per_token_market = 0
     nrTokens_market = 0
     if sell_position is not None:
-        nrTokens_market = sell_position.amount_tokens
-        price_per_token_market = sell_position.price_atto_dai_per_token
+        nrTokens_market = int(sell_position.amount_tokens)
+        price_per_token_market = int(sell_position.price_atto_dai_per_token)
 
     loan_obj = {
         "loan": loan_dict,
         "name": student_name,
-        "nrTokens": loan.get_token_balance_of(adr),
+        "nrTokens": chain_state.get_token_balance_of(adr),
         "nrTokens_market": nrTokens_market,
         "price_per_token_market": price_per_token_market,
     }
@@ -172,9 +187,10 @@ def get_investment(request, id, user_addr):
 
 @api_view(["GET"])
 @permission_classes((IsAuthenticated,))
+@conditional_view(Loan, Profile)
 def get_general_investments(request, id):
     """
-    Get sell positions from the investments done
+    Get sell positions from the investments done, by page of sell positions
 
     Parameters
     ----------
@@ -182,26 +198,33 @@ def get_general_investments(request, id):
 
         Loan's database identifier.
 
+    cursor : string, optional
+
+        Position of the page, from the ``next`` link of the previous one.
+
+    page_size : integer, optional
+
+        Number of sell positions per page.
+
     Returns
     -------
     200
-        Investments fetched with success.
+        Investments fetched with success, along with the ``next`` page's link.
 
     """
 
-    loan = _get_loan(id)
-
-    student_id = (
-        Loan.objects.filter(identifier=str(loan.identifier)).first().student
+    loan = Loan.objects.select_related("chain_state", "student__profile").get(
+        id=int(id)
     )
-    student_name = Profile.objects.filter(user=student_id).first().full_name
+    chain_state = _get_chain_state(loan)
 
-    loan_dict = (
-        Loan.objects.filter(identifier=str(loan.identifier)).first().to_dict()
-    )
-    loan_dict["state"] = loan.get_state().phase.name
+    student_name = loan.student.profile.full_name
+
+    loan_dict = loan.to_dict()
+    loan_dict["state"] = chain_state.phase
 
-    sell_positions = controller.market.get_sell_positions_by_loan(loan)
+    page = paginate(request, chain_state.get_sell_positions(), "seller_address")
+    sell_positions = page.items
 
     sp_list = []
     # for sp in sell_positions:
@@ -210,8 +233,8 @@ def get_general_investments(request, id):
     for sp in sell_positions:
         sp_dict = {}
         sp_dict["seller_address"] = str(sp.seller_address)
-        sp_dict["amount_tokens"] = sp.amount_tokens
-        sp_dict["price_atto_dai_per_token"] = sp.price_atto_dai_per_token
+        sp_dict["amount_tokens"] = int(sp.amount_tokens)
+        sp_dict["price_atto_dai_per_token"] = int(sp.price_atto_dai_per_token)
         sp_list.append(sp_dict)
 
     loan_obj = {
@@ -225,9 +248,17 @@ def get_general_investments(request, id):
         {
             "message": "Investment fetched with success",
             "investment": loan_obj,
+            "next": page.next_link,
         },
         status=HTTP_200_OK,
     )
 
 
+# ---------------------------------------------------------------------------- #
+# async variants of the read endpoints, for ASGI deployments
+
+get_personal_investments_async = async_view(get_personal_investments)
+get_investment_async = async_view(get_investment)
+get_general_investments_async = async_view(get_general_investments)
+
 # ---------------------------------------------------------------------------- #
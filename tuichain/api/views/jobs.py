@@ -0,0 +1,53 @@
+from rest_framework.response import Response
+from rest_framework.status import (
+    HTTP_403_FORBIDDEN,
+    HTTP_404_NOT_FOUND,
+    HTTP_200_OK,
+)
+from tuichain.api.models import Job
+from rest_framework.permissions import *
+from rest_framework.decorators import api_view, permission_classes
+
+
+@api_view(["GET"])
+@permission_classes((IsAuthenticated,))
+def get_job(request, id):
+    """
+    Get the status of a queued on-chain operation on a loan
+
+    Parameters
+    ----------
+    id : integer
+
+        Job's identifier.
+
+    Returns
+    -------
+    200
+        Job fetched with success.
+
+    403
+        Job is on a loan that does not belong to current logged user.
+
+    404
+        Job not found.
+
+    """
+
+    user = request.user
+
+    job = Job.objects.select_related("loan").filter(id=id).first()
+
+    if job is None:
+        return Response({"error": "Unexistent Job"}, status=HTTP_404_NOT_FOUND)
+
+    if user != job.loan.student and not user.is_staff:
+        return Response(
+            {"error": "Job does not belong to logged user"},
+            status=HTTP_403_FORBIDDEN,
+        )
+
+    return Response(
+        {"message": "Job fetched with success", "job": job.to_dict()},
+        status=HTTP_200_OK,
+    )
@@ -1,3 +1,7 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
 from rest_framework.response import Response
 from rest_framework.status import (
     HTTP_400_BAD_REQUEST,
@@ -5,52 +9,155 @@ from rest_framework.status import (
     HTTP_404_NOT_FOUND,
     HTTP_200_OK,
     HTTP_201_CREATED,
+    HTTP_202_ACCEPTED,
 )
-from tuichain.api.models import Loan, Profile, Document
+from tuichain.api.models import Loan, LoanChainState, Document
+from tuichain.api.decorators import async_view, conditional_view
+from tuichain.api.pagination import paginate
+from tuichain.api.serializers import serialize_documents
 from tuichain.api.enums import LoanState
-from tuichain.api.services.blockchain import controller
+from tuichain.api.services import jobs
+from tuichain.api.services.blockchain import (
+    block_pinner,
+    controller,
+    rpc_batcher,
+)
+from tuichain.api.services.loans import (
+    filter_by_phase,
+    get_phase_condition,
+    get_value_statistics,
+)
+from tuichain.api.services.market import get_current_price
+from tuichain.api.services.price_history import get_ohlc
 from tuichain.api.services.storage import upload_file
 from tuichain_ethereum import Address, LoanIdentifier, LoanPhase
 from rest_framework.permissions import *
 from rest_framework.decorators import api_view, permission_classes
 from datetime import timedelta, datetime
+from functools import cached_property
 
 
-def _retrieve_current_price(loan):
+MAX_ATTO_DAI = 10 ** 40 - 1
+"""The largest amount that Loan.requested_value_atto_dai can hold."""
 
-    state = loan.get_state()
 
-    if state.phase in [
-        LoanPhase.FUNDING,
-        LoanPhase.CANCELED,
-        LoanPhase.EXPIRED,
-    ]:
+def _retrieve_current_price(loan, state=None):
+
+    if state is None:
+        state = loan.get_state()
+
+    if state.phase == LoanPhase.ACTIVE:
+        sell_positions = controller.market.get_sell_positions_by_loan(loan)
+    else:
+        sell_positions = []
+
+    return get_current_price(state, sell_positions)
+
+
+class _LiveLoanChainState:
+    """
+    Reads the same information as LoanChainState, straight from the chain.
+    """
+
+    def __init__(self, fetched_loan):
+        self.fetched_loan = fetched_loan
+
+    @cached_property
+    def _state(self):
+        return self.fetched_loan.get_state()
+
+    @property
+    def phase(self):
+        return self._state.phase.name
 
-        return str(10 ** 18)
+    @property
+    def funded_value_atto_dai(self):
+        return self._state.funded_value_atto_dai
 
-    elif state.phase == LoanPhase.ACTIVE:
+    @cached_property
+    def current_value_atto_dai(self):
+        return _retrieve_current_price(self.fetched_loan, self._state)
 
-        sorted_sell_positions = sorted(
-            controller.market.get_sell_positions_by_loan(loan),
-            key=lambda sp: sp.price_atto_dai_per_token,
+    @property
+    def block_number(self):
+        return block_pinner.get_block_number()
+
+    @cached_property
+    def token_contract_address(self):
+        return str(self.fetched_loan.token_contract_address)
+
+    def get_token_balance_of(self, address):
+        return self.fetched_loan.get_token_balance_of(Address(address))
+
+    def get_sell_positions(self):
+        return [
+            _LiveSellPosition(sp)
+            for sp in controller.market.get_sell_positions_by_loan(
+                self.fetched_loan
+            )
+        ]
+
+    def get_sell_position_of(self, address):
+        return controller.market.get_sell_position_by_loan_and_seller(
+            self.fetched_loan, Address(address)
         )
 
-        if not sorted_sell_positions:
-            return None
 
-        counter = 0
-        total_amount_for_sale = sum(
-            sp.amount_tokens for sp in sorted_sell_positions
+class _LiveSellPosition:
+    """
+    A sell position read from the chain, with its seller's address as a string
+    like in SellPosition, so that they are paginated alike.
+    """
+
+    def __init__(self, sell_position):
+        self.seller_address = str(sell_position.seller_address)
+        self.amount_tokens = sell_position.amount_tokens
+        self.price_atto_dai_per_token = sell_position.price_atto_dai_per_token
+
+
+def _get_chain_state(loan, fetched_loan=None):
+    """
+    Get the on-chain state of an approved loan.
+
+    The state is read from the tables maintained by the indexer if it is
+    enabled and has already seen the loan, and from the chain otherwise.
+    """
+
+    if settings.ETHEREUM_INDEXER_ENABLED:
+        try:
+            return loan.chain_state
+        except LoanChainState.DoesNotExist:
+            pass
+
+    if fetched_loan is None:
+        fetched_loan = controller.loans.get_by_identifier(
+            LoanIdentifier(loan.identifier)
         )
 
-        for sp in sorted_sell_positions:
-            counter += sp.amount_tokens
-            if counter > total_amount_for_sale // 2:
-                return str(sp.price_atto_dai_per_token)
+    return _LiveLoanChainState(fetched_loan)
+
+
+def _read_fields(chain_state, fields):
+    for field in fields:
+        getattr(chain_state, field)
+    return chain_state
 
-    else:  # state.phase == LoanPhase.FINALIZED
 
-        return str(state.redemption_value_atto_dai_per_token)
+def _get_chain_states(loans, *fields):
+    """
+    Get the on-chain state of several approved loans, keyed by loan id.
+
+    The given fields are read up front and concurrently for all loans, on the
+    bounded pool of ``fan_out()``, so that their chain reads overlap and are
+    sent together in JSON-RPC batches. The first failed read aborts the
+    listing.
+    """
+
+    chain_states = rpc_batcher.map(
+        lambda loan: _read_fields(_get_chain_state(loan), fields), loans
+    )
+
+    return {loan.id: s for (loan, s) in zip(loans, chain_states)}
 
 
 @api_view(["POST"])
@@ -69,9 +176,9 @@ def create_loan_request(request):
 
         User's desired course.
 
-    requested_value_atto_dai : float
+    requested_value_atto_dai : string
 
-        requested_value_atto_dai of money pretended by the user.
+        Whole number of atto-Dai requested by the user.
 
     destination : string
 
@@ -87,7 +194,8 @@ def create_loan_request(request):
         Loan request created successfully.
 
     400
-        Required fields are missing or user already has an undergoing loan request.
+        Required fields are missing, the requested value is invalid or user
+        already has an undergoing loan request.
 
     """
 
@@ -116,7 +224,16 @@ def create_loan_request(request):
         )
 
     try:
-        Address(recipient_address)
+        requested_value_atto_dai = _parse_atto_dai(requested_value_atto_dai)
+    except ValueError as e:
+        return Response(
+            {"error": f"Invalid requested_value_atto_dai: {e}"},
+            status=HTTP_400_BAD_REQUEST,
+        )
+
+    try:
+        # stored checksummed, as the chain returns it
+        recipient_address = str(Address(recipient_address))
     except ValueError as e:
         return Response({"error": str(e)}, status=HTTP_400_BAD_REQUEST)
 
@@ -141,6 +258,7 @@ def create_loan_request(request):
         school=school,
         course=course,
         requested_value_atto_dai=requested_value_atto_dai,
+        exact_requested_value_atto_dai=str(requested_value_atto_dai),
         destination=destination,
         description=description,
         recipient_address=recipient_address,
@@ -167,40 +285,49 @@ def cancel_loan(request, id):
 
     Returns
     -------
-    200
-        Loan canceled successfully.
+    202
+        Loan cancellation queued successfully, see the returned job.
 
     403
         Cannot cancel a loan that you don't own
 
     403
-        Loan cannot be canceled.
+        Loan cannot be canceled, or has another operation in progress.
 
     404
         Loan not found.
 
     """
-    user = request.user
-    loan = Loan.objects.filter(id=id).first()
+    with transaction.atomic():
+        loan = Loan.objects.select_for_update().filter(id=id).first()
+        body, status = _cancel_loan(loan, request.user)
+
+    return Response(body, status=status)
+
+
+def _cancel_loan(loan, user):
 
     if loan is None:
-        return Response({"error": "Unexistent Loan"}, status=HTTP_404_NOT_FOUND)
+        return ({"error": "Unexistent Loan"}, HTTP_404_NOT_FOUND)
 
     if user != loan.student and not user.is_superuser:
-        return Response(
+        return (
             {"error": "Cannot cancel a loan that you don't own"},
-            status=HTTP_403_FORBIDDEN,
+            HTTP_403_FORBIDDEN,
         )
 
-    if loan.state != LoanState.APPROVED.value:
-        return Response(
+    if loan.state != LoanState.APPROVED.value or jobs.has_unfinished_jobs(loan):
+        return (
             {"error": "The given Loan cannot be canceled"},
-            status=HTTP_403_FORBIDDEN,
+            HTTP_403_FORBIDDEN,
         )
 
-    controller.loans.get_by_identifier(LoanIdentifier(loan.identifier)).cancel()
+    job = jobs.enqueue("cancel_loan", loan)
 
-    return Response({"message": "Loan has been canceled"}, status=HTTP_200_OK)
+    return (
+        {"message": "Loan is being canceled", "job": job.to_dict()},
+        HTTP_202_ACCEPTED,
+    )
 
 
 @api_view(["PUT"])
@@ -233,28 +360,31 @@ def withdraw_loan_request(request, id):
 
     user = request.user
 
-    loan = Loan.objects.filter(id=id).first()
+    with transaction.atomic():
 
-    if loan is None:
-        return Response(
-            {"error": "Unexistent Loan Request"}, status=HTTP_404_NOT_FOUND
-        )
+        loan = Loan.objects.select_for_update().filter(id=id).first()
 
-    if loan.student != user:
-        return Response(
-            {"error": "Loan Request does not belong to logged user"},
-            status=HTTP_403_FORBIDDEN,
-        )
+        if loan is None:
+            return Response(
+                {"error": "Unexistent Loan Request"},
+                status=HTTP_404_NOT_FOUND,
+            )
 
-    if loan.state > LoanState.PENDING.value:
-        return Response(
-            {"error": "That Loan Request cannot be withdrawn"},
-            status=HTTP_400_BAD_REQUEST,
-        )
+        if loan.student != user:
+            return Response(
+                {"error": "Loan Request does not belong to logged user"},
+                status=HTTP_403_FORBIDDEN,
+            )
 
-    # set status as withdrawn
-    loan.state = LoanState.WITHDRAWN.value
-    loan.save()
+        if loan.state > LoanState.PENDING.value:
+            return Response(
+                {"error": "That Loan Request cannot be withdrawn"},
+                status=HTTP_400_BAD_REQUEST,
+            )
+
+        # set status as withdrawn
+        loan.state = LoanState.WITHDRAWN.value
+        loan.save()
 
     return Response(
         {"message": "Loan Request has been withdrawn"}, status=HTTP_200_OK
@@ -275,81 +405,82 @@ def validate_loan_request(request, id):
 
     Returns
     -------
-    200
-        Loan request validated successfully.
+    202
+        Loan creation queued successfully, see the returned job. The loan
+        request is in the CREATING state until the job succeeds.
 
     400
         Loan request fields are missing.
 
     403
-        Loan request has already been validated.
+        Loan request has already been validated, or is being validated.
 
     404
         Unexistent loan request.
 
     """
-    days_to_expiration = request.data.get("days_to_expiration")
-    funding_fee_atto_dai_per_dai = request.data.get(
-        "funding_fee_atto_dai_per_dai"
-    )
-    payment_fee_atto_dai_per_dai = request.data.get(
-        "payment_fee_atto_dai_per_dai"
-    )
+    # locked like in the bulk views, so that concurrent validations of the
+    # same request cannot both see it pending and enqueue two jobs
+    with transaction.atomic():
+        loan = Loan.objects.select_for_update().filter(id=id).first()
+        body, status = _validate_loan_request(loan, request.data)
+
+    return Response(body, status=status)
+
+
+def _validate_loan_request(loan, data):
+
+    days_to_expiration = data.get("days_to_expiration")
+    funding_fee_atto_dai_per_dai = data.get("funding_fee_atto_dai_per_dai")
+    payment_fee_atto_dai_per_dai = data.get("payment_fee_atto_dai_per_dai")
 
     if (
         days_to_expiration is None
         or funding_fee_atto_dai_per_dai is None
         or payment_fee_atto_dai_per_dai is None
     ):
-        return Response(
+        return (
             {
                 "error": "Required fields: days_to_expiration, funding_fee_atto_dai_per_dai and payment_fee_atto_dai_per_dai"
             },
-            status=HTTP_400_BAD_REQUEST,
+            HTTP_400_BAD_REQUEST,
         )
 
-    loan = Loan.objects.filter(id=id).first()
-
     if loan is None:
-        return Response(
-            {"error": "Unexistent Loan Request"}, status=HTTP_404_NOT_FOUND
-        )
+        return ({"error": "Unexistent Loan Request"}, HTTP_404_NOT_FOUND)
 
     if (
-        loan.state > LoanState.CREATING.value
+        loan.state >= LoanState.CREATING.value
         and loan.state <= LoanState.REJECTED.value
     ):
-        return Response(
+        return (
             {
                 "error": "The given Loan Request as already been validated, rejected or withdrawn"
             },
-            status=HTTP_403_FORBIDDEN,
+            HTTP_403_FORBIDDEN,
         )
 
     try:
         time_to_expiration = timedelta(days=int(days_to_expiration))
+        funding_fee_atto_dai_per_dai = int(funding_fee_atto_dai_per_dai)
+        payment_fee_atto_dai_per_dai = int(payment_fee_atto_dai_per_dai)
     except Exception as e:
-        return Response(
-            {
-                "error": str(e),
-            },
-            status=HTTP_400_BAD_REQUEST,
-        )
-
-    result = controller.loans.create(
-        recipient_address=Address(loan.recipient_address),
-        time_to_expiration=time_to_expiration,
-        funding_fee_atto_dai_per_dai=int(funding_fee_atto_dai_per_dai),
-        payment_fee_atto_dai_per_dai=int(payment_fee_atto_dai_per_dai),
-        requested_value_atto_dai=int(loan.requested_value_atto_dai),
-    ).get()
+        return ({"error": str(e)}, HTTP_400_BAD_REQUEST)
 
-    loan.identifier = str(result.identifier)
-    loan.state = LoanState.APPROVED.value
+    loan.state = LoanState.CREATING.value
     loan.save()
 
-    return Response(
-        {"message": "Loan Request has been validated"}, status=HTTP_200_OK
+    job = jobs.enqueue(
+        "create_loan",
+        loan,
+        days_to_expiration=time_to_expiration.days,
+        funding_fee_atto_dai_per_dai=str(funding_fee_atto_dai_per_dai),
+        payment_fee_atto_dai_per_dai=str(payment_fee_atto_dai_per_dai),
+    )
+
+    return (
+        {"message": "Loan Request is being validated", "job": job.to_dict()},
+        HTTP_202_ACCEPTED,
     )
 
 
@@ -367,33 +498,41 @@ def finalize_loan(request, id):
 
     Returns
     -------
-    200
-        Loan finalized successfully.
+    202
+        Loan finalization queued successfully, see the returned job.
 
     403
-        Loan cannot be finalized.
+        Loan cannot be finalized, or has another operation in progress.
 
     404
         Loan not found.
 
     """
 
-    loan = Loan.objects.filter(id=id).first()
+    with transaction.atomic():
+        loan = Loan.objects.select_for_update().filter(id=id).first()
+        body, status = _finalize_loan(loan)
+
+    return Response(body, status=status)
+
+
+def _finalize_loan(loan):
 
     if loan is None:
-        return Response({"error": "Unexistent Loan"}, status=HTTP_404_NOT_FOUND)
+        return ({"error": "Unexistent Loan"}, HTTP_404_NOT_FOUND)
 
-    if loan.state != LoanState.APPROVED.value:
-        return Response(
+    if loan.state != LoanState.APPROVED.value or jobs.has_unfinished_jobs(loan):
+        return (
             {"error": "The given Loan cannot be finalized"},
-            status=HTTP_403_FORBIDDEN,
+            HTTP_403_FORBIDDEN,
         )
 
-    controller.loans.get_by_identifier(
-        LoanIdentifier(loan.identifier)
-    ).finalize()
+    job = jobs.enqueue("finalize_loan", loan)
 
-    return Response({"message": "Loan has been finalized"}, status=HTTP_200_OK)
+    return (
+        {"message": "Loan is being finalized", "job": job.to_dict()},
+        HTTP_202_ACCEPTED,
+    )
 
 
 @api_view(["PUT"])
@@ -421,37 +560,221 @@ def reject_loan_request(request, id):
 
     """
 
-    loan = Loan.objects.filter(id=id).first()
+    with transaction.atomic():
+        loan = Loan.objects.select_for_update().filter(id=id).first()
+        body, status = _reject_loan_request(loan)
+
+    return Response(body, status=status)
+
+
+def _reject_loan_request(loan):
 
     if loan is None:
-        return Response(
-            {"error": "Unexistent Loan request"}, status=HTTP_404_NOT_FOUND
-        )
+        return ({"error": "Unexistent Loan request"}, HTTP_404_NOT_FOUND)
 
     if loan.state == LoanState.REJECTED.value:
-        return Response(
+        return (
             {"error": "The given Loan request as already been rejected"},
-            status=HTTP_403_FORBIDDEN,
+            HTTP_403_FORBIDDEN,
         )
 
     if loan.state > LoanState.PENDING.value:
-        return Response(
+        return (
             {
                 "error": "The given Loan request as already been validated or withdrawn by the user"
             },
-            status=HTTP_403_FORBIDDEN,
+            HTTP_403_FORBIDDEN,
         )
 
     loan.state = LoanState.REJECTED.value
     loan.save()
 
-    return Response(
-        {"message": "Loan request has been rejected"}, status=HTTP_200_OK
+    return ({"message": "Loan request has been rejected"}, HTTP_200_OK)
+
+
+# ---------------------------------------------------------------------------- #
+
+MAX_BULK_LOANS = 100
+
+VALIDATION_FIELDS = [
+    "days_to_expiration",
+    "funding_fee_atto_dai_per_dai",
+    "payment_fee_atto_dai_per_dai",
+]
+
+
+def _run_bulk(request, operation):
+    """
+    Apply an operation to each loan listed in a bulk request, in a single
+    transaction, and report the outcome for each of them.
+
+    The ``loans`` field lists either loan IDs or objects with an ``id`` field
+    and parameters of the operation. The operation is given the loan, or None
+    if it does not exist, and the item as an object, and returns the body and
+    status code that the single-loan view would answer with.
+    """
+
+    items = request.data.get("loans")
+
+    if not isinstance(items, list) or not 0 < len(items) <= MAX_BULK_LOANS:
+        return Response(
+            {
+                "error": f"Required field: loans, a list of 1 to {MAX_BULK_LOANS} loan IDs or objects with an id"
+            },
+            status=HTTP_400_BAD_REQUEST,
+        )
+
+    items = [item if isinstance(item, dict) else {"id": item} for item in items]
+
+    try:
+        ids = [int(item["id"]) for item in items]
+    except (KeyError, TypeError, ValueError):
+        return Response(
+            {"error": "Every loan must be given by an integer ID"},
+            status=HTTP_400_BAD_REQUEST,
+        )
+
+    with transaction.atomic():
+
+        loans = Loan.objects.select_for_update().in_bulk(ids)
+
+        results = []
+
+        for (id, item) in zip(ids, items):
+            body, status = operation(loans.get(id), item)
+            results.append({"id": id, "status": status, **body})
+
+    return Response({"results": results}, status=HTTP_200_OK)
+
+
+@api_view(["PUT"])
+@permission_classes((IsAdminUser,))
+def bulk_validate_loan_requests(request):
+    """
+    Validate several Loan Requests
+
+    The on-chain loans are created by jobs, which the job worker runs
+    concurrently.
+
+    Parameters
+    ----------
+    loans : list
+
+        Loan requests' identifiers, or objects with an ``id`` field and any of
+        the fields of ``validate_loan_request``.
+
+    days_to_expiration, funding_fee_atto_dai_per_dai, payment_fee_atto_dai_per_dai
+
+        Default values of the fields of ``validate_loan_request`` for the loan
+        requests that do not specify them.
+
+    Returns
+    -------
+    200
+        The ``results``, each with the loan request's ``id`` and the
+        ``status`` and fields ``validate_loan_request`` would answer with.
+
+    400
+        Loan requests are missing or not given by their identifiers.
+
+    """
+
+    defaults = {
+        f: request.data[f] for f in VALIDATION_FIELDS if f in request.data
+    }
+
+    return _run_bulk(
+        request,
+        lambda loan, item: _validate_loan_request(loan, {**defaults, **item}),
+    )
+
+
+@api_view(["PUT"])
+@permission_classes((IsAdminUser,))
+def bulk_reject_loan_requests(request):
+    """
+    Reject several Loan Requests
+
+    Parameters
+    ----------
+    loans : list
+
+        Loan requests' identifiers.
+
+    Returns
+    -------
+    200
+        The ``results``, each with the loan request's ``id`` and the
+        ``status`` and fields ``reject_loan_request`` would answer with.
+
+    400
+        Loan requests are missing or not given by their identifiers.
+
+    """
+
+    return _run_bulk(request, lambda loan, item: _reject_loan_request(loan))
+
+
+@api_view(["PUT"])
+@permission_classes((IsAdminUser,))
+def bulk_finalize_loans(request):
+    """
+    Finalize several Loans
+
+    Parameters
+    ----------
+    loans : list
+
+        Loans' identifiers.
+
+    Returns
+    -------
+    200
+        The ``results``, each with the loan's ``id`` and the ``status`` and
+        fields ``finalize_loan`` would answer with.
+
+    400
+        Loans are missing or not given by their identifiers.
+
+    """
+
+    return _run_bulk(request, lambda loan, item: _finalize_loan(loan))
+
+
+@api_view(["PUT"])
+@permission_classes((IsAdminUser,))
+def bulk_cancel_loans(request):
+    """
+    Cancel several Loans
+
+    Parameters
+    ----------
+    loans : list
+
+        Loans' identifiers.
+
+    Returns
+    -------
+    200
+        The ``results``, each with the loan's ``id`` and the ``status`` and
+        fields ``cancel_loan`` would answer with.
+
+    400
+        Loans are missing or not given by their identifiers.
+
+    """
+
+    return _run_bulk(
+        request, lambda loan, item: _cancel_loan(loan, request.user)
     )
 
 
+# ---------------------------------------------------------------------------- #
+
+
 @api_view(["GET"])
 @permission_classes((IsAuthenticated,))
+@conditional_view(Loan)
 def get_loan(request, id):
     """
     Get Loan with given ID
@@ -465,7 +788,8 @@ def get_loan(request, id):
     Returns
     -------
     200
-        Loan found with success.
+        Loan found with success, along with the number of the block its
+        on-chain state was read at.
 
     404
         Loan not found.
@@ -483,30 +807,39 @@ def get_loan(request, id):
         )
 
     loan_dict = loan.to_dict()
+    block_number = None
 
     if loan.state == LoanState.APPROVED.value:
-        fetched_loan = controller.loans.get_by_identifier(
-            LoanIdentifier(loan.identifier)
-        )
-        loan_state = fetched_loan.get_state()
-        loan_funding_fee = fetched_loan.funding_fee_atto_dai_per_dai
-        loan_payment_fee = fetched_loan.payment_fee_atto_dai_per_dai
+        chain_state = _get_chain_state(loan)
+        block_number = chain_state.block_number
 
-        loan_dict["state"] = loan_state.phase.name
+        if loan.token_contract_address is None:
+            # created before these attributes were stored, and not backfilled
+            fetched_loan = controller.loans.get_by_identifier(
+                LoanIdentifier(loan.identifier)
+            )
+            loan_dict["funding_fee_atto_dai_per_dai"] = str(
+                fetched_loan.funding_fee_atto_dai_per_dai
+            )
+            loan_dict["payment_fee_atto_dai_per_dai"] = str(
+                fetched_loan.payment_fee_atto_dai_per_dai
+            )
+            loan_dict["token_contract_address"] = str(
+                fetched_loan.token_contract_address
+            )
+
+        loan_dict["state"] = chain_state.phase
         loan_dict["funded_value_atto_dai"] = str(
-            loan_state.funded_value_atto_dai
-        )
-        loan_dict["funding_fee_atto_dai_per_dai"] = str(loan_funding_fee)
-        loan_dict["payment_fee_atto_dai_per_dai"] = str(loan_payment_fee)
-        loan_dict["current_value_atto_dai"] = _retrieve_current_price(
-            fetched_loan
+            chain_state.funded_value_atto_dai
         )
-        loan_dict["token_address"] = str(fetched_loan.token_contract_address)
+        loan_dict["current_value_atto_dai"] = chain_state.current_value_atto_dai
+        loan_dict["token_address"] = loan_dict["token_contract_address"]
 
     return Response(
         {
             "message": "Loan found with success",
             "loan": loan_dict,
+            "block_number": block_number,
         },
         status=HTTP_200_OK,
     )
@@ -530,26 +863,32 @@ def get_personal_loans(request):
 
     user = request.user
 
-    loan_list = Loan.objects.filter(student=user)
+    loan_list = Loan.objects.filter(student=user).select_related("chain_state")
     result = []
 
+    chain_states = _get_chain_states(
+        [obj for obj in loan_list if obj.state == LoanState.APPROVED.value],
+        "phase",
+        "current_value_atto_dai",
+        "funded_value_atto_dai",
+    )
+
     for obj in loan_list:
 
         loan_dict = obj.to_dict()
 
         if obj.state == LoanState.APPROVED.value:
-            fetched_loan = controller.loans.get_by_identifier(
-                LoanIdentifier(obj.identifier)
+            chain_state = chain_states[obj.id]
+
+            loan_dict["state"] = chain_state.phase
+            loan_dict[
+                "current_value_atto_dai"
+            ] = chain_state.current_value_atto_dai
+            loan_dict["funded_value_atto_dai"] = int(
+                chain_state.funded_value_atto_dai
             )
-            state = fetched_loan.get_state()
-
-            loan_dict["state"] = state.phase.name
-            loan_dict["current_value_atto_dai"] = _retrieve_current_price(
-                fetched_loan
-            )
-            loan_dict["funded_value_atto_dai"] = state.funded_value_atto_dai
-            loan_dict["token_address"] = str(
-                fetched_loan.token_contract_address
+            loan_dict["token_address"] = (
+                obj.token_contract_address or chain_state.token_contract_address
             )
         result.append(loan_dict)
 
@@ -563,37 +902,127 @@ def get_personal_loans(request):
     )
 
 
+LOAN_SORT_KEYS = {
+    "id": ("id",),
+    "-id": ("-id",),
+    "requested_value_atto_dai": ("requested_value_atto_dai", "id"),
+    "-requested_value_atto_dai": ("-requested_value_atto_dai", "-id"),
+}
+
+
+def _get_loan_sort_key(request):
+
+    sort = request.query_params.get("sort", "id")
+
+    if sort not in LOAN_SORT_KEYS:
+        raise ParseError(f"Invalid sort, must be one of {list(LOAN_SORT_KEYS)}")
+
+    return LOAN_SORT_KEYS[sort]
+
+
+def _filter_by_requested_value(request, loans):
+    """
+    Keep the loans within the range of requested values given by the
+    ``min_requested_value_atto_dai`` and ``max_requested_value_atto_dai`` query
+    parameters, if any.
+    """
+
+    for parameter, lookup in [
+        ("min_requested_value_atto_dai", "gte"),
+        ("max_requested_value_atto_dai", "lte"),
+    ]:
+        if parameter in request.query_params:
+            try:
+                value = _parse_atto_dai(request.query_params[parameter])
+            except ValueError as e:
+                raise ParseError(f"Invalid {parameter}: {e}")
+            loans = loans.filter(
+                **{f"requested_value_atto_dai__{lookup}": value}
+            )
+
+    return loans
+
+
+def _parse_atto_dai(value):
+
+    # only whole numbers, given as strings or integers, as they may not fit
+    # in a double
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError("Expected a whole number of atto-Dai")
+
+    value = int(value)
+
+    if not 0 <= value <= MAX_ATTO_DAI:
+        raise ValueError(f"Expected a value between 0 and {MAX_ATTO_DAI}")
+
+    return value
+
+
 @api_view(["GET"])
 @permission_classes((IsAuthenticated,))
+@conditional_view(Loan, cacheable=True)
 def get_all_loans(request):
     """
-    Get all loans
+    Get all loans, by page
 
     Parameters
     ----------
+    min_requested_value_atto_dai : string, optional
+
+        Only list loans requesting at least this many atto-Dai.
+
+    max_requested_value_atto_dai : string, optional
+
+        Only list loans requesting at most this many atto-Dai.
+
+    sort : string, optional
+
+        "id", the default, or "requested_value_atto_dai", either prefixed with
+        "-" for descending order.
+
+    cursor : string, optional
+
+        Position of the page, from the ``next`` link of the previous one.
+
+    page_size : integer, optional
+
+        Number of loans per page.
 
     Returns
     -------
     200
-        All Loans fetched with success.
+        Loans fetched with success, along with the ``next`` page's link.
+
+    400
+        Invalid requested value range or sort.
 
     """
 
-    loan_list = Loan.objects.all()
+    page = paginate(
+        request,
+        _filter_by_requested_value(
+            request, Loan.objects.select_related("chain_state")
+        ),
+        _get_loan_sort_key(request),
+    )
+    loan_list = page.items
     result = []
 
+    chain_states = _get_chain_states(
+        [obj for obj in loan_list if obj.state == LoanState.APPROVED.value],
+        "phase",
+        "current_value_atto_dai",
+    )
+
     for obj in loan_list:
         loan_dict = obj.to_dict()
         if obj.state == LoanState.APPROVED.value:
-            fetched_loan = controller.loans.get_by_identifier(
-                LoanIdentifier(obj.identifier)
-            )
-            phase = fetched_loan.get_state().phase
+            chain_state = chain_states[obj.id]
 
-            loan_dict["state"] = phase.name
-            loan_dict["current_value_atto_dai"] = _retrieve_current_price(
-                fetched_loan
-            )
+            loan_dict["state"] = chain_state.phase
+            loan_dict[
+                "current_value_atto_dai"
+            ] = chain_state.current_value_atto_dai
         result.append(loan_dict)
 
     return Response(
@@ -601,6 +1030,7 @@ def get_all_loans(request):
             "message": "Loan fetched with success",
             "loans": result,
             "count": len(result),
+            "next": page.next_link,
         },
         status=HTTP_200_OK,
     )
@@ -610,38 +1040,79 @@ def get_all_loans(request):
 @permission_classes((IsAuthenticated,))
 def get_operating_loans(request):
     """
-    Get all operating loans
+    Get all operating loans, by page
 
     Parameters
     ----------
+    min_requested_value_atto_dai : string, optional
+
+        Only list loans requesting at least this many atto-Dai.
+
+    max_requested_value_atto_dai : string, optional
+
+        Only list loans requesting at most this many atto-Dai.
+
+    sort : string, optional
+
+        "id", the default, or "requested_value_atto_dai", either prefixed with
+        "-" for descending order.
+
+    cursor : string, optional
+
+        Position of the page, from the ``next`` link of the previous one.
+
+    page_size : integer, optional
+
+        Number of loans per page.
 
     Returns
     -------
     200
-        All operating Loans fetched with success.
+        Operating Loans fetched with success, along with the ``next`` page's
+        link.
+
+    400
+        Invalid requested value range or sort.
 
     """
 
     q = Loan.objects.exclude(state=LoanState.WITHDRAWN.value)
-    loan_list = q.exclude(state=LoanState.REJECTED.value)
+    q = q.exclude(state=LoanState.REJECTED.value)
+    q = q.exclude(
+        get_phase_condition(LoanPhase.CANCELED.name)
+        | get_phase_condition(LoanPhase.EXPIRED.name)
+    )
+
+    page = paginate(
+        request,
+        _filter_by_requested_value(request, q.select_related("chain_state")),
+        _get_loan_sort_key(request),
+    )
+    loan_list = page.items
 
     result = []
 
+    chain_states = _get_chain_states(
+        [obj for obj in loan_list if obj.state == LoanState.APPROVED.value],
+        "phase",
+        "current_value_atto_dai",
+    )
+
     for obj in loan_list:
         loan_dict = obj.to_dict()
         if obj.state != LoanState.APPROVED.value:
             result.append(loan_dict)
         else:
-            fetched_loan = controller.loans.get_by_identifier(
-                LoanIdentifier(obj.identifier)
-            )
-            phase = fetched_loan.get_state().phase
-
-            if phase not in [LoanPhase.CANCELED, LoanPhase.EXPIRED]:
-                loan_dict["state"] = phase.name
-                loan_dict["current_value_atto_dai"] = _retrieve_current_price(
-                    fetched_loan
-                )
+            chain_state = chain_states[obj.id]
+
+            if chain_state.phase not in [
+                LoanPhase.CANCELED.name,
+                LoanPhase.EXPIRED.name,
+            ]:
+                loan_dict["state"] = chain_state.phase
+                loan_dict[
+                    "current_value_atto_dai"
+                ] = chain_state.current_value_atto_dai
                 result.append(loan_dict)
 
     return Response(
@@ -649,6 +1120,7 @@ def get_operating_loans(request):
             "message": "Loans fetched with success",
             "loans": result,
             "count": len(result),
+            "next": page.next_link,
         },
         status=HTTP_200_OK,
     )
@@ -658,7 +1130,8 @@ def get_operating_loans(request):
 @permission_classes((IsAuthenticated,))
 def get_specific_state_loans(request, state, user_info):
     """
-    Get all loans at a given state with respective user_info, if requested.
+    Get all loans at a given state with respective user_info, if requested,
+    by page.
 
     Parameters
     ----------
@@ -670,10 +1143,35 @@ def get_specific_state_loans(request, state, user_info):
 
         Flag that tells if information about user should be used or not.
 
+    min_requested_value_atto_dai : string, optional
+
+        Only list loans requesting at least this many atto-Dai.
+
+    max_requested_value_atto_dai : string, optional
+
+        Only list loans requesting at most this many atto-Dai.
+
+    sort : string, optional
+
+        "id", the default, or "requested_value_atto_dai", either prefixed with
+        "-" for descending order.
+
+    cursor : string, optional
+
+        Position of the page, from the ``next`` link of the previous one.
+
+    page_size : integer, optional
+
+        Number of loans per page.
+
     Returns
     -------
     200
-        Loans at given state fetched with success.
+        Loans at given state fetched with success, along with the ``next``
+        page's link.
+
+    400
+        Invalid requested value range or sort.
 
     404
         Loans at given state doesn't exist.
@@ -681,33 +1179,49 @@ def get_specific_state_loans(request, state, user_info):
 
     """
     if state in LoanState.__members__:
-        loan_list = Loan.objects.filter(state=getattr(LoanState, state).value)
-        result = [obj.to_dict() for obj in loan_list]
+        page = paginate(
+            request,
+            _filter_by_requested_value(
+                request,
+                Loan.objects.filter(
+                    state=getattr(LoanState, state).value
+                ).select_related("student__profile"),
+            ),
+            _get_loan_sort_key(request),
+        )
+        loans = page.items
+        result = [obj.to_dict() for obj in loans]
 
     elif state in LoanPhase.__members__:
-        identifiers_list = [
-            loan.identifier
-            for loan in controller.loans.get_all()
-            if loan.get_state().phase == getattr(LoanPhase, state)
-        ]
+        page = paginate(
+            request,
+            _filter_by_requested_value(
+                request,
+                filter_by_phase(
+                    Loan.objects.filter(state=LoanState.APPROVED.value), state
+                ).select_related("chain_state", "student__profile"),
+            ),
+            _get_loan_sort_key(request),
+        )
+        loans = page.items
+
+        chain_states = _get_chain_states(
+            loans, "funded_value_atto_dai", "current_value_atto_dai"
+        )
 
         result = []
 
-        for identifier in identifiers_list:
-            funded_value = (
-                controller.loans.get_by_identifier(identifier)
-                .get_state()
-                .funded_value_atto_dai
-            )
-            loan = Loan.objects.filter(identifier=identifier).first()
+        for loan in loans:
+            chain_state = chain_states[loan.id]
             loan_dict = loan.to_dict()
-            fetched_loan = controller.loans.get_by_identifier(identifier)
 
             loan_dict["state"] = state
-            loan_dict["funded_value_atto_dai"] = str(funded_value)
-            loan_dict["current_value_atto_dai"] = _retrieve_current_price(
-                fetched_loan
+            loan_dict["funded_value_atto_dai"] = str(
+                chain_state.funded_value_atto_dai
             )
+            loan_dict[
+                "current_value_atto_dai"
+            ] = chain_state.current_value_atto_dai
             result.append(loan_dict)
 
     else:
@@ -716,16 +1230,172 @@ def get_specific_state_loans(request, state, user_info):
         )
 
     if user_info:
-        for obj in result:
-            profile = Profile.objects.filter(user=obj["student"]).first()
-            obj["user_full_name"] = profile.user.get_full_name()
-            obj["user_profile_pic"] = profile.profile_pic
+        for loan, obj in zip(loans, result):
+            obj["user_full_name"] = loan.student.get_full_name()
+            obj["user_profile_pic"] = loan.student.profile.profile_pic
 
     return Response(
         {
             "message": "Loans fetched with success",
             "loans": result,
             "count": len(result),
+            "next": page.next_link,
+        },
+        status=HTTP_200_OK,
+    )
+
+
+MAX_HISTOGRAM_BUCKETS = 100
+
+
+@api_view(["GET"])
+@permission_classes((IsAuthenticated,))
+@conditional_view(Loan, cacheable=True)
+def get_loan_value_statistics(request):
+    """
+    Get the count, total, average, minimum and maximum of the values requested
+    by loans, overall and by state, and their histogram.
+
+    Parameters
+    ----------
+    state : string, optional
+
+        Only consider loans at this state.
+
+    min_requested_value_atto_dai : string, optional
+
+        Only consider loans requesting at least this many atto-Dai.
+
+    max_requested_value_atto_dai : string, optional
+
+        Only consider loans requesting at most this many atto-Dai.
+
+    buckets : integer, optional
+
+        Number of buckets of the histogram, which split the range of requested
+        values in equal parts. Defaults to 10.
+
+    Returns
+    -------
+    200
+        Statistics computed with success.
+
+    400
+        Invalid requested value range or number of buckets.
+
+    404
+        Unexistent Loan State.
+
+    """
+
+    loans = _filter_by_requested_value(request, Loan.objects.all())
+
+    state = request.query_params.get("state")
+
+    if state is not None:
+        if state not in LoanState.__members__:
+            return Response(
+                {"error": "Unexistent Loan State"}, status=HTTP_404_NOT_FOUND
+            )
+        loans = loans.filter(state=getattr(LoanState, state).value)
+
+    try:
+        bucket_count = int(request.query_params.get("buckets", 10))
+    except ValueError as e:
+        return Response({"error": str(e)}, status=HTTP_400_BAD_REQUEST)
+
+    if not 1 <= bucket_count <= MAX_HISTOGRAM_BUCKETS:
+        return Response(
+            {
+                "error": "The number of buckets must be between 1 and "
+                f"{MAX_HISTOGRAM_BUCKETS}"
+            },
+            status=HTTP_400_BAD_REQUEST,
+        )
+
+    return Response(
+        {
+            "message": "Statistics computed with success",
+            **get_value_statistics(loans, bucket_count),
+        },
+        status=HTTP_200_OK,
+    )
+
+
+def _parse_timestamp(value):
+    if value is None:
+        return None
+    return datetime.fromtimestamp(int(value), tz=timezone.utc)
+
+
+@api_view(["GET"])
+@permission_classes((IsAuthenticated,))
+def get_loan_price_history(request, id):
+    """
+    Get the market price history of a Loan, as open/high/low/close buckets.
+
+    Parameters
+    ----------
+    id : integer
+
+        Loan's identifier.
+
+    interval : integer (query parameter)
+
+        Length of each bucket, in seconds. Defaults to 3600.
+
+    start : integer (query parameter)
+
+        Unix time of the oldest snapshot to consider. Optional, defaults to
+        as many intervals before the end as can be returned.
+
+    end : integer (query parameter)
+
+        Unix time of the newest snapshot to consider. Optional, defaults to
+        now.
+
+    Returns
+    -------
+    200
+        Price history fetched with success.
+
+    400
+        Invalid interval, start or end, or a range of more than
+        MAX_OHLC_BUCKETS intervals.
+
+    404
+        Loan not found.
+
+    """
+
+    try:
+        interval = int(request.query_params.get("interval", 3600))
+        start = _parse_timestamp(request.query_params.get("start"))
+        end = _parse_timestamp(request.query_params.get("end"))
+    except (ValueError, OverflowError, OSError) as e:
+        return Response({"error": str(e)}, status=HTTP_400_BAD_REQUEST)
+
+    if interval <= 0:
+        return Response(
+            {"error": "The interval must be positive"},
+            status=HTTP_400_BAD_REQUEST,
+        )
+
+    if not Loan.objects.filter(id=id).exists():
+        return Response({"error": "Unexistent Loan"}, status=HTTP_404_NOT_FOUND)
+
+    try:
+        buckets = get_ohlc(id, interval, start, end)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=HTTP_400_BAD_REQUEST)
+
+    return Response(
+        {
+            "message": "Price history fetched with success",
+            "loan": id,
+            "interval": interval,
+            "buckets": buckets,
+            "count": len(buckets),
         },
         status=HTTP_200_OK,
     )
@@ -762,7 +1432,7 @@ def get_loan_unevaluated_docs(request, id):
         loan=loan, approved=False, rejected=False
     )
 
-    result = [doc.to_dict() for doc in documents]
+    result = serialize_documents(documents)
 
     return Response(
         {
@@ -806,7 +1476,7 @@ def get_loan_approved_public_docs(request, id):
         loan=loan, is_public=True, approved=True
     )
 
-    result = [doc.to_dict() for doc in documents]
+    result = serialize_documents(documents)
 
     return Response(
         {
@@ -851,7 +1521,7 @@ def get_loan_personal_docs(request, id):
             {"error": "Unexistent Loan Request"}, status=HTTP_404_NOT_FOUND
         )
 
-    if loan.student != user:
+    if loan.student_id != user.id:
         return Response(
             {"error": "Loan Request does not belong to logged user"},
             status=HTTP_403_FORBIDDEN,
@@ -859,7 +1529,7 @@ def get_loan_personal_docs(request, id):
 
     documents = Document.objects.filter(loan=id)
 
-    result = [doc.to_dict() for doc in documents]
+    result = serialize_documents(documents)
 
     return Response(
         {
@@ -876,23 +1546,36 @@ def get_loan_personal_docs(request, id):
 @permission_classes((IsAdminUser,))
 def get_all_unevaluated_documents(request):
     """
-    Get all unevaluated docs for all the Loans. ADMIN ONLY.
+    Get all unevaluated docs for all the Loans, by page. ADMIN ONLY.
+
+    Parameters
+    ----------
+    cursor : string, optional
+
+        Position of the page, from the ``next`` link of the previous one.
+
+    page_size : integer, optional
+
+        Number of documents per page.
 
     Returns
     -------
     200
-        Documents fetched with success
+        Documents fetched with success, along with the ``next`` page's link.
 
     """
-    documents = Document.objects.filter(approved=False, rejected=False)
+    page = paginate(
+        request, Document.objects.filter(approved=False, rejected=False), "id"
+    )
 
-    result = [doc.to_dict() for doc in documents]
+    result = serialize_documents(page.items)
 
     return Response(
         {
             "message": "Documents fetched with success",
             "documents": result,
             "count": len(result),
+            "next": page.next_link,
         },
         status=HTTP_200_OK,
     )
@@ -1059,3 +1742,21 @@ def upload_document(request, id):
         },
         status=HTTP_201_CREATED,
     )
+
+
+# ---------------------------------------------------------------------------- #
+# async variants of the read endpoints, for ASGI deployments
+
+get_loan_async = async_view(get_loan)
+get_personal_loans_async = async_view(get_personal_loans)
+get_all_loans_async = async_view(get_all_loans)
+get_operating_loans_async = async_view(get_operating_loans)
+get_specific_state_loans_async = async_view(get_specific_state_loans)
+get_loan_value_statistics_async = async_view(get_loan_value_statistics)
+get_loan_price_history_async = async_view(get_loan_price_history)
+get_loan_unevaluated_docs_async = async_view(get_loan_unevaluated_docs)
+get_loan_approved_public_docs_async = async_view(get_loan_approved_public_docs)
+get_loan_personal_docs_async = async_view(get_loan_personal_docs)
+get_all_unevaluated_documents_async = async_view(get_all_unevaluated_documents)
+
+# ---------------------------------------------------------------------------- #
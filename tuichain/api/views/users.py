@@ -7,6 +7,8 @@ from rest_framework.status import (
     HTTP_201_CREATED,
 )
 from tuichain.api.models import Profile
+from tuichain.api.pagination import paginate
+from tuichain.api.serializers import serialize_profiles
 from django.contrib.auth.models import User
 from rest_framework.permissions import *
 from rest_framework.decorators import api_view, permission_classes
@@ -90,27 +92,35 @@ def get_me(request):
 @permission_classes((IsAuthenticated,))
 def get_all(request):
     """
-    Get all users (public profile)
+    Get all users (public profile), by page
 
     Parameters
     ----------
+    cursor : string, optional
+
+        Position of the page, from the ``next`` link of the previous one.
+
+    page_size : integer, optional
+
+        Number of users per page.
 
     Returns
     -------
     200
-        Users fetched successfully.
+        Users fetched successfully, along with the ``next`` page's link.
 
     """
 
-    user_list = User.objects.all()
+    page = paginate(request, User.objects.all(), "id")
 
-    result = [user.profile.to_dict() for user in user_list]
+    result = serialize_profiles(page.items)
 
     return Response(
         {
             "message": "Users fetched with success",
             "users": result,
             "count": len(result),
+            "next": page.next_link,
         },
         status=HTTP_200_OK,
     )
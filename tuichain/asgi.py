@@ -13,4 +13,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tuichain.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported once Django is set up
+from tuichain.api.events import PATH, market_events  # noqa: E402
+
+
+async def application(scope, receive, send):
+
+    if scope["type"] == "http" and scope["path"] == PATH:
+        await market_events(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
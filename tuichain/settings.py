@@ -18,6 +18,9 @@ from dotenv import load_dotenv
 from os import environ
 import os
 from pathlib import Path
+import sys
+from requests import Session
+from requests.adapters import HTTPAdapter
 from tuichain_ethereum import Address, PrivateKey
 from web3 import HTTPProvider, IPCProvider, WebsocketProvider
 
@@ -74,6 +77,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    # Apps
+    "tuichain.api.middleware.BlockScopeMiddleware",
 ]
 
 ROOT_URLCONF = "tuichain.urls"
@@ -130,79 +135,72 @@ GCP_BUCKET_NAME = environ["GCP_BUCKET_NAME"]
 # ---------------------------------------------------------------------------- #
 # Ethereum
 
-eth_provider = environ["ETHEREUM_PROVIDER"]
+# whitespace-separated list of the URIs of nodes of the same chain, requests go
+# to the fastest healthy one
+
+eth_providers = environ["ETHEREUM_PROVIDER"].split()
 eth_master_acc = environ["ETHEREUM_MASTER_ACCOUNT_PRIVATE_KEY"]
 eth_controller_address = environ["ETHEREUM_CONTROLLER_ADDRESS"]
 
-if not eth_provider:
-
-    assert not eth_master_acc
-    assert not eth_controller_address
-
-    from eth_tester import EthereumTester
-    from tuichain_ethereum import Controller
-    from tuichain_ethereum.test import DaiMockContract
-    from web3 import EthereumTesterProvider, Web3
-    import eth_tester.backends.pyevm.main
+# maximum number of loans whose chain reads are in progress at once, across all
+# requests, 1 disables concurrent reads
 
-    eth_tester.backends.pyevm.main.GENESIS_GAS_LIMIT = 8_000_000
+ETHEREUM_MAX_CONCURRENCY = int(environ.get("ETHEREUM_MAX_CONCURRENCY", "32"))
 
-    # create test chain and generate master account
+# seconds between health and latency probes of each node, when there are several
 
-    chain = EthereumTester()
+ETHEREUM_PROBE_INTERVAL = float(environ.get("ETHEREUM_PROBE_INTERVAL", "5"))
 
-    ETHEREUM_PROVIDER = EthereumTesterProvider(chain)
+# percentile of the latest request durations after which read-only requests are
+# also sent to a second node, 0 disables hedging
 
-    # generate master account and transfer 100 thousand ether to it
+ETHEREUM_HEDGE_PERCENTILE = float(environ.get("ETHEREUM_HEDGE_PERCENTILE", "0"))
 
-    ETHEREUM_MASTER_ACCOUNT_PRIVATE_KEY = PrivateKey.random()
+# file the test chain is saved to and restored from, so that it survives
+# restarts, empty to create a new one in every process; the test runner always
+# gets a new one, and leaves the file alone
 
-    chain.add_account(bytes(ETHEREUM_MASTER_ACCOUNT_PRIVATE_KEY).hex())
+ETHEREUM_TEST_CHAIN_SNAPSHOT = environ.get("ETHEREUM_TEST_CHAIN_SNAPSHOT", "")
 
-    Web3(ETHEREUM_PROVIDER).eth.sendTransaction(
-        {
-            "from": chain.get_accounts()[0],
-            "to": str(ETHEREUM_MASTER_ACCOUNT_PRIVATE_KEY.address),
-            "value": Web3.toWei(100_000, "ether"),
-        }
-    )
+if sys.argv[1:2] == ["test"]:
+    ETHEREUM_TEST_CHAIN_SNAPSHOT = ""
 
-    # deploy mock Dai contract and mint 1 million Dai to master account
+if not eth_providers:
 
-    dai = DaiMockContract.deploy(
-        provider=ETHEREUM_PROVIDER,
-        account_private_key=ETHEREUM_MASTER_ACCOUNT_PRIVATE_KEY,
-    ).get()
-
-    dai.mint(
-        account_private_key=ETHEREUM_MASTER_ACCOUNT_PRIVATE_KEY,
-        atto_dai=1_000_000 * (10 ** 18),
-    ).get()
+    assert not eth_master_acc
+    assert not eth_controller_address
 
-    # deploy controller
+    from web3 import EthereumTesterProvider
+    from tuichain.test_chain import get_test_chain
 
-    controller = Controller.deploy(
-        provider=ETHEREUM_PROVIDER,
-        master_account_private_key=ETHEREUM_MASTER_ACCOUNT_PRIVATE_KEY,
-        dai_contract_address=dai.address,
-        market_fee_atto_dai_per_nano_dai=10 ** 7,
-    ).get()
+    (
+        chain,
+        ETHEREUM_MASTER_ACCOUNT_PRIVATE_KEY,
+        ETHEREUM_CONTROLLER_ADDRESS,
+    ) = get_test_chain(ETHEREUM_TEST_CHAIN_SNAPSHOT or None)
 
-    ETHEREUM_CONTROLLER_ADDRESS = controller.contract_address
+    ETHEREUM_PROVIDERS = [EthereumTesterProvider(chain)]
 
 else:
 
     assert eth_master_acc
     assert eth_controller_address
 
-    if eth_provider.startswith("http://") or eth_provider.startswith(
-        "https://"
-    ):
-        ETHEREUM_PROVIDER = HTTPProvider(eth_provider)
-    elif eth_provider.startswith("ws://"):
-        ETHEREUM_PROVIDER = WebsocketProvider(eth_provider)
-    else:
-        ETHEREUM_PROVIDER = IPCProvider(eth_provider)
+    def make_eth_provider(uri):
+
+        if uri.startswith("http://") or uri.startswith("https://"):
+            # keep-alive connections for every request that may run at once
+            session = Session()
+            session.mount(
+                uri, HTTPAdapter(pool_maxsize=ETHEREUM_MAX_CONCURRENCY)
+            )
+            return HTTPProvider(uri, session=session)
+        elif uri.startswith("ws://"):
+            return WebsocketProvider(uri)
+        else:
+            return IPCProvider(uri)
+
+    ETHEREUM_PROVIDERS = list(map(make_eth_provider, eth_providers))
 
     ETHEREUM_MASTER_ACCOUNT_PRIVATE_KEY = PrivateKey(
         bytes.fromhex(eth_master_acc)
@@ -210,6 +208,66 @@ else:
 
     ETHEREUM_CONTROLLER_ADDRESS = Address(eth_controller_address)
 
+# when enabled, views read loan states, sell positions and investments from
+# the tables maintained by the run_indexer management command
+
+ETHEREUM_INDEXER_ENABLED = {"True": True, "False": False}[
+    environ.get("ETHEREUM_INDEXER_ENABLED", "False")
+]
+
+ETHEREUM_INDEXER_START_BLOCK = int(
+    environ.get("ETHEREUM_INDEXER_START_BLOCK", "0")
+)
+
+# maximum number of RPC responses kept by the per-block read cache, 0 disables
+# the cache
+
+ETHEREUM_CACHE_MAX_ENTRIES = int(
+    environ.get("ETHEREUM_CACHE_MAX_ENTRIES", "10000")
+)
+
+# whether the chain reads of list endpoints are sent as JSON-RPC batches
+
+ETHEREUM_BATCH_REQUESTS = {"True": True, "False": False}[
+    environ.get("ETHEREUM_BATCH_REQUESTS", "True")
+]
+
+# whether queued on-chain writes are run by a thread of the web server instead
+# of the run_jobs management command, as they must be when using the test chain
+
+JOBS_RUN_IN_PROCESS = {"True": True, "False": False}[
+    environ.get("JOBS_RUN_IN_PROCESS", "False")
+]
+
+# maximum number of queued on-chain writes in flight at once
+
+JOBS_CONCURRENCY = int(environ.get("JOBS_CONCURRENCY", "8"))
+
+# ---------------------------------------------------------------------------- #
+# HTTP caching
+
+# seconds for which clients may reuse cacheable listings without revalidating
+
+HTTP_CACHE_MAX_AGE = int(environ.get("HTTP_CACHE_MAX_AGE", "5"))
+
+# ---------------------------------------------------------------------------- #
+# Pagination
+
+# default number of items per page of list endpoints, see
+# tuichain.api.pagination
+
+API_PAGE_SIZE = int(environ.get("API_PAGE_SIZE", "100"))
+
+# ---------------------------------------------------------------------------- #
+# Market events
+
+# seconds between checks for new market events by the poller shared by the
+# open streams of each process, see tuichain.api.events
+
+MARKET_EVENTS_POLL_INTERVAL = float(
+    environ.get("MARKET_EVENTS_POLL_INTERVAL", "1")
+)
+
 # ---------------------------------------------------------------------------- #
 # CORS
 
@@ -0,0 +1,221 @@
+# ---------------------------------------------------------------------------- #
+
+"""
+In-process test chain, used when ETHEREUM_PROVIDER is empty.
+
+Creating it means funding the master account and deploying the mock Dai
+contract and the controller, which every process importing the settings would
+otherwise repeat. Given a snapshot file, the chain is restored from it instead,
+along with the master account's key and the controller's address, and saved
+back to it when the process exits if new blocks were mined, so that loans
+created during development survive restarts. Delete the file to start over.
+
+Each process has a chain of its own, so the snapshot only suits a single
+process that mines blocks, such as the development server. A process does not
+save its chain if another one saved to the file since it was loaded, so that
+the blocks of the first to exit are kept, and those of the others are lost.
+"""
+
+# ---------------------------------------------------------------------------- #
+
+import atexit
+import os
+import pickle
+import warnings
+
+from eth.db.atomic import AtomicDB
+from eth.db.backends.memory import MemoryDB
+from eth_tester import EthereumTester
+from tuichain_ethereum import Address, Controller, PrivateKey
+from tuichain_ethereum.test import DaiMockContract
+from web3 import EthereumTesterProvider, Web3
+import eth_tester.backends.pyevm.main
+
+# ---------------------------------------------------------------------------- #
+
+SNAPSHOT_VERSION = 1
+
+# ---------------------------------------------------------------------------- #
+
+
+def get_test_chain(snapshot_path=None):
+    """
+    Create the test chain, or restore it from a snapshot.
+
+    Parameters
+    ----------
+    snapshot_path : str or None
+
+        File the chain is restored from if it exists, and saved to when the
+        process exits. None to create a new chain every time.
+
+    Returns
+    -------
+    tuple
+        The ``EthereumTester``, the master account's private key and the
+        controller's address.
+    """
+
+    eth_tester.backends.pyevm.main.GENESIS_GAS_LIMIT = 8_000_000
+
+    snapshot = _load(snapshot_path) if snapshot_path else None
+
+    if snapshot is None:
+        result = _create()
+        if snapshot_path:
+            _save(snapshot_path, *result)
+    else:
+        result = _restore(snapshot)
+
+    if snapshot_path:
+        atexit.register(
+            _save_if_changed,
+            snapshot_path,
+            _get_head(result[0]),
+            _get_modification_time(snapshot_path),
+            *result,
+        )
+
+    return result
+
+
+def _create():
+
+    chain = EthereumTester()
+    provider = EthereumTesterProvider(chain)
+
+    # generate master account and transfer 100 thousand ether to it
+
+    master_account_private_key = PrivateKey.random()
+
+    chain.add_account(bytes(master_account_private_key).hex())
+
+    Web3(provider).eth.sendTransaction(
+        {
+            "from": chain.get_accounts()[0],
+            "to": str(master_account_private_key.address),
+            "value": Web3.toWei(100_000, "ether"),
+        }
+    )
+
+    # deploy mock Dai contract and mint 1 million Dai to master account
+
+    dai = DaiMockContract.deploy(
+        provider=provider,
+        account_private_key=master_account_private_key,
+    ).get()
+
+    dai.mint(
+        account_private_key=master_account_private_key,
+        atto_dai=1_000_000 * (10 ** 18),
+    ).get()
+
+    # deploy controller
+
+    controller = Controller.deploy(
+        provider=provider,
+        master_account_private_key=master_account_private_key,
+        dai_contract_address=dai.address,
+        market_fee_atto_dai_per_nano_dai=10 ** 7,
+    ).get()
+
+    return (chain, master_account_private_key, controller.contract_address)
+
+
+def _restore(snapshot):
+
+    chain = EthereumTester()
+
+    # replace the new chain's blocks and state with those of the snapshot
+    backend = chain.backend
+    backend.chain = type(backend.chain)(
+        AtomicDB(MemoryDB(snapshot["database"]))
+    )
+
+    master_account_private_key = PrivateKey(
+        snapshot["master_account_private_key"]
+    )
+
+    chain.add_account(bytes(master_account_private_key).hex())
+
+    return (
+        chain,
+        master_account_private_key,
+        Address(snapshot["controller_address"]),
+    )
+
+
+# ---------------------------------------------------------------------------- #
+
+
+def _get_head(chain):
+    return chain.backend.chain.get_canonical_head().hash
+
+
+def _get_modification_time(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _load(path):
+
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, "rb") as file:
+            snapshot = pickle.load(file)
+        assert snapshot["version"] == SNAPSHOT_VERSION
+    except Exception as e:
+        warnings.warn(f"Ignoring unreadable test chain snapshot {path}: {e!r}")
+        return None
+
+    return snapshot
+
+
+def _save(path, chain, master_account_private_key, controller_address):
+
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        # copying a dict is atomic, even if another thread is sending to it
+        "database": dict(chain.backend.chain.chaindb.db.wrapped_db.kv_store),
+        "master_account_private_key": bytes(master_account_private_key),
+        "controller_address": str(controller_address),
+    }
+
+    # a process killed while writing must not leave a truncated file behind
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+
+    with open(temporary_path, "wb") as file:
+        pickle.dump(snapshot, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    os.replace(temporary_path, path)
+
+
+def _save_if_changed(
+    path,
+    head,
+    modification_time,
+    chain,
+    master_account_private_key,
+    controller_address,
+):
+
+    # processes that only read the chain, such as runserver's autoreloader,
+    # must not overwrite what others saved in the meantime
+    if _get_head(chain) == head:
+        return
+
+    if _get_modification_time(path) != modification_time:
+        warnings.warn(
+            f"Not saving the test chain to {path}, which another process "
+            f"saved its own chain to in the meantime"
+        )
+        return
+
+    _save(path, chain, master_account_private_key, controller_address)
+
+
+# ---------------------------------------------------------------------------- #
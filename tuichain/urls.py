@@ -8,6 +8,7 @@ from tuichain.api.views import (
     auth,
     users,
     investments,
+    jobs,
     loans,
     external,
     blockchain,
@@ -51,6 +52,10 @@ urlpatterns = [
     path("api/users/update_profile/", users.update_profile),
     # BLOCKCHAIN ROUTES
     path("api/tuichain/get_info/", blockchain.get_blockchain_info),
+    path("api/tuichain/get_cache_stats/", blockchain.get_cache_stats),
+    path("api/tuichain/get_provider_stats/", blockchain.get_provider_stats),
+    # JOB ROUTES
+    path("api/jobs/get/<int:id>/", jobs.get_job),
     # EXTERNAL ROUTES
     path(
         "api/external/create_verification_intent/",
@@ -81,6 +86,13 @@ urlpatterns = [
     ),
     path("api/loans/finalize/<int:id>/", loans.finalize_loan),
     path("api/loans/reject/<int:id>/", loans.reject_loan_request),
+    path(
+        "api/loans/bulk/validate/",
+        loans.bulk_validate_loan_requests,
+    ),
+    path("api/loans/bulk/reject/", loans.bulk_reject_loan_requests),
+    path("api/loans/bulk/finalize/", loans.bulk_finalize_loans),
+    path("api/loans/bulk/cancel/", loans.bulk_cancel_loans),
     path(
         "api/loans/get_personal/",
         loans.get_personal_loans,
@@ -92,6 +104,11 @@ urlpatterns = [
         loans.get_specific_state_loans,
     ),
     path("api/loans/get/<int:id>/", loans.get_loan),
+    path("api/loans/get_value_statistics/", loans.get_loan_value_statistics),
+    path(
+        "api/loans/get_price_history/<int:id>/",
+        loans.get_loan_price_history,
+    ),
     path("api/loans/cancel/<int:id>/", loans.cancel_loan),
     path(
         "api/loans/user_withdraw/<int:id>/",
@@ -164,6 +181,51 @@ urlpatterns = [
         market_transactions.update_sell_position_price,
     ),
     path("api/market/transactions/purchase/", market_transactions.purchase),
+    # ASYNC READ ROUTES (same as the above, for ASGI deployments)
+    path(
+        "api/async/investments/get_personal/<str:user_addr>/",
+        investments.get_personal_investments_async,
+    ),
+    path(
+        "api/async/investments/get/<int:id>/<str:user_addr>/",
+        investments.get_investment_async,
+    ),
+    path(
+        "api/async/investments/get/<int:id>/",
+        investments.get_general_investments_async,
+    ),
+    path("api/async/loans/get_personal/", loans.get_personal_loans_async),
+    path("api/async/loans/get_all/", loans.get_all_loans_async),
+    path("api/async/loans/get_operating/", loans.get_operating_loans_async),
+    path(
+        "api/async/loans/get_state/<str:state>/<int:user_info>/",
+        loans.get_specific_state_loans_async,
+    ),
+    path("api/async/loans/get/<int:id>/", loans.get_loan_async),
+    path(
+        "api/async/loans/get_value_statistics/",
+        loans.get_loan_value_statistics_async,
+    ),
+    path(
+        "api/async/loans/get_price_history/<int:id>/",
+        loans.get_loan_price_history_async,
+    ),
+    path(
+        "api/async/loans/documents/get_unevaluated_docs/<int:id>/",
+        loans.get_loan_unevaluated_docs_async,
+    ),
+    path(
+        "api/async/loans/documents/get_approved_public_docs/<int:id>/",
+        loans.get_loan_approved_public_docs_async,
+    ),
+    path(
+        "api/async/loans/documents/get_personal_docs/<int:id>/",
+        loans.get_loan_personal_docs_async,
+    ),
+    path(
+        "api/async/loans/documents/get_all_unevaluated/",
+        loans.get_all_unevaluated_documents_async,
+    ),
     # DOCUMENTATION ROUTES
     re_path(r"^api/docs/", include_docs_urls(title="Tuichain API")),
     #    re_path(